@@ -11,7 +11,8 @@ app.use(cors({
     origin: 'http://localhost:4200',
     credentials: true,
     methods: ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
-    allowedHeaders: ['Content-Type', 'Authorization']
+    allowedHeaders: ['Content-Type', 'Authorization', 'If-None-Match'],
+    exposedHeaders: ['ETag', 'X-Proximo-Cursor']
 }));
 
 app.use(bodyParser.json());
@@ -54,15 +55,38 @@ app.post("/leiloes", async (req, res) => {
 app.get("/leiloes/ativos", async (req, res) => {
     try {
         const url = `${LEILAO_MS_URL}/leiloes/ativos`;
-        const resp = await axios.get(url, { timeout: 5000 });
+        const headers = {};
+        if (req.get('If-None-Match')) {
+            headers['If-None-Match'] = req.get('If-None-Match');
+        }
+        const resp = await axios.get(url, {
+            timeout: 5000,
+            params: req.query,
+            headers,
+            validateStatus: status => (status >= 200 && status < 300) || status === 304
+        });
 
-        const results = Array.isArray(resp.data)
+        // repassa a ETag do MS leilão para que o polling receba 304
+        if (resp.headers.etag) {
+            res.set('ETag', resp.headers.etag);
+        }
+        if (resp.headers['x-proximo-cursor']) {
+            res.set('X-Proximo-Cursor', resp.headers['x-proximo-cursor']);
+        }
+        if (resp.status === 304) {
+            return res.status(304).end();
+        }
+
+        // com projeção de campos (?campos=) a lista já vem no formato pedido
+        const results = Array.isArray(resp.data) && !req.query.campos
             ? resp.data.map(l => ({
                 id: l.id || l.leilaoId,
                 nome: l.nome || l.descricao || l.id,
                 descricao: l.descricao || null,
                 valorInicial: l.valorInicial || l.valor_inicial || l.valor || null,
                 ultimoLance: l.ultimoLance || l.ultimo_lance || null,
+                lider: l.lider || null,
+                lances: l.lances || 0,
                 inicio: l.inicio || null,
                 fim: l.fim || null,
                 status: l.status || null
@@ -94,8 +118,16 @@ app.post("/lances", async (req, res) => {
             data: new Date().toISOString()
         };
 
+        // ?aguardar=1: o MS lance devolve o veredito (201/409) na resposta
         const url = `${LANCE_MS_URL}/lances`;
-        await axios.post(url, payload, { timeout: 5000 });
+        const resposta = await axios.post(url, payload, {
+            timeout: 5000,
+            params: req.query.aguardar ? { aguardar: req.query.aguardar } : undefined
+        });
+
+        if (resposta.status === 201) {
+            return res.status(201).json(resposta.data);
+        }
 
         return res.status(202).json({
             message: "Lance aceito para processamento",
@@ -103,6 +135,11 @@ app.post("/lances", async (req, res) => {
         });
     } catch (err) {
         if (err.response) {
+            // 409 (valor abaixo do atual ou lance invalidado) e 429 (limite
+            // de lances) vêm do MS lance
+            if (err.response.headers["retry-after"]) {
+                res.set("Retry-After", err.response.headers["retry-after"]);
+            }
             return res.status(err.response.status).json(err.response.data);
         }
 
@@ -113,6 +150,19 @@ app.post("/lances", async (req, res) => {
     }
 });
 
+// leilões mais disputados, do cache de preços do MS leilão
+app.get("/leiloes/quentes", async (req, res) => {
+    try {
+        const resp = await axios.get(`${LEILAO_MS_URL}/leiloes/quentes`, { timeout: 5000, params: req.query });
+        return res.json(resp.data);
+    } catch (err) {
+        if (err.response) {
+            return res.status(err.response.status).json(err.response.data);
+        }
+        return res.status(503).json({ error: "Serviço de leilões indisponível", message: err.message });
+    }
+});
+
 app.get("/sse/:usuarioId", (req, res) => {
     const usuarioId = req.params.usuarioId;
 
@@ -1,14 +1,53 @@
 const amqp = require('amqplib');
 const sse = require('./sse_interests');
 
-const RABBITMQ_URL = "amqp://localhost";
+const RABBITMQ_URL = process.env.RABBITMQ_URL || "amqp://localhost";
+const HEARTBEAT = Number(process.env.RABBITMQ_HEARTBEAT || 30);
+const BACKOFF_INICIAL = 500;
+const BACKOFF_MAXIMO = 30000;
+
+// Se a conexão cair, reconecta com backoff exponencial e redeclara tudo:
+// as filas exclusivas do gateway somem junto com a conexão antiga.
+let backoff = BACKOFF_INICIAL;
+let reconexaoAgendada = false;
+
+function agendarReconexao() {
+    if (reconexaoAgendada) {
+        return;
+    }
+    reconexaoAgendada = true;
+    console.error(`Reconectando ao RabbitMQ em ${backoff} ms`);
+    setTimeout(() => {
+        reconexaoAgendada = false;
+        conectarRabbitMQ();
+    }, backoff);
+    backoff = Math.min(backoff * 2, BACKOFF_MAXIMO);
+}
 
 async function conectarRabbitMQ() {
     try {
-        const connection = await amqp.connect(RABBITMQ_URL);
+        const connection = await amqp.connect(RABBITMQ_URL, { heartbeat: HEARTBEAT });
+        
+        connection.on('error', (err) => {
+            console.error('Erro na conexão:', err.message);
+        });
+        
+        connection.on('close', agendarReconexao);
+        
         const channel = await connection.createChannel();
         
-        await channel.assertExchange('leilao', 'direct', { durable: false });
+        channel.on('error', (err) => {
+            console.error('Erro no canal:', err.message);
+        });
+        
+        // Canal fechado pelo broker (ex.: erro de declaração): derruba a
+        // conexão para passar pela reconexão
+        channel.on('close', () => {
+            connection.close().catch(() => {});
+        });
+        
+        // Exchanges duráveis, iguais às declaradas pelos MS
+        await channel.assertExchange('leilao', 'direct', { durable: true });
         
         // Consumir lance_validado
         const queueValidado = await channel.assertQueue('', { exclusive: true });
@@ -124,18 +163,12 @@ async function conectarRabbitMQ() {
                 channel.ack(msg);
             }
         }, { noAck: false });
-                
-        connection.on('error', (err) => {
-            console.error('Erro na conexão:', err.message);
-        });
-        
-        connection.on('close', () => {
-            setTimeout(conectarRabbitMQ, 5000);
-        });
         
+        backoff = BACKOFF_INICIAL;
+        console.log('Conectado ao RabbitMQ');
     } catch (error) {
         console.error(' Erro ao conectar:', error.message);
-        setTimeout(conectarRabbitMQ, 5000);
+        agendarReconexao();
     }
 }
 
@@ -0,0 +1,59 @@
+import heapq
+import itertools
+import threading
+import time
+
+# Agenda funções para instantes absolutos (epoch, como time.time()). Os eventos
+# ficam num min-heap e a thread dorme só até o próximo prazo, então o custo
+# não depende de quantos leilões já existiram.
+
+
+class Agendador:
+    def __init__(self):
+        self._eventos = []
+        self._sequencia = itertools.count()
+        self._condicao = threading.Condition()
+        self._rodando = True
+
+    def agendar(self, instante, funcao, *args):
+        with self._condicao:
+            evento = (instante, next(self._sequencia), funcao, args)
+            heapq.heappush(self._eventos, evento)
+            # Só acorda a thread se o novo evento passou a ser o mais próximo
+            if self._eventos[0] is evento:
+                self._condicao.notify()
+
+    def pendentes(self):
+        with self._condicao:
+            return len(self._eventos)
+
+    def parar(self):
+        with self._condicao:
+            self._rodando = False
+            self._condicao.notify()
+
+    def executar(self):
+        while True:
+            with self._condicao:
+                while self._rodando:
+                    if not self._eventos:
+                        self._condicao.wait()
+                        continue
+                    espera = self._eventos[0][0] - time.time()
+                    if espera <= 0:
+                        break
+                    self._condicao.wait(espera)
+
+                if not self._rodando:
+                    return
+
+                agora = time.time()
+                vencidos = []
+                while self._eventos and self._eventos[0][0] <= agora:
+                    vencidos.append(heapq.heappop(self._eventos))
+
+            for _, _, funcao, args in vencidos:
+                try:
+                    funcao(*args)
+                except Exception as e:
+                    print(f"Erro no evento agendado {funcao.__name__}{args}: {e}")
@@ -0,0 +1,366 @@
+import argparse
+import collections
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+import pika
+
+import codec
+import runtime_amqp
+
+# Teste de carga ponta a ponta: lance -> lance_validado -> notificacoes_leilao.
+# No fim, mede também do leilao_finalizado até o leilao_vencedor de cada leilão.
+#
+#   python benchmark.py --lances 20000 --taxa 2000 --leiloes 100 --assimetria 1.1
+#
+# Com --broker memoria (padrão) o ms_lance e o ms_notif rodam neste processo
+# sobre o broker_memoria, sem RabbitMQ nem rede; é o modo usado no CI. Com
+# --broker rabbitmq os MS precisam estar rodando e os lances vão para --url.
+#
+# As latências são medidas a partir do instante em que cada lance deveria ter
+# sido enviado (carga em malha aberta), então uma fila no envio também conta.
+
+
+def argumentos():
+    parser = argparse.ArgumentParser(description="Benchmark do fluxo de lances")
+    parser.add_argument('--broker', choices=['memoria', 'rabbitmq'], default='memoria')
+    parser.add_argument('--entrada', choices=['http', 'fila'], default='http',
+                        help="POST /lances ou publicação direta em lance_realizado")
+    parser.add_argument('--url', default='http://localhost:5001/lances')
+    parser.add_argument('--aguardar', action='store_true',
+                        help="POST /lances?aguardar=1: o veredito vem na resposta (só com --entrada http)")
+    parser.add_argument('--host', default='localhost', help="host do RabbitMQ")
+    parser.add_argument('--lances', type=int, default=10000)
+    parser.add_argument('--taxa', type=float, default=1000, help="lances/s (0 = sem limite)")
+    parser.add_argument('--concorrencia', type=int, default=4, help="threads de envio")
+    parser.add_argument('--leiloes', type=int, default=50)
+    parser.add_argument('--assimetria', type=float, default=0.0,
+                        help="expoente zipf da escolha do leilão (0 = uniforme)")
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--espera', type=float, default=30, help="segundos para drenar após o envio")
+    parser.add_argument('--diario', default='', help="LANCE_DIARIO do ms_lance embutido (vazio = sem diário)")
+    parser.add_argument('--json', help="grava o resultado neste arquivo")
+    parser.add_argument('--max-p99', type=float, help="falha (código 1) se o p99 até a notificação passar disso, em ms")
+    return parser.parse_args()
+
+
+def gerar_lances(args, leiloes):
+    # Sequência determinística: leilão escolhido por zipf, valor crescente
+    # por leilão, user_id único para casar o lance com os eventos
+    aleatorio = random.Random(args.semente)
+    pesos = [1 / (k + 1) ** args.assimetria for k in range(len(leiloes))]
+    escolhidos = aleatorio.choices(leiloes, weights=pesos, k=args.lances)
+
+    valores = dict.fromkeys(leiloes, 0)
+    lances = []
+    for numero, leilao_id in enumerate(escolhidos):
+        valores[leilao_id] += 1
+        lances.append({
+            "id": numero,
+            "leilaoId": leilao_id,
+            "usuarioId": f"bench-{numero}",
+            "valor": valores[leilao_id]
+        })
+    return lances
+
+
+def percentis(amostras):
+    if not amostras:
+        return None
+    ordenadas = sorted(amostras)
+
+    def p(q):
+        return ordenadas[min(len(ordenadas) - 1, int(q * len(ordenadas)))] * 1000
+
+    return {"p50": p(0.50), "p90": p(0.90), "p99": p(0.99), "max": ordenadas[-1] * 1000}
+
+
+class Medicao:
+    def __init__(self, lances):
+        self.enviados = {}
+        self.validados = {}
+        self.invalidados = {}
+        self.notificados = {}
+        self.vencedores = {}
+        self.erros_envio = 0
+        # 409/429 do POST /lances: resolvidos na própria resposta
+        self.recusados = 0
+
+        # Valores crescentes por leilão, na ordem em que foram gerados
+        self.pendentes_por_leilao = {}
+        for lance in lances:
+            self.pendentes_por_leilao.setdefault(lance['leilaoId'], collections.deque()).append(
+                (lance['valor'], lance['usuarioId'])
+            )
+
+    def resolvidos(self):
+        return len(self.notificados.keys() | self.invalidados.keys())
+
+    def registrar(self, destino, evento):
+        user_id = evento.get('user_id')
+        if user_id in self.enviados:
+            destino.setdefault(user_id, time.perf_counter())
+
+    def registrar_vencedor(self, evento):
+        self.vencedores.setdefault(evento.get('leilao_id'), time.perf_counter())
+
+    def registrar_notificacao(self, evento):
+        # O ms_notif agrupa os lances de uma janela: a notificação cobre todos
+        # os lances já enviados do leilão com valor até o dela
+        pendentes = self.pendentes_por_leilao.get(evento.get('leilao_id'))
+        if evento.get('tipo') != 'novo_lance' or not pendentes:
+            return
+        agora = time.perf_counter()
+        while pendentes and pendentes[0][0] <= evento.get('valor'):
+            _, user_id = pendentes.popleft()
+            if user_id in self.enviados:
+                self.notificados.setdefault(user_id, agora)
+
+
+def iniciar_servicos_embutidos(args):
+    os.environ['LANCE_PARTICOES'] = '1'
+    os.environ['LANCE_DIARIO'] = args.diario
+    # Os leilões do benchmark são publicados direto no fanout, sem MS leilão
+    os.environ['LEILAO_SNAPSHOT_URL'] = ''
+    # A carga mede o pipeline, não os limites por usuário/leilão
+    os.environ.setdefault('LANCE_LIMITE_USUARIO', '0')
+    os.environ.setdefault('LANCE_LIMITE_LEILAO', '0')
+
+    import broker_memoria
+    broker_memoria.instalar()
+
+    import ms_lance
+    import ms_notif
+
+    threading.Thread(target=ms_lance.rabbitmq_thread, daemon=True).start()
+    ms_lance.publicador.iniciar()
+
+    threading.Thread(target=ms_notif.consumidor.executar, daemon=True).start()
+    if not ms_notif.consumidor.aguardar_conexao(10):
+        raise RuntimeError("ms_notif não conectou ao broker em memória")
+
+    # Espera o ms_lance declarar as filas e registrar os consumidores
+    while ms_lance.lote is None:
+        time.sleep(0.01)
+    return ms_lance
+
+
+def iniciar_observador(args, leiloes, medicao):
+    # Filas exclusivas extras recebem uma cópia dos eventos; não competem com
+    # os consumidores dos MS
+    pronto = threading.Event()
+
+    def executar():
+        connection = pika.BlockingConnection(pika.ConnectionParameters(args.host))
+        channel = connection.channel()
+        runtime_amqp.declarar_exchanges(channel)
+
+        def observar(exchange, routing_keys, registrar):
+            fila = channel.queue_declare(queue='', exclusive=True).method.queue
+            for routing_key in routing_keys:
+                channel.queue_bind(exchange=exchange, queue=fila, routing_key=routing_key)
+
+            def callback(ch, method, properties, body):
+                registrar(codec.decodificar(body, properties))
+
+            channel.basic_consume(queue=fila, on_message_callback=callback, auto_ack=True)
+
+        observar('leilao', ['lance_validado'], lambda evento: medicao.registrar(medicao.validados, evento))
+        observar('leilao', ['lance_invalidado'], lambda evento: medicao.registrar(medicao.invalidados, evento))
+        observar('leilao', ['leilao_vencedor'], medicao.registrar_vencedor)
+        observar('notificacoes_leilao', [f'leilao_{leilao_id}' for leilao_id in leiloes], medicao.registrar_notificacao)
+        pronto.set()
+        channel.start_consuming()
+
+    threading.Thread(target=executar, daemon=True).start()
+    pronto.wait(10)
+
+
+def publicar_eventos_leilao(args, routing_key, leiloes):
+    connection = pika.BlockingConnection(pika.ConnectionParameters(args.host))
+    channel = connection.channel()
+    for leilao_id in leiloes:
+        if routing_key == 'leilao_iniciado':
+            channel.basic_publish(
+                exchange='leilao_iniciado', routing_key='',
+                body=json.dumps({"id": leilao_id, "nome": leilao_id, "status": "ativo"})
+            )
+        else:
+            channel.basic_publish(exchange='leilao', routing_key=routing_key, body=json.dumps({"id": leilao_id}))
+    connection.close()
+
+
+def criar_enviador(args, ms_lance):
+    # Um enviador por thread: nem o test_client do Flask nem o canal do pika
+    # são compartilhados
+    if args.entrada == 'http':
+        parametros = {'aguardar': '1'} if args.aguardar else {}
+        if ms_lance is not None:
+            cliente = ms_lance.app.test_client()
+            return lambda lance: cliente.post('/lances', json=lance, query_string=parametros).status_code
+
+        import requests
+        sessao = requests.Session()
+        return lambda lance: sessao.post(args.url, json=lance, params=parametros, timeout=10).status_code
+
+    connection = pika.BlockingConnection(pika.ConnectionParameters(args.host))
+    channel = connection.channel()
+
+    def enviar(lance):
+        body, properties = codec.codificar('lance_realizado', {
+            "id": lance['id'],
+            "leilao_id": lance['leilaoId'],
+            "user_id": lance['usuarioId'],
+            "valor": lance['valor'],
+            "timestamp": codec.agora()
+        })
+        channel.basic_publish(exchange='leilao', routing_key='lance_realizado', body=body, properties=properties)
+        return 202
+
+    return enviar
+
+
+def enviar_carga(args, ms_lance, lances, medicao):
+    proximo = iter(range(len(lances)))
+    trava = threading.Lock()
+    inicio = time.perf_counter() + 0.1
+
+    def trabalhador():
+        enviar = criar_enviador(args, ms_lance)
+        while True:
+            with trava:
+                numero = next(proximo, None)
+            if numero is None:
+                return
+
+            lance = lances[numero]
+            if args.taxa > 0:
+                previsto = inicio + numero / args.taxa
+                atraso = previsto - time.perf_counter()
+                if atraso > 0:
+                    time.sleep(atraso)
+            else:
+                previsto = time.perf_counter()
+
+            medicao.enviados[lance['usuarioId']] = previsto
+            try:
+                status = enviar(lance)
+                if status == 201:
+                    medicao.validados.setdefault(lance['usuarioId'], time.perf_counter())
+                elif status in (409, 429):
+                    medicao.recusados += 1
+                    medicao.invalidados.setdefault(lance['usuarioId'], time.perf_counter())
+                elif status != 202:
+                    medicao.erros_envio += 1
+            except Exception:
+                medicao.erros_envio += 1
+
+    threads = [threading.Thread(target=trabalhador, daemon=True) for _ in range(args.concorrencia)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return inicio
+
+
+def resumir(args, medicao, inicio, fim_envio, fechamento):
+    def latencias(destino):
+        return [
+            instante - medicao.enviados[user_id] for user_id, instante in destino.items()
+            if user_id not in medicao.invalidados
+        ]
+
+    ultimo = max(list(medicao.notificados.values()) + list(medicao.invalidados.values()), default=fim_envio)
+    duracao = max(ultimo - inicio, 1e-9)
+
+    return {
+        "parametros": {
+            "broker": args.broker, "entrada": args.entrada, "lances": args.lances,
+            "taxa": args.taxa, "concorrencia": args.concorrencia,
+            "leiloes": args.leiloes, "assimetria": args.assimetria, "semente": args.semente
+        },
+        "enviados": len(medicao.enviados),
+        "erros_envio": medicao.erros_envio,
+        "recusados": medicao.recusados,
+        "validados": len(medicao.validados),
+        "invalidados": len(medicao.invalidados),
+        "notificados": len(medicao.notificados),
+        "vencedores": len(medicao.vencedores),
+        "perdidos": len(medicao.enviados) - medicao.resolvidos(),
+        "vazao_envio": len(medicao.enviados) / max(fim_envio - inicio, 1e-9),
+        "vazao_notificacoes": len(medicao.notificados) / duracao,
+        "latencia_ms": {
+            "lance_validado": percentis(latencias(medicao.validados)),
+            "notificacao": percentis(latencias(medicao.notificados)),
+            "fechamento": percentis([instante - fechamento for instante in medicao.vencedores.values()])
+        }
+    }
+
+
+def imprimir(resultado):
+    print()
+    print(f"enviados {resultado['enviados']} (erros {resultado['erros_envio']}, recusados {resultado['recusados']}), "
+          f"validados {resultado['validados']}, invalidados {resultado['invalidados']}, "
+          f"notificados {resultado['notificados']}, perdidos {resultado['perdidos']}, "
+          f"vencedores {resultado['vencedores']}")
+    print(f"vazão: envio {resultado['vazao_envio']:.0f}/s, notificações {resultado['vazao_notificacoes']:.0f}/s")
+    for etapa, valores in resultado['latencia_ms'].items():
+        if valores is None:
+            print(f"{etapa:>15}: sem amostras")
+        else:
+            print(f"{etapa:>15}: p50 {valores['p50']:.2f} ms, p90 {valores['p90']:.2f} ms, "
+                  f"p99 {valores['p99']:.2f} ms, máx {valores['max']:.2f} ms")
+
+
+def main():
+    args = argumentos()
+
+    ms_lance = iniciar_servicos_embutidos(args) if args.broker == 'memoria' else None
+
+    execucao = uuid.uuid4().hex[:8]
+    leiloes = [f"bench-{execucao}-{numero}" for numero in range(args.leiloes)]
+    lances = gerar_lances(args, leiloes)
+    medicao = Medicao(lances)
+
+    iniciar_observador(args, leiloes, medicao)
+    publicar_eventos_leilao(args, 'leilao_iniciado', leiloes)
+    if ms_lance is not None:
+        while len(ms_lance.leiloes_ativos) < len(leiloes):
+            time.sleep(0.01)
+    else:
+        time.sleep(1)
+
+    inicio = enviar_carga(args, ms_lance, lances, medicao)
+    fim_envio = time.perf_counter()
+
+    limite = fim_envio + args.espera
+    while medicao.resolvidos() < len(medicao.enviados) and time.perf_counter() < limite:
+        time.sleep(0.05)
+
+    # Só os leilões com algum lance têm vencedor
+    com_lances = {lance['leilaoId'] for lance in lances}
+    fechamento = time.perf_counter()
+    publicar_eventos_leilao(args, 'leilao_finalizado', leiloes)
+    limite = fechamento + args.espera
+    while len(medicao.vencedores) < len(com_lances) and time.perf_counter() < limite:
+        time.sleep(0.01)
+
+    resultado = resumir(args, medicao, inicio, fim_envio, fechamento)
+    imprimir(resultado)
+    if args.json:
+        with open(args.json, 'w') as arquivo:
+            json.dump(resultado, arquivo, indent=2)
+
+    p99 = (resultado['latencia_ms']['notificacao'] or {}).get('p99')
+    if args.max_p99 is not None and (p99 is None or p99 > args.max_p99 or resultado['perdidos']):
+        print(f"Falhou: p99 {p99} ms (limite {args.max_p99} ms), {resultado['perdidos']} perdidos")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+import collections
+import heapq
+import itertools
+import threading
+import time
+from types import SimpleNamespace
+
+import pika
+import pika.exceptions
+import pika.spec
+
+# Substituto em memória do RabbitMQ para benchmarks e CI: implementa a parte
+# da API do pika.BlockingConnection que os MS usam (exchanges direct/fanout,
+# filas, bindings, basic_consume com prefetch, acks, transações e timers).
+# Todas as conexões de um processo compartilham o mesmo broker.
+#
+#   import broker_memoria
+#   broker_memoria.instalar()   # pika.BlockingConnection passa a usar o broker
+#
+# Limitações: nada é persistido, o prefetch vale por canal e não há
+# heartbeats, TTL nem dead-lettering.
+
+
+class BrokerMemoria:
+    def __init__(self):
+        self.condicao = threading.Condition()
+        self.exchanges = {'': 'direct'}
+        self.filas = {}
+        self.bindings = {}
+        self.fanout = {}
+        self.contador = itertools.count(1)
+
+    def declarar_exchange(self, nome, tipo):
+        with self.condicao:
+            self.exchanges.setdefault(nome, tipo)
+            self.bindings.setdefault(nome, {})
+            self.fanout.setdefault(nome, set())
+
+    def declarar_fila(self, nome):
+        with self.condicao:
+            if not nome:
+                nome = f"amq.gen-{next(self.contador)}"
+            self.filas.setdefault(nome, collections.deque())
+            return nome
+
+    def remover_fila(self, nome):
+        with self.condicao:
+            self.filas.pop(nome, None)
+            for rotas in self.bindings.values():
+                for filas in rotas.values():
+                    filas.discard(nome)
+            for filas in self.fanout.values():
+                filas.discard(nome)
+
+    def vincular(self, fila, exchange, routing_key):
+        with self.condicao:
+            if exchange not in self.exchanges:
+                raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no exchange '{exchange}'")
+            if self.exchanges[exchange] == 'fanout':
+                self.fanout[exchange].add(fila)
+            else:
+                self.bindings[exchange].setdefault(routing_key, set()).add(fila)
+
+    def desvincular(self, fila, exchange, routing_key):
+        with self.condicao:
+            if self.exchanges.get(exchange) == 'fanout':
+                self.fanout[exchange].discard(fila)
+            else:
+                self.bindings.get(exchange, {}).get(routing_key, set()).discard(fila)
+
+    def rotear(self, exchange, routing_key, body, properties):
+        with self.condicao:
+            tipo = self.exchanges.get(exchange)
+            if tipo is None:
+                raise pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no exchange '{exchange}'")
+
+            if exchange == '':
+                destinos = (routing_key,)
+            elif tipo == 'fanout':
+                destinos = self.fanout[exchange]
+            else:
+                destinos = self.bindings[exchange].get(routing_key, ())
+
+            # Mensagem sem fila de destino é descartada, como no RabbitMQ
+            mensagem = (exchange, routing_key, body, properties)
+            entregue = False
+            for fila in destinos:
+                if fila in self.filas:
+                    self.filas[fila].append(mensagem)
+                    entregue = True
+            if entregue:
+                self.condicao.notify_all()
+
+    def devolver(self, fila, mensagens):
+        # Mensagens não confirmadas voltam para o início da fila
+        with self.condicao:
+            if fila in self.filas:
+                self.filas[fila].extendleft(reversed(mensagens))
+                self.condicao.notify_all()
+
+    def profundidade(self, fila):
+        with self.condicao:
+            return len(self.filas.get(fila, ()))
+
+
+broker = BrokerMemoria()
+
+
+def resetar():
+    global broker
+    broker = BrokerMemoria()
+
+
+def _tipo_exchange(tipo):
+    return str(getattr(tipo, 'value', tipo))
+
+
+class _Consumidor:
+    __slots__ = ('tag', 'fila', 'callback', 'auto_ack')
+
+    def __init__(self, tag, fila, callback, auto_ack):
+        self.tag = tag
+        self.fila = fila
+        self.callback = callback
+        self.auto_ack = auto_ack
+
+
+class CanalMemoria:
+    def __init__(self, conexao, numero):
+        self.conexao = conexao
+        self.channel_number = numero
+        self.prefetch = 0
+        self.consumidores = {}
+        self.nao_confirmadas = collections.OrderedDict()
+        self.ultima_tag = 0
+        self.exclusivas = []
+
+        self._transacao = False
+        self._publicacoes = []
+        self._acks = []
+        self._aberto = True
+
+    @property
+    def is_open(self):
+        return self._aberto and self.conexao.is_open
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def exchange_declare(self, exchange, exchange_type='direct', **kwargs):
+        broker.declarar_exchange(exchange, _tipo_exchange(exchange_type))
+
+    def queue_declare(self, queue, exclusive=False, **kwargs):
+        nome = broker.declarar_fila(queue)
+        if exclusive:
+            self.exclusivas.append(nome)
+        return SimpleNamespace(method=SimpleNamespace(
+            queue=nome, message_count=broker.profundidade(nome), consumer_count=0
+        ))
+
+    def queue_bind(self, queue, exchange, routing_key=None, **kwargs):
+        broker.vincular(queue, exchange, queue if routing_key is None else routing_key)
+
+    def queue_unbind(self, queue, exchange, routing_key=None, **kwargs):
+        broker.desvincular(queue, exchange, queue if routing_key is None else routing_key)
+
+    def basic_qos(self, prefetch_count=0, **kwargs):
+        self.prefetch = prefetch_count
+
+    def confirm_delivery(self):
+        # As publicações já são síncronas: basic_publish só retorna roteado
+        pass
+
+    def tx_select(self):
+        self._transacao = True
+
+    def tx_commit(self):
+        publicacoes, self._publicacoes = self._publicacoes, []
+        acks, self._acks = self._acks, []
+        for publicacao in publicacoes:
+            broker.rotear(*publicacao)
+        for delivery_tag, multiple in acks:
+            self._aplicar_ack(delivery_tag, multiple)
+
+    def tx_rollback(self):
+        self._publicacoes = []
+        self._acks = []
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        if isinstance(body, str):
+            body = body.encode()
+        publicacao = (exchange, routing_key, body, properties or pika.BasicProperties())
+        if self._transacao:
+            self._publicacoes.append(publicacao)
+        else:
+            broker.rotear(*publicacao)
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, consumer_tag=None, **kwargs):
+        tag = consumer_tag or f"ctag-{next(broker.contador)}"
+        self.consumidores[tag] = _Consumidor(tag, queue, on_message_callback, auto_ack)
+        with broker.condicao:
+            broker.condicao.notify_all()
+        return tag
+
+    def basic_cancel(self, consumer_tag):
+        self.consumidores.pop(consumer_tag, None)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        if self._transacao:
+            self._acks.append((delivery_tag, multiple))
+        else:
+            self._aplicar_ack(delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        for fila, mensagem in self._retirar(delivery_tag, multiple):
+            if requeue:
+                broker.devolver(fila, [mensagem])
+
+    def basic_reject(self, delivery_tag=0, requeue=True):
+        self.basic_nack(delivery_tag, multiple=False, requeue=requeue)
+
+    def start_consuming(self):
+        self.conexao._consumir()
+
+    def stop_consuming(self, consumer_tag=None):
+        self.conexao._consumindo = False
+
+    def close(self):
+        self._fechar()
+
+    def _aplicar_ack(self, delivery_tag, multiple):
+        self._retirar(delivery_tag, multiple)
+        # Libera espaço no prefetch
+        with broker.condicao:
+            broker.condicao.notify_all()
+
+    def _retirar(self, delivery_tag, multiple):
+        if not multiple:
+            entrada = self.nao_confirmadas.pop(delivery_tag, None)
+            return [entrada] if entrada else []
+        retiradas = []
+        while self.nao_confirmadas:
+            tag = next(iter(self.nao_confirmadas))
+            if tag > delivery_tag:
+                break
+            retiradas.append(self.nao_confirmadas.pop(tag))
+        return retiradas
+
+    def _coletar(self, entregas):
+        # Chamado com o lock do broker: retira o que cabe no prefetch
+        for consumidor in list(self.consumidores.values()):
+            fila = broker.filas.get(consumidor.fila)
+            while fila and (not self.prefetch or len(self.nao_confirmadas) < self.prefetch):
+                mensagem = fila.popleft()
+                self.ultima_tag += 1
+                if not consumidor.auto_ack:
+                    self.nao_confirmadas[self.ultima_tag] = (consumidor.fila, mensagem)
+                entregas.append((self, consumidor, self.ultima_tag, mensagem))
+
+    def _fechar(self):
+        if not self._aberto:
+            return
+        self._aberto = False
+        self.consumidores.clear()
+        pendentes = collections.defaultdict(list)
+        for fila, mensagem in self.nao_confirmadas.values():
+            pendentes[fila].append(mensagem)
+        self.nao_confirmadas.clear()
+        for fila, mensagens in pendentes.items():
+            broker.devolver(fila, mensagens)
+        for fila in self.exclusivas:
+            broker.remover_fila(fila)
+
+
+class ConexaoMemoria:
+    def __init__(self, parameters=None):
+        self.parameters = parameters
+        self._canais = []
+        self._timers = []
+        self._timers_cancelados = set()
+        self._callbacks = collections.deque()
+        self._contador = itertools.count(1)
+        self._consumindo = False
+        self._aberta = True
+
+    @property
+    def is_open(self):
+        return self._aberta
+
+    @property
+    def is_closed(self):
+        return not self._aberta
+
+    def channel(self, channel_number=None):
+        canal = CanalMemoria(self, channel_number or len(self._canais) + 1)
+        self._canais.append(canal)
+        return canal
+
+    def call_later(self, delay, callback):
+        timer = (time.monotonic() + delay, next(self._contador), callback)
+        heapq.heappush(self._timers, timer)
+        return timer[1]
+
+    def remove_timeout(self, timeout_id):
+        self._timers_cancelados.add(timeout_id)
+
+    def add_callback_threadsafe(self, callback):
+        with broker.condicao:
+            self._callbacks.append(callback)
+            broker.condicao.notify_all()
+
+    def sleep(self, duration):
+        limite = time.monotonic() + duration
+        while self._aberta and time.monotonic() < limite:
+            self.process_data_events(time_limit=limite - time.monotonic())
+
+    def process_data_events(self, time_limit=0):
+        if not self._aberta:
+            raise pika.exceptions.ConnectionWrongStateError('Connection is closed')
+
+        limite = time.monotonic() + (time_limit or 0)
+        while True:
+            entregas = []
+            with broker.condicao:
+                for canal in self._canais:
+                    if canal._aberto:
+                        canal._coletar(entregas)
+                callbacks = list(self._callbacks)
+                self._callbacks.clear()
+
+                espera = limite - time.monotonic()
+                if self._timers:
+                    espera = min(espera, self._timers[0][0] - time.monotonic())
+                if not entregas and not callbacks and espera > 0:
+                    broker.condicao.wait(espera)
+                    continue
+
+            for callback in callbacks:
+                callback()
+            for canal, consumidor, tag, (exchange, routing_key, body, properties) in entregas:
+                metodo = pika.spec.Basic.Deliver(consumidor.tag, tag, False, exchange, routing_key)
+                consumidor.callback(canal, metodo, properties, body)
+            self._executar_timers()
+
+            if entregas or callbacks or time.monotonic() >= limite:
+                return
+
+    def _executar_timers(self):
+        agora = time.monotonic()
+        while self._timers and self._timers[0][0] <= agora:
+            _, timeout_id, callback = heapq.heappop(self._timers)
+            if timeout_id in self._timers_cancelados:
+                self._timers_cancelados.discard(timeout_id)
+                continue
+            callback()
+
+    def _consumir(self):
+        self._consumindo = True
+        while self._consumindo and self._aberta:
+            self.process_data_events(time_limit=0.1)
+
+    def close(self):
+        if not self._aberta:
+            return
+        for canal in self._canais:
+            canal._fechar()
+        self._aberta = False
+        self._consumindo = False
+
+
+def instalar():
+    # Faz os MS (e o Publicador) abrirem conexões no broker em memória
+    pika.BlockingConnection = ConexaoMemoria
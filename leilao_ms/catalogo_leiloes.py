@@ -0,0 +1,124 @@
+import bisect
+import itertools
+import threading
+
+from estado_leiloes import EstadoLeiloes
+
+# Catálogo do ms_leilao: o EstadoLeiloes com índices secundários por status
+# (em ordem de entrada no status, para paginação por cursor) e, para os leilões
+# ativos, por horário de término. Cada índice tem uma versão que muda a cada
+# alteração dos seus leilões, usada como ETag.
+STATUS_POR_FIM = ("ativo",)
+
+
+class _IndiceStatus:
+    def __init__(self, por_fim):
+        self.lock = threading.Lock()
+        self.posicoes = []      # crescente; remoções são preguiçosas
+        self.ids = {}           # posicao -> leilao_id
+        self.posicao_de = {}    # leilao_id -> posicao
+        self.por_fim = [] if por_fim else None   # (fim, posicao), ordenada
+        self.versao = 0
+
+    def adicionar(self, leilao_id, posicao, fim):
+        with self.lock:
+            self.posicoes.append(posicao)
+            self.ids[posicao] = leilao_id
+            self.posicao_de[leilao_id] = posicao
+            if self.por_fim is not None:
+                bisect.insort(self.por_fim, (fim or "", posicao))
+            self.versao += 1
+
+    def remover(self, leilao_id, fim):
+        with self.lock:
+            posicao = self.posicao_de.pop(leilao_id, None)
+            if posicao is None:
+                return
+            del self.ids[posicao]
+            if self.por_fim is not None:
+                chave = (fim or "", posicao)
+                i = bisect.bisect_left(self.por_fim, chave)
+                if i < len(self.por_fim) and self.por_fim[i] == chave:
+                    del self.por_fim[i]
+            # Compacta quando metade das posições já foi removida
+            if len(self.posicoes) > 2 * len(self.ids) + 64:
+                self.posicoes = [p for p in self.posicoes if p in self.ids]
+            self.versao += 1
+
+    def tocar(self):
+        with self.lock:
+            self.versao += 1
+
+    def pagina(self, cursor, limite):
+        with self.lock:
+            inicio = bisect.bisect_right(self.posicoes, cursor) if cursor is not None else 0
+            ids = []
+            ultima = None
+            for posicao in itertools.islice(self.posicoes, inicio, None):
+                leilao_id = self.ids.get(posicao)
+                if leilao_id is None:
+                    continue
+                if limite is not None and len(ids) == limite:
+                    return ids, ultima
+                ids.append(leilao_id)
+                ultima = posicao
+            return ids, None
+
+    def primeiros_por_fim(self, limite):
+        with self.lock:
+            return [self.ids[posicao] for _, posicao in self.por_fim[:limite]]
+
+
+class CatalogoLeiloes(EstadoLeiloes):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._indices = {}
+        self._indices_lock = threading.Lock()
+        self._posicoes = itertools.count(1)
+
+    def _indice(self, status):
+        indice = self._indices.get(status)
+        if indice is None:
+            with self._indices_lock:
+                indice = self._indices.get(status)
+                if indice is None:
+                    indice = _IndiceStatus(status in STATUS_POR_FIM)
+                    self._indices[status] = indice
+        return indice
+
+    def _alterado(self, leilao_id, anterior, atual):
+        status_anterior = anterior.get("status") if anterior else None
+        status_atual = atual.get("status") if atual else None
+
+        if status_anterior == status_atual:
+            if status_atual is not None:
+                self._indice(status_atual).tocar()
+            return
+
+        if status_anterior is not None:
+            self._indice(status_anterior).remover(leilao_id, anterior.get("fim"))
+        if status_atual is not None:
+            self._indice(status_atual).adicionar(leilao_id, next(self._posicoes), atual.get("fim"))
+
+    def versao(self, status):
+        return self._indice(status).versao
+
+    def contagem(self, status):
+        return len(self._indice(status).ids)
+
+    def _carregar(self, status, ids):
+        leiloes = []
+        for leilao_id in ids:
+            leilao = self.obter(leilao_id)
+            if leilao is not None and leilao.get("status") == status:
+                leiloes.append(leilao)
+        return leiloes
+
+    def pagina(self, status, cursor=None, limite=None):
+        ids, proximo_cursor = self._indice(status).pagina(cursor, limite)
+        return self._carregar(status, ids), proximo_cursor
+
+    def encerrando(self, limite):
+        # Os horários estão em "%Y-%m-%d %H:%M:%S", que ordena como texto
+        ids = self._indice("ativo").primeiros_por_fim(limite)
+        return self._carregar("ativo", ids)
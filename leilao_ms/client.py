@@ -1,8 +1,14 @@
 import pika
-import json
 import os
-from datetime import datetime
-import sys
+import time
+import uuid
+import random
+import argparse
+import threading
+import functools
+import codec
+import snapshot_leiloes
+from runtime_amqp import declarar_exchanges, parametros
 
 user_id = None
 connection = None
@@ -10,41 +16,83 @@ channel = None
 running = True
 leiloes_ativos = {}
 leiloes_interessado = set()
-queue_leilao_iniciado = None
+fila_cliente = None
+fila_eventos = None
+seq_snapshot = 0
+
+# A conexão é do thread de I/O, que trata as mensagens assim que chegam; o
+# menu (ou o bot) pede publicações e bindings por add_callback_threadsafe.
+thread_io = None
+silencioso = False
+precos = {}
+notificacoes_recebidas = 0
+
+# Uma fila por cliente recebe as notificações de todos os leilões acompanhados
+# (um binding leilao_{id} por leilão). O broker entrega no máximo PREFETCH
+# mensagens sem ack e a fila guarda no máximo FILA_MAXIMO mensagens por até
+# FILA_TTL_MS; ao encher, descarta as mais antigas (drop-head), já que só o
+# preço mais recente interessa. Os leilões iniciados e os vencedores vêm por
+# outra fila, sem limite: perder um deles deixaria um leilão fora da lista ou
+# um binding que nunca é removido, e são só dois eventos por leilão.
+PREFETCH = int(os.environ.get('CLIENTE_PREFETCH', '64'))
+FILA_MAXIMO = int(os.environ.get('CLIENTE_FILA_MAXIMO', '1000'))
+FILA_TTL_MS = int(os.environ.get('CLIENTE_FILA_TTL_MS', '60000'))
+FILA_OVERFLOW = os.environ.get('CLIENTE_FILA_OVERFLOW', 'drop-head')
+
+def argumentos_fila():
+    argumentos = {'x-overflow': FILA_OVERFLOW}
+    if FILA_MAXIMO:
+        argumentos['x-max-length'] = FILA_MAXIMO
+    if FILA_TTL_MS:
+        argumentos['x-message-ttl'] = FILA_TTL_MS
+    return argumentos
 
 def conectar_rabbitmq():
-    global connection, channel, queue_leilao_iniciado
+    global connection, channel, fila_cliente, fila_eventos, seq_snapshot
     try:
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters('localhost')
-        )
+        connection = pika.BlockingConnection(parametros())
         channel = connection.channel()
         
-        channel.exchange_declare(exchange='leilao_iniciado', exchange_type='fanout')
-        channel.exchange_declare(exchange='leilao', exchange_type='direct')
-        channel.exchange_declare(exchange='notificacoes_leilao', exchange_type='direct')
+        declarar_exchanges(channel)
+        
+        result = channel.queue_declare(queue='', exclusive=True, arguments=argumentos_fila())
+        fila_cliente = result.method.queue
         
         result = channel.queue_declare(queue='', exclusive=True)
-        queue_leilao_iniciado = result.method.queue
-        channel.queue_bind(exchange='leilao_iniciado', queue=queue_leilao_iniciado)
+        fila_eventos = result.method.queue
+        channel.queue_bind(exchange='leilao_iniciado', queue=fila_eventos)
+        channel.queue_bind(exchange='leilao', queue=fila_eventos, routing_key='leilao_vencedor')
+        channel.basic_qos(prefetch_count=PREFETCH)
+        
+        # Com a fila já vinculada, os leilões que começaram antes do cliente
+        seq_snapshot = snapshot_leiloes.carregar(guardar_leilao)
         
         return True
     except Exception:
         return False
 
+def no_io(funcao, *args):
+    connection.add_callback_threadsafe(functools.partial(funcao, *args))
+
 def publicar_lance(leilao_id, valor):
+    no_io(_publicar_lance, leilao_id, valor)
+
+def _publicar_lance(leilao_id, valor):
     try:
         lance_data = {
+            "id": str(uuid.uuid4()),
             "leilao_id": leilao_id,
             "user_id": user_id,
             "valor": valor,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": codec.agora()
         }
         
+        body, properties = codec.codificar('lance_realizado', lance_data)
         channel.basic_publish(
             exchange='leilao',
             routing_key='lance_realizado',
-            body=json.dumps(lance_data)
+            body=body,
+            properties=properties
         )
         
         registrar_interesse_leilao(leilao_id)
@@ -57,46 +105,80 @@ def registrar_interesse_leilao(leilao_id):
         leiloes_interessado.add(leilao_id)
 
         try:
-            channel.exchange_declare(exchange='notificacoes_leilao', exchange_type='direct')
-            
-            result = channel.queue_declare(queue='', exclusive=True)
-            fila_client_leilao = result.method.queue
-            
             channel.queue_bind(
                 exchange='notificacoes_leilao',
-                queue=fila_client_leilao,
+                queue=fila_cliente,
                 routing_key=f'leilao_{leilao_id}'
             )
-            
-            channel.basic_consume(
-                queue=fila_client_leilao,
-                on_message_callback=callback_notificacao_leilao_especifica,
-                auto_ack=True
-            )
-            print(f"Acompanhando leilão de número {leilao_id}")
+            if not silencioso:
+                print(f"Acompanhando leilão de número {leilao_id}")
         except Exception as e:
             print(f"Erro ao conectar às notificações do leilão {leilao_id}: {e}")
 
+def esquecer_leilao(leilao_id):
+    # Leilão encerrado: remove o binding para a fila não acumular rotas
+    leiloes_interessado.discard(leilao_id)
+    try:
+        channel.queue_unbind(
+            exchange='notificacoes_leilao',
+            queue=fila_cliente,
+            routing_key=f'leilao_{leilao_id}'
+        )
+    except Exception as e:
+        print(f"Erro ao deixar de acompanhar o leilão {leilao_id}: {e}")
+
+def callback_mensagem(ch, method, properties, body):
+    # As duas filas usam o mesmo callback; a exchange diz o que é a mensagem
+    if method.exchange == 'leilao_iniciado':
+        callback_leilao_iniciado(ch, method, properties, body)
+    elif method.exchange == 'leilao':
+        callback_leilao_vencedor(ch, method, properties, body)
+    else:
+        callback_notificacao_leilao_especifica(ch, method, properties, body)
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+
+def guardar_leilao(leilao):
+    leiloes_ativos[leilao['id']] = leilao
+
 def callback_leilao_iniciado(ch, method, properties, body):
     try:
-        evento = json.loads(body)
-        leilao_id = evento['id']
-        leiloes_ativos[leilao_id] = evento        
+        evento = codec.decodificar(body, properties)
+        seq = evento.get('seq')
+        if seq is None or seq > seq_snapshot:
+            guardar_leilao(evento)        
     except Exception as e:
         pass
 
+def encerrar_leilao(leilao_id, vencedor_id, valor_final):
+    # Pela notificação ou pelo leilao_vencedor, o que chegar primeiro
+    if leilao_id in leiloes_interessado:
+        if not silencioso:
+            print(f"\n Leilão {leilao_id} finalizado! Vencedor: {vencedor_id} com R$ {valor_final}")
+        esquecer_leilao(leilao_id)
+    leiloes_ativos.pop(leilao_id, None)
+    precos.pop(leilao_id, None)
+
+def callback_leilao_vencedor(ch, method, properties, body):
+    try:
+        evento = codec.decodificar(body, properties)
+        encerrar_leilao(evento.get('leilao_id'), evento.get('vencedor_id'), evento.get('valor_final'))
+    except Exception as e:
+        print(f"Erro ao processar vencedor: {e}")
+
 def callback_notificacao_leilao_especifica(ch, method, properties, body):
+    global notificacoes_recebidas
     try:
-        notificacao = json.loads(body)
+        notificacao = codec.decodificar(body, properties)
         leilao_id = notificacao.get('leilao_id')
         
         if leilao_id in leiloes_interessado:
+            notificacoes_recebidas += 1
             if notificacao['tipo'] == 'novo_lance':
-                print(f"\n Novo lance no leilão {leilao_id}: R$ {notificacao['valor']} por {notificacao['user_id']}")
+                precos[leilao_id] = notificacao['valor']
+                if not silencioso:
+                    print(f"\n Novo lance no leilão {leilao_id}: R$ {notificacao['valor']} por {notificacao['user_id']}")
             elif notificacao['tipo'] == 'leilao_vencedor':
-                print(f"\n Leilão {leilao_id} finalizado! Vencedor: {notificacao['vencedor_id']} com R$ {notificacao['valor_final']}")
-                if leilao_id in leiloes_ativos:
-                    del leiloes_ativos[leilao_id]
+                encerrar_leilao(leilao_id, notificacao['vencedor_id'], notificacao['valor_final'])
                 
     except Exception as e:
         pass
@@ -116,7 +198,6 @@ def interface_usuario():
             comando = input(f"\nCliente {user_id}> ").strip()
             
             if comando == "1":
-                connection.process_data_events(time_limit=0.1)
                 listar_e_dar_lance()
             elif comando == "2" and leiloes_interessado:
                 acompanhar_meus_leiloes()
@@ -137,18 +218,14 @@ def acompanhar_meus_leiloes():
         print("Você não está acompanhando nenhum leilão ainda.")
         return
     
-    print(f"\n Acompanhando leilões: {', '.join(map(str, leiloes_interessado))}")
-    print("Aguardando notificações... (CTRL+C para voltar ao menu)")
+    print(f"\n Acompanhando leilões: {', '.join(map(str, list(leiloes_interessado)))}")
+    print("As notificações aparecem assim que chegam. (ENTER para voltar ao menu)")
     
     try:
-        channel.start_consuming()
-        
+        input()
     except KeyboardInterrupt:
-        try:
-            channel.stop_consuming()
-        except:
-            pass
-        print("\nVoltando ao menu...")
+        pass
+    print("Voltando ao menu...")
 
 def listar_e_dar_lance():
     if not leiloes_ativos:
@@ -156,7 +233,7 @@ def listar_e_dar_lance():
         return
         
     print("\nLeilões ativos:")
-    for leilao_id, dados in leiloes_ativos.items():
+    for leilao_id, dados in list(leiloes_ativos.items()):
         print(f"{leilao_id}. {dados['descricao']}")
         print(f"   Início: {dados['inicio']} | Fim: {dados['fim']}")
     
@@ -183,26 +260,85 @@ def listar_e_dar_lance():
     except Exception as e:
         print(f"Erro: {e}")
 
+def loop_io():
+    try:
+        while running:
+            connection.process_data_events(time_limit=0.1)
+    except Exception as e:
+        if running:
+            print(f"\nErro na conexão com o RabbitMQ: {e}")
+    finally:
+        if not connection.is_closed:
+            # Publicações pedidas antes de parar ainda saem
+            connection.process_data_events(time_limit=0)
+            connection.close()
+
+def executar_bot(taxa, total, incremento):
+    # Lances em leilões ativos sorteados, a `taxa` lances/s (laço aberto), sempre
+    # `incremento` acima do último preço conhecido; total 0 = até CTRL+C
+    print(f"Bot {user_id}: {taxa:g} lances/s{f', {total} lances' if total else ''}")
+    enviados = 0
+    inicio = time.monotonic()
+    try:
+        while running and (not total or enviados < total):
+            ativos = list(leiloes_ativos.items())
+            if not ativos:
+                time.sleep(0.1)
+                inicio = time.monotonic() - enviados / taxa
+                continue
+            
+            leilao_id, dados = random.choice(ativos)
+            preco = precos.get(leilao_id, dados.get('valorInicial') or 0)
+            publicar_lance(leilao_id, round(preco + incremento * random.uniform(1, 2), 2))
+            enviados += 1
+            
+            espera = inicio + enviados / taxa - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+    except KeyboardInterrupt:
+        pass
+    
+    duracao = time.monotonic() - inicio
+    print(f"Bot {user_id}: {enviados} lances em {duracao:.1f}s ({enviados / (duracao or 1):.0f}/s), "
+          f"{notificacoes_recebidas} notificações recebidas")
+
 def parar():
     global running
     running = False
-    if connection and not connection.is_closed:
-        connection.close()
+    if thread_io is not None and thread_io is not threading.current_thread():
+        thread_io.join(timeout=2)
 
 def main():
-    global user_id      
-    user_id = sys.argv[1]
+    global user_id, silencioso, thread_io
+    parser = argparse.ArgumentParser(description="Cliente de terminal do leilão")
+    parser.add_argument('user_id')
+    parser.add_argument('--bot', action='store_true', help="sem menu: dá lances automáticos para gerar carga")
+    parser.add_argument('--taxa', type=float, default=20, help="lances por segundo no modo bot")
+    parser.add_argument('--lances', type=int, default=0, help="total de lances no modo bot (0 = até CTRL+C)")
+    parser.add_argument('--incremento', type=float, default=1, help="incremento mínimo sobre o último preço")
+    args = parser.parse_args()
+    if not args.taxa > 0:
+        parser.error("--taxa precisa ser maior que zero")
+    user_id = args.user_id
+    silencioso = args.bot
     
     if not conectar_rabbitmq():
         print("Erro ao conectar ao RabbitMQ")
         return
         
-    channel.basic_consume(
-        queue=queue_leilao_iniciado,
-        on_message_callback=callback_leilao_iniciado,
-        auto_ack=True
-    )
-    interface_usuario()
+    for fila in (fila_eventos, fila_cliente):
+        channel.basic_consume(
+            queue=fila,
+            on_message_callback=callback_mensagem
+        )
+    thread_io = threading.Thread(target=loop_io, daemon=True)
+    thread_io.start()
+    
+    if args.bot:
+        executar_bot(args.taxa, args.lances, args.incremento)
+        parar()
+    else:
+        interface_usuario()
 
 if __name__ == "__main__":
     main()
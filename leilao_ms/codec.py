@@ -0,0 +1,197 @@
+import json
+import os
+import time
+from datetime import datetime
+
+import pika
+
+from metricas import registro
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Codificação dos eventos trocados pelo RabbitMQ. O formato de cada mensagem
+# vai no content_type e o nome do evento no campo type das propriedades AMQP,
+# então quem recebe decodifica qualquer formato sem configuração.
+#
+# CODEC_FORMATO=msgpack (requer o pacote msgpack) publica em binário, como
+# lista na ordem dos campos do esquema, os eventos que só os MS Python leem;
+# os que o gateway Node consome continuam em JSON. Em msgpack só viajam os
+# campos do esquema: um campo novo precisa entrar no esquema, senão some no
+# caminho. Sem orjson o JSON usa a biblioteca padrão.
+#
+# CODEC_TIMESTAMP=epoch troca os timestamps ISO por milissegundos desde a
+# época (inteiro); o gateway e o frontend aceitam os dois.
+#
+# CODEC_VALIDAR=1 confere os tipos de cada evento publicado contra o esquema
+# (para desenvolvimento; fica fora do caminho quente por padrão).
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+
+FORMATO = os.environ.get('CODEC_FORMATO', 'json')
+TIMESTAMP = os.environ.get('CODEC_TIMESTAMP', 'iso')
+VALIDAR = os.environ.get('CODEC_VALIDAR') == '1'
+
+if FORMATO == 'msgpack' and msgpack is None:
+    raise ImportError("CODEC_FORMATO=msgpack precisa do pacote msgpack: pip install msgpack")
+
+
+class Esquema:
+    __slots__ = ('nome', 'campos', 'tipos', 'interno')
+
+    def __init__(self, nome, campos, interno=False):
+        self.nome = nome
+        self.tipos = dict(campos)
+        self.campos = tuple(self.tipos)
+        self.interno = interno
+
+    def validar(self, dados):
+        # Confere os tipos dos campos presentes (None é sempre aceito)
+        for campo, tipos in self.tipos.items():
+            valor = dados.get(campo)
+            if valor is not None and not isinstance(valor, tipos):
+                raise TypeError(f"{self.nome}.{campo}: esperado {tipos}, recebido {type(valor).__name__}")
+        return dados
+
+    def para_lista(self, dados):
+        return [dados.get(campo) for campo in self.campos]
+
+    def de_lista(self, valores):
+        # Só os campos do esquema (é tudo o que para_lista envia)
+        return dict(zip(self.campos, valores))
+
+
+TEXTO = (str,)
+ID = (str, int)
+NUMERO = (int, float)
+INSTANTE = (str, int)
+
+ESQUEMAS = {esquema.nome: esquema for esquema in (
+    # Só entre os MS Python: podem ir em binário
+    Esquema('lance_realizado', [
+        ('id', ID), ('leilao_id', ID), ('user_id', ID), ('valor', NUMERO), ('timestamp', INSTANTE)
+    ], interno=True),
+    Esquema('leilao_iniciado', [
+        ('id', ID), ('nome', TEXTO), ('descricao', TEXTO), ('valorInicial', NUMERO),
+        ('inicio', TEXTO), ('fim', TEXTO), ('seq', (int,))
+    ], interno=True),
+    Esquema('leilao_finalizado', [
+        ('id', ID), ('descricao', TEXTO), ('timestamp', INSTANTE), ('status', TEXTO), ('seq', (int,))
+    ], interno=True),
+    Esquema('fechamento_leilao', [
+        ('leilao_id', ID), ('fim', NUMERO)
+    ], interno=True),
+    # Lidos pelo gateway: sempre JSON
+    Esquema('lance_validado', [
+        ('leilao_id', ID), ('leilao_nome', ID), ('user_id', ID), ('valor', NUMERO), ('timestamp', INSTANTE)
+    ]),
+    Esquema('lance_invalidado', [
+        ('leilao_id', ID), ('user_id', ID), ('valor', NUMERO), ('motivo', TEXTO),
+        ('ultimo_lance', NUMERO), ('timestamp', INSTANTE)
+    ]),
+    Esquema('leilao_vencedor', [
+        ('leilao_id', ID), ('leilao_nome', ID), ('vencedor_id', ID), ('valor_final', NUMERO),
+        ('timestamp', INSTANTE)
+    ]),
+    Esquema('link_pagamento', [
+        ('leilao_id', ID), ('vencedor_id', ID), ('link', TEXTO), ('timestamp', INSTANTE)
+    ]),
+    Esquema('status_pagamento', [
+        ('leilao_id', ID), ('vencedor_id', ID), ('status', TEXTO), ('timestamp', INSTANTE)
+    ]),
+    Esquema('notificacao', [
+        ('tipo', TEXTO), ('leilao_id', ID), ('user_id', ID), ('valor', NUMERO),
+        ('lances_agrupados', (int,)), ('vencedor_id', ID), ('valor_final', NUMERO), ('timestamp', INSTANTE)
+    ]),
+)}
+
+duracao_codec = registro.histograma(
+    'codec_segundos', 'Tempo de codificação/decodificação das mensagens', ('operacao', 'formato')
+)
+
+# As propriedades não mudam entre mensagens do mesmo tipo. Todas as mensagens
+# são persistentes (delivery_mode 2): nas filas duráveis sobrevivem a um
+# reinício do broker
+PERSISTENTE = 2
+_propriedades = {}
+
+
+def propriedades(tipo, formato=JSON):
+    chave = (tipo, formato)
+    if chave not in _propriedades:
+        _propriedades[chave] = pika.BasicProperties(content_type=formato, type=tipo, delivery_mode=PERSISTENTE)
+    return _propriedades[chave]
+
+
+def formato_de(tipo):
+    esquema = ESQUEMAS.get(tipo)
+    if FORMATO == 'msgpack' and esquema is not None and esquema.interno:
+        return MSGPACK
+    return JSON
+
+
+def para_json(dados):
+    if orjson is not None:
+        return orjson.dumps(dados)
+    return json.dumps(dados, separators=(',', ':')).encode()
+
+
+def de_json(body):
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def codificar(tipo, dados, **extra):
+    # Devolve (body, properties) prontos para o basic_publish. Propriedades
+    # extras (reply_to, correlation_id) saem num objeto próprio, fora do cache
+    formato = formato_de(tipo)
+    if VALIDAR and tipo in ESQUEMAS:
+        ESQUEMAS[tipo].validar(dados)
+    inicio = time.perf_counter()
+    if formato == MSGPACK:
+        body = msgpack.packb(ESQUEMAS[tipo].para_lista(dados))
+    else:
+        body = para_json(dados)
+    duracao_codec.observar(time.perf_counter() - inicio, operacao='encode', formato=formato)
+    if extra:
+        return body, pika.BasicProperties(content_type=formato, type=tipo, delivery_mode=PERSISTENTE, **extra)
+    return body, propriedades(tipo, formato)
+
+
+def decodificar(body, properties=None):
+    # Aceita as propriedades do pika ou uma mensagem do aio-pika; sem
+    # content_type a mensagem é tratada como JSON (produtores antigos)
+    formato = getattr(properties, 'content_type', None) or JSON
+    inicio = time.perf_counter()
+    if formato == MSGPACK:
+        if msgpack is None:
+            raise ValueError("mensagem em msgpack, mas o pacote msgpack não está instalado")
+        dados = ESQUEMAS[properties.type].de_lista(msgpack.unpackb(body))
+    else:
+        dados = de_json(body)
+    duracao_codec.observar(time.perf_counter() - inicio, operacao='decode', formato=formato)
+    return dados
+
+
+def instante(valor):
+    # Timestamp ISO (com ou sem fuso) ou epoch em ms -> segundos desde a época.
+    # Levanta ValueError (ou TypeError) se o valor não é nenhum dos dois
+    if valor is None:
+        return None
+    if isinstance(valor, (int, float)):
+        return valor / 1000
+    return datetime.fromisoformat(valor.replace('Z', '+00:00')).timestamp()
+
+
+def agora():
+    if TIMESTAMP == 'epoch':
+        return time.time_ns() // 1_000_000
+    return datetime.now().isoformat()
@@ -0,0 +1,79 @@
+import collections
+import threading
+import time
+from metricas import registro
+
+# Cache de ids já processados, para descartar reentregas (ex.: o consumidor
+# caiu depois de processar e antes do ack). Guarda no máximo `capacidade`
+# ids por até `ttl` segundos; como os ids ficam em ordem de chegada, expirar
+# e despejar olham só o início do OrderedDict e custam O(1) amortizado.
+# Com capacidade 0 o cache fica desligado.
+consultas = registro.contador(
+    'dedup_consultas_total', 'Consultas ao cache de deduplicação por resultado', ('cache', 'resultado')
+)
+tamanho = registro.medidor('dedup_ids', 'Ids guardados no cache de deduplicação', ('cache',))
+
+
+class CacheDeduplicacao:
+    def __init__(self, capacidade, ttl, nome='dedup'):
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self.nome = nome
+        self._ids = collections.OrderedDict()
+        self._trava = threading.Lock()
+
+        self.total_consultas = 0
+        self.total_duplicados = 0
+
+    def visto(self, chave, agora=None, guardar=True):
+        # True se a chave já passou por aqui dentro do TTL; senão a registra
+        # (com guardar=False só consulta e quem chama registra depois)
+        if not self.capacidade:
+            return False
+        agora = time.time() if agora is None else agora
+
+        with self._trava:
+            self.total_consultas += 1
+            instante = self._ids.get(chave)
+            if instante is not None and agora - instante < self.ttl:
+                self.total_duplicados += 1
+                duplicado = True
+            else:
+                if guardar:
+                    self._guardar(chave, agora)
+                duplicado = False
+
+        consultas.inc(cache=self.nome, resultado='duplicado' if duplicado else 'novo')
+        return duplicado
+
+    def registrar(self, chave, instante=None):
+        # Usado na recuperação do estado: só guarda, sem contar consulta
+        if not self.capacidade or chave is None:
+            return
+        with self._trava:
+            self._guardar(chave, time.time() if instante is None else instante)
+
+    def _guardar(self, chave, instante):
+        self._ids[chave] = instante
+        self._ids.move_to_end(chave)
+        while self._ids:
+            primeira, inicio = next(iter(self._ids.items()))
+            if len(self._ids) <= self.capacidade and instante - inicio < self.ttl:
+                break
+            del self._ids[primeira]
+        tamanho.definir(len(self._ids), cache=self.nome)
+
+    def itens(self):
+        with self._trava:
+            return [[chave, instante] for chave, instante in self._ids.items()]
+
+    def __len__(self):
+        return len(self._ids)
+
+    def estatisticas(self):
+        return {
+            "ids": len(self._ids),
+            "consultas": self.total_consultas,
+            "duplicados": self.total_duplicados,
+            "taxa_duplicados": self.total_duplicados / (self.total_consultas or 1)
+        }
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+from metricas import registro
+
+# Requisições esperando o resultado de uma mensagem, por chave de correlação
+# (o id do lance). Quem espera abre a espera ANTES de publicar, para não
+# perder um resultado que chegue antes do wait; quem processa chama
+# resolver(chave, resultado) e a espera é retirada. Serve tanto às threads do
+# Flask (aguardar) quanto ao loop asyncio (aguardar_async).
+
+
+class Espera:
+    __slots__ = ('resultado', '_evento', '_loop', '_futuro')
+
+    def __init__(self, loop=None):
+        self.resultado = None
+        self._evento = threading.Event()
+        self._loop = loop
+        self._futuro = loop.create_future() if loop is not None else None
+
+    def entregar(self, resultado):
+        self.resultado = resultado
+        self._evento.set()
+        if self._futuro is not None:
+            self._loop.call_soon_threadsafe(self._concluir)
+
+    def _concluir(self):
+        if not self._futuro.done():
+            self._futuro.set_result(None)
+
+    def aguardar(self, prazo):
+        # Resultado entregue ou None se o prazo acabou
+        self._evento.wait(prazo)
+        return self.resultado
+
+    async def aguardar_async(self, prazo):
+        try:
+            await asyncio.wait_for(asyncio.shield(self._futuro), prazo)
+        except asyncio.TimeoutError:
+            pass
+        return self.resultado
+
+
+class EsperaResultados:
+    def __init__(self, nome='esperas'):
+        self.nome = nome
+        self._esperas = {}
+        self._trava = threading.Lock()
+        registro.medidor(
+            'esperas_abertas', 'Requisições esperando um resultado', ('esperas',),
+            funcao=lambda: {(self.nome,): len(self._esperas)}
+        )
+
+    def abrir(self, chave, loop=None):
+        espera = Espera(loop)
+        with self._trava:
+            self._esperas[chave] = espera
+        return espera
+
+    def fechar(self, chave):
+        with self._trava:
+            self._esperas.pop(chave, None)
+
+    def aguardando(self, chave):
+        return chave in self._esperas
+
+    def resolver(self, chave, resultado):
+        with self._trava:
+            espera = self._esperas.pop(chave, None)
+        if espera is None:
+            return False
+        espera.entregar(resultado)
+        return True
+
+    def __len__(self):
+        return len(self._esperas)
@@ -0,0 +1,90 @@
+import threading
+
+# Estado por leilão compartilhado entre as threads do Flask e a do consumidor.
+# Cada leilão cai em uma listra (lock + dict próprios), então escritas em
+# leilões diferentes não disputam o mesmo lock. As leituras em massa usam um
+# snapshot imutável por listra, reconstruído só quando a listra mudou.
+LISTRAS_PADRAO = 64
+
+
+class _Listra:
+    __slots__ = ('lock', 'dados', 'snapshot')
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.dados = {}
+        self.snapshot = ()
+
+
+class EstadoLeiloes:
+    def __init__(self, listras=LISTRAS_PADRAO):
+        self._listras = tuple(_Listra() for _ in range(listras))
+
+    def _listra(self, leilao_id):
+        return self._listras[hash(leilao_id) % len(self._listras)]
+
+    def bloqueio(self, leilao_id):
+        # Para operações compostas (ler-validar-escrever) de um mesmo leilão
+        return self._listra(leilao_id).lock
+
+    def obter(self, leilao_id, padrao=None):
+        return self._listra(leilao_id).dados.get(leilao_id, padrao)
+
+    def __contains__(self, leilao_id):
+        return leilao_id in self._listra(leilao_id).dados
+
+    def __len__(self):
+        return sum(len(listra.dados) for listra in self._listras)
+
+    def _alterado(self, leilao_id, anterior, atual):
+        # Gancho chamado sob o lock da listra; subclasses mantêm índices aqui
+        pass
+
+    def definir(self, leilao_id, valor):
+        listra = self._listra(leilao_id)
+        with listra.lock:
+            anterior = listra.dados.get(leilao_id)
+            listra.dados[leilao_id] = valor
+            listra.snapshot = None
+            self._alterado(leilao_id, anterior, valor)
+
+    def atualizar(self, leilao_id, **campos):
+        # Copy-on-write: quem já leu o registro antigo continua com uma
+        # versão consistente dele
+        listra = self._listra(leilao_id)
+        with listra.lock:
+            atual = listra.dados.get(leilao_id)
+            if atual is None:
+                return None
+            novo = {**atual, **campos}
+            listra.dados[leilao_id] = novo
+            listra.snapshot = None
+            self._alterado(leilao_id, atual, novo)
+            return novo
+
+    def remover(self, leilao_id):
+        listra = self._listra(leilao_id)
+        with listra.lock:
+            valor = listra.dados.pop(leilao_id, None)
+            listra.snapshot = None
+            if valor is not None:
+                self._alterado(leilao_id, valor, None)
+            return valor
+
+    def _snapshot(self, listra):
+        snapshot = listra.snapshot
+        if snapshot is None:
+            with listra.lock:
+                snapshot = listra.snapshot
+                if snapshot is None:
+                    snapshot = tuple(listra.dados.items())
+                    listra.snapshot = snapshot
+        return snapshot
+
+    def itens(self):
+        for listra in self._listras:
+            yield from self._snapshot(listra)
+
+    def valores(self):
+        for _, valor in self.itens():
+            yield valor
@@ -0,0 +1,351 @@
+import argparse
+import heapq
+import io
+import itertools
+import os
+import sys
+
+import codec
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Exportação do histórico em disco do MS lance (LANCE_HISTORICO_ARQUIVO): lê
+# os arquivos NDJSON linha a linha e devolve geradores, então a memória não
+# cresce com o número de lances. Sai em NDJSON, Arrow (stream IPC) ou Parquet;
+# os dois últimos precisam do pacote pyarrow.
+#
+# O resumo por leilão é calculado na mesma passada: quantidade de lances,
+# licitantes distintos, primeiro/último lance, tempo entre o último lance e o
+# fim e a curva de preço, reduzida a no máximo 2 * PONTOS_CURVA pontos. Com o
+# pyarrow os lances são agregados em blocos de TAMANHO_LOTE, um passo por
+# leilão do bloco em vez de um por lance. Os licitantes distintos são contados
+# com um sketch KMV (os LICITANTES_AMOSTRA menores hashes): exato até esse
+# número de licitantes, estimado acima dele (erro típico de ~3%), com memória
+# constante por leilão.
+#
+#   python exportacao_lances.py historico.ndjson --leilao 7 --formato parquet --saida leilao7.parquet
+#   python exportacao_lances.py historico.p*.ndjson --resumo
+CONTENT_TYPE_NDJSON = 'application/x-ndjson'
+CONTENT_TYPE_ARROW = 'application/vnd.apache.arrow.stream'
+TAMANHO_LOTE = 65536
+TAMANHO_BLOCO = 1000
+PONTOS_CURVA = 100
+LICITANTES_AMOSTRA = 1024
+
+
+def _exigir_pyarrow(formato):
+    if pyarrow is None:
+        raise ValueError(f"formato {formato} precisa do pacote pyarrow: pip install pyarrow")
+
+
+def instante_parametro(texto):
+    # Limite de intervalo vindo de query string/CLI: ISO ou epoch em ms
+    if not texto:
+        return None
+    return codec.instante(int(texto) if texto.isdigit() else texto)
+
+
+def registros(caminhos, leilao_id=None):
+    # Lances e fechamentos (linhas com "fim"), na ordem dos arquivos
+    for caminho in caminhos:
+        if not os.path.exists(caminho):
+            continue
+        with open(caminho, 'rb') as arquivo:
+            for linha in arquivo:
+                # Linha ainda sendo escrita pelo MS
+                if not linha.endswith(b'\n'):
+                    break
+                registro = codec.de_json(linha)
+                if leilao_id is not None and str(registro.get('leilao_id')) != str(leilao_id):
+                    continue
+                yield registro
+
+
+def lances(caminhos, leilao_id=None, desde=None, ate=None, fins=None):
+    # Com `fins`, guarda nele o fechamento de cada leilão encontrado
+    for registro in registros(caminhos, leilao_id):
+        if 'fim' in registro:
+            if fins is not None:
+                fins[registro.get('leilao_id')] = registro
+            continue
+        instante = codec.instante(registro.get('timestamp'))
+        if (desde is not None and instante < desde) or (ate is not None and instante >= ate):
+            continue
+        registro['instante'] = instante
+        yield registro
+
+
+def para_ndjson(itens, tamanho_bloco=TAMANHO_BLOCO):
+    bloco = []
+    for item in itens:
+        bloco.append(codec.para_json(item))
+        if len(bloco) == tamanho_bloco:
+            yield b'\n'.join(bloco) + b'\n'
+            bloco = []
+    if bloco:
+        yield b'\n'.join(bloco) + b'\n'
+
+
+def _esquema():
+    return pyarrow.schema([
+        ('leilao_id', pyarrow.string()),
+        ('user_id', pyarrow.string()),
+        ('valor', pyarrow.float64()),
+        ('timestamp', pyarrow.string()),
+        ('instante', pyarrow.float64()),
+    ])
+
+
+def _lotes(itens, tamanho_lote):
+    # Lotes colunares de até tamanho_lote lances
+    esquema = _esquema()
+    colunas = {campo: [] for campo in esquema.names}
+    for lance in itens:
+        colunas['leilao_id'].append(str(lance.get('leilao_id')))
+        colunas['user_id'].append(str(lance.get('user_id')))
+        colunas['valor'].append(lance.get('valor'))
+        colunas['timestamp'].append(str(lance.get('timestamp')))
+        colunas['instante'].append(lance.get('instante'))
+        if len(colunas['valor']) == tamanho_lote:
+            yield pyarrow.RecordBatch.from_pydict(colunas, schema=esquema)
+            colunas = {campo: [] for campo in esquema.names}
+    if colunas['valor']:
+        yield pyarrow.RecordBatch.from_pydict(colunas, schema=esquema)
+
+
+def para_arrow(itens, tamanho_lote=TAMANHO_LOTE):
+    # Stream IPC do Arrow: devolve os bytes de cada lote assim que fica pronto.
+    # A falta do pyarrow é apontada já na chamada, não no meio da resposta.
+    _exigir_pyarrow('arrow')
+    return _blocos_arrow(itens, tamanho_lote)
+
+
+def _blocos_arrow(itens, tamanho_lote):
+    buffer = io.BytesIO()
+    with pyarrow.ipc.new_stream(buffer, _esquema()) as escritor:
+        for lote in _lotes(itens, tamanho_lote):
+            escritor.write_batch(lote)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def escrever_parquet(itens, destino, tamanho_lote=TAMANHO_LOTE):
+    _exigir_pyarrow('parquet')
+    quantidade = 0
+    with pyarrow.parquet.ParquetWriter(destino, _esquema()) as escritor:
+        for lote in _lotes(itens, tamanho_lote):
+            escritor.write_batch(lote)
+            quantidade += lote.num_rows
+    return quantidade
+
+
+class ContagemDistinta:
+    # Sketch KMV: guarda só os `amostra` menores hashes de 64 bits vistos. O
+    # hash() do Python muda entre processos, mas um resumo vive numa passada só
+    __slots__ = ('amostra', '_hashes', '_maiores', '_descartou')
+
+    def __init__(self, amostra=LICITANTES_AMOSTRA):
+        self.amostra = amostra
+        self._hashes = set()
+        self._maiores = []      # heap com os hashes guardados, negativos
+        self._descartou = False
+
+    def adicionar(self, valor):
+        codigo = hash(str(valor)) & 0xFFFFFFFFFFFFFFFF
+        if codigo in self._hashes:
+            return
+        if len(self._hashes) < self.amostra:
+            self._hashes.add(codigo)
+            heapq.heappush(self._maiores, -codigo)
+            return
+        self._descartou = True
+        if codigo < -self._maiores[0]:
+            self._hashes.remove(-heapq.heapreplace(self._maiores, -codigo))
+            self._hashes.add(codigo)
+
+    def exata(self):
+        return not self._descartou
+
+    def estimativa(self):
+        if self.exata():
+            return len(self._hashes)
+        # (k - 1) / (k-ésimo menor hash, normalizado para [0, 1))
+        return round((self.amostra - 1) * 2 ** 64 / (-self._maiores[0] + 1))
+
+
+class ResumoLeilao:
+    __slots__ = ('leilao_id', 'quantidade', 'licitantes', 'primeiro', 'ultimo',
+                 'valor_inicial', 'valor_final', 'fim', 'vencedor_id', 'curva', 'passo')
+
+    def __init__(self, leilao_id):
+        self.leilao_id = leilao_id
+        self.quantidade = 0
+        self.licitantes = ContagemDistinta()
+        self.primeiro = None
+        self.ultimo = None
+        self.valor_inicial = None
+        self.valor_final = None
+        self.fim = None
+        self.vencedor_id = None
+        self.curva = []
+        self.passo = 1
+
+    def adicionar(self, user_id, valor, instante):
+        if self.quantidade == 0:
+            self.primeiro = instante
+            self.valor_inicial = valor
+        # Guarda um ponto a cada `passo` lances; ao passar do limite, descarta
+        # metade dos pontos e dobra o passo
+        if self.quantidade % self.passo == 0:
+            self.curva.append([instante, valor])
+            if len(self.curva) > 2 * PONTOS_CURVA:
+                self.curva = self.curva[::2]
+                self.passo *= 2
+        self.quantidade += 1
+        self.licitantes.adicionar(user_id)
+        self.ultimo = instante
+        self.valor_final = valor
+
+    def adicionar_bloco(self, user_ids, instantes, valores):
+        # Os lances do leilão num bloco do pyarrow, na ordem do arquivo. A
+        # curva fica com os mesmos pontos de adicionar() lance a lance: os
+        # lances de posição múltipla do menor passo que cabe em 2 * PONTOS_CURVA
+        quantidade = len(valores)
+        if self.quantidade == 0:
+            self.primeiro = instantes[0].as_py()
+            self.valor_inicial = valores[0].as_py()
+        total = self.quantidade + quantidade
+        passo = self.passo
+        while -(-total // passo) > 2 * PONTOS_CURVA:
+            passo *= 2
+        self.curva = self.curva[::passo // self.passo]
+        self.passo = passo
+        posicoes = pyarrow.array(range((-self.quantidade) % passo, quantidade, passo), pyarrow.int64())
+        self.curva.extend(
+            [instante, valor]
+            for instante, valor in zip(instantes.take(posicoes).to_pylist(), valores.take(posicoes).to_pylist())
+        )
+        self.quantidade = total
+        for user_id in pyarrow.compute.unique(user_ids).to_pylist():
+            self.licitantes.adicionar(user_id)
+        self.ultimo = instantes[-1].as_py()
+        self.valor_final = valores[-1].as_py()
+
+    def como_dict(self):
+        curva = self.curva
+        if self.quantidade and curva[-1] != [self.ultimo, self.valor_final]:
+            curva = curva + [[self.ultimo, self.valor_final]]
+        return {
+            "leilao_id": self.leilao_id,
+            "lances": self.quantidade,
+            "licitantes": self.licitantes.estimativa(),
+            "licitantes_estimado": not self.licitantes.exata(),
+            "primeiro_lance": self.primeiro,
+            "ultimo_lance": self.ultimo,
+            "valor_inicial": self.valor_inicial,
+            "valor_final": self.valor_final,
+            "fim": self.fim,
+            "vencedor_id": self.vencedor_id,
+            "segundos_ate_fim": self.fim - self.ultimo if self.fim is not None and self.ultimo is not None else None,
+            "curva": curva
+        }
+
+
+def _agregar_bloco(por_leilao, bloco):
+    # Ordena o bloco por leilão (ordenação estável: cada leilão mantém a ordem
+    # do arquivo) e entrega a fatia de cada um ao seu resumo
+    chaves = pyarrow.array([str(lance.get('leilao_id')) for lance in bloco], pyarrow.string())
+    ordem = pyarrow.compute.sort_indices(chaves)
+    chaves = chaves.take(ordem)
+    user_ids = pyarrow.array([str(lance.get('user_id')) for lance in bloco], pyarrow.string()).take(ordem)
+    instantes = pyarrow.array([lance['instante'] for lance in bloco], pyarrow.float64()).take(ordem)
+    valores = pyarrow.array([lance.get('valor') for lance in bloco], pyarrow.float64()).take(ordem)
+
+    trocas = pyarrow.compute.not_equal(chaves[1:], chaves[:-1])
+    inicios = [0] + [posicao + 1 for posicao in pyarrow.compute.indices_nonzero(trocas).to_pylist()]
+    for inicio, fim in zip(inicios, inicios[1:] + [len(bloco)]):
+        chave = chaves[inicio].as_py()
+        resumo = por_leilao.get(chave)
+        if resumo is None:
+            resumo = por_leilao[chave] = ResumoLeilao(bloco[ordem[inicio].as_py()].get('leilao_id'))
+        tamanho = fim - inicio
+        resumo.adicionar_bloco(
+            user_ids.slice(inicio, tamanho), instantes.slice(inicio, tamanho), valores.slice(inicio, tamanho)
+        )
+
+
+def resumos(caminhos, leilao_id=None, desde=None, ate=None, tamanho_lote=TAMANHO_LOTE):
+    # Uma passada pelo histórico; guarda um ResumoLeilao por leilão, não os lances
+    por_leilao = {}
+    fins = {}
+    itens = lances(caminhos, leilao_id, desde, ate, fins)
+    if pyarrow is not None:
+        while True:
+            bloco = list(itertools.islice(itens, tamanho_lote))
+            if not bloco:
+                break
+            _agregar_bloco(por_leilao, bloco)
+        # Chave dos fechamentos igual à dos blocos
+        fins = {str(chave): fechamento for chave, fechamento in fins.items()}
+    else:
+        for lance in itens:
+            chave = lance.get('leilao_id')
+            resumo = por_leilao.get(chave)
+            if resumo is None:
+                resumo = por_leilao[chave] = ResumoLeilao(chave)
+            resumo.adicionar(lance.get('user_id'), lance.get('valor'), lance['instante'])
+
+    for chave, resumo in por_leilao.items():
+        fechamento = fins.get(chave)
+        if fechamento is not None:
+            resumo.fim = fechamento['fim']
+            resumo.vencedor_id = fechamento.get('vencedor_id')
+        yield resumo.como_dict()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta o histórico de lances do MS lance")
+    parser.add_argument('arquivos', nargs='+', help="arquivos NDJSON do LANCE_HISTORICO_ARQUIVO")
+    parser.add_argument('--leilao')
+    parser.add_argument('--desde', help="ISO ou epoch em ms")
+    parser.add_argument('--ate', help="ISO ou epoch em ms (exclusivo)")
+    parser.add_argument('--formato', choices=['ndjson', 'arrow', 'parquet'], default='ndjson')
+    parser.add_argument('--saida', help="arquivo de saída (padrão: stdout; obrigatório para parquet)")
+    parser.add_argument('--resumo', action='store_true', help="resumo por leilão em vez dos lances")
+    parser.add_argument('--tamanho-lote', type=int, default=TAMANHO_LOTE)
+    args = parser.parse_args()
+
+    filtros = dict(leilao_id=args.leilao, desde=instante_parametro(args.desde), ate=instante_parametro(args.ate))
+
+    if args.resumo:
+        blocos = para_ndjson(resumos(args.arquivos, **filtros))
+    elif args.formato == 'parquet':
+        if not args.saida:
+            parser.error("--formato parquet precisa de --saida")
+        quantidade = escrever_parquet(lances(args.arquivos, **filtros), args.saida, args.tamanho_lote)
+        print(f"{quantidade} lances gravados em {args.saida}", file=sys.stderr)
+        return
+    elif args.formato == 'arrow':
+        blocos = para_arrow(lances(args.arquivos, **filtros), args.tamanho_lote)
+    else:
+        blocos = para_ndjson(lances(args.arquivos, **filtros))
+
+    saida = open(args.saida, 'wb') if args.saida else sys.stdout.buffer
+    try:
+        for bloco in blocos:
+            saida.write(bloco)
+    finally:
+        if args.saida:
+            saida.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import array
+import math
+import threading
+import time
+from metricas import registro
+
+# Token bucket por chave (usuário, leilão) numa tabela de tamanho fixo: a
+# chave é espalhada em `posicoes` baldes, então a memória não cresce com o
+# número de usuários. Chaves que caem no mesmo balde dividem o limite, o que
+# só erra para o lado de recusar; com a tabela bem maior que o número de
+# chaves ativas por segundo isso é raro. Com taxa 0 o limite fica desligado.
+recusas = registro.contador(
+    'limite_taxa_recusas_total', 'Pedidos recusados pelo limite de taxa', ('limite',)
+)
+
+
+class LimitadorTaxa:
+    def __init__(self, taxa, rajada=None, posicoes=65536, nome='limite'):
+        self.taxa = taxa
+        self.rajada = max(rajada or taxa, 1)
+        self.nome = nome
+        self._fichas = array.array('d', [self.rajada]) * posicoes
+        self._instantes = array.array('d', [0.0]) * posicoes
+        self._trava = threading.Lock()
+
+    def consumir(self, chave, agora=None):
+        # 0 se o pedido pode passar; senão os segundos até a próxima ficha
+        if not self.taxa:
+            return 0
+        agora = time.monotonic() if agora is None else agora
+        posicao = hash(chave) % len(self._fichas)
+
+        with self._trava:
+            fichas = min(self.rajada, self._fichas[posicao] + (agora - self._instantes[posicao]) * self.taxa)
+            self._instantes[posicao] = agora
+            if fichas >= 1:
+                self._fichas[posicao] = fichas - 1
+                return 0
+            self._fichas[posicao] = fichas
+
+        recusas.inc(limite=self.nome)
+        return (1 - fichas) / self.taxa
+
+    def devolver(self, chave):
+        # Devolve a ficha de um pedido que passou aqui mas foi recusado por
+        # outro limite, para ele não contar contra esta chave
+        if not self.taxa:
+            return
+        posicao = hash(chave) % len(self._fichas)
+        with self._trava:
+            self._fichas[posicao] = min(self.rajada, self._fichas[posicao] + 1)
+
+
+def retry_after(espera):
+    # Valor do cabeçalho Retry-After (segundos inteiros)
+    return str(max(1, math.ceil(espera)))
@@ -0,0 +1,122 @@
+import time
+from metricas import registro
+
+# No BlockingChannel o confirm_delivery espera a confirmação de cada
+# basic_publish, o que volta a custar uma ida ao broker por lance. Por isso o
+# lote usa uma transação AMQP: as publicações e o ack (multiple=True) das
+# entregas processadas são confirmados juntos por um único tx_commit.
+# Ganchos opcionais rodam antes do commit (ex.: gravar o diário em disco) e
+# depois dele (ex.: avisar quem espera um resultado já confirmado).
+INTERVALO_RELATORIO = 10
+
+duracao_descarga = registro.histograma(
+    'lote_descarga_segundos', 'Da primeira entrega do lote até o tx_commit', ('lote',)
+)
+tamanho_lote = registro.histograma(
+    'lote_entregas', 'Entregas confirmadas por lote', ('lote',),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+)
+
+
+class LoteConfirmacao:
+    def __init__(self, connection, channel, tamanho_maximo, janela, nome='lote',
+                 antes_de_confirmar=None, depois_de_confirmar=None):
+        self.connection = connection
+        self.channel = channel
+        self.tamanho_maximo = tamanho_maximo
+        self.janela = janela
+        self.nome = nome
+        self.antes_de_confirmar = antes_de_confirmar
+        self.depois_de_confirmar = depois_de_confirmar
+
+        self.ultima_tag = None
+        self.entregas = 0
+        self.publicacoes = 0
+        self.inicio = None
+        self.timer = None
+
+        self.total_lotes = 0
+        self.total_entregas = 0
+        self.latencia_total = 0.0
+        self.latencia_maxima = 0.0
+        self.ultimo_relatorio = time.monotonic()
+
+        channel.tx_select()
+
+    def publicar(self, exchange, routing_key, body, properties=None):
+        self.channel.basic_publish(
+            exchange=exchange,
+            routing_key=routing_key,
+            body=body,
+            properties=properties
+        )
+        self.publicacoes += 1
+
+    def confirmar(self, delivery_tag):
+        # O ack só sai no próximo descarregar(), junto com as publicações
+        self.ultima_tag = delivery_tag
+        self.entregas += 1
+
+        if self.inicio is None:
+            self.inicio = time.perf_counter()
+            self.timer = self.connection.call_later(self.janela, self._expirar_janela)
+
+        if self.entregas >= self.tamanho_maximo:
+            self.descarregar()
+
+    def _expirar_janela(self):
+        self.timer = None
+        self.descarregar()
+
+    def descarregar(self):
+        if self.timer is not None:
+            self.connection.remove_timeout(self.timer)
+            self.timer = None
+
+        if self.ultima_tag is None and not self.publicacoes:
+            return
+
+        if self.antes_de_confirmar is not None:
+            self.antes_de_confirmar()
+        if self.ultima_tag is not None:
+            self.channel.basic_ack(delivery_tag=self.ultima_tag, multiple=True)
+        self.channel.tx_commit()
+        if self.depois_de_confirmar is not None:
+            self.depois_de_confirmar()
+
+        latencia = time.perf_counter() - self.inicio if self.inicio is not None else 0.0
+        self.total_lotes += 1
+        self.total_entregas += self.entregas
+        self.latencia_total += latencia
+        self.latencia_maxima = max(self.latencia_maxima, latencia)
+        duracao_descarga.observar(latencia, lote=self.nome)
+        tamanho_lote.observar(self.entregas, lote=self.nome)
+
+        self.ultima_tag = None
+        self.entregas = 0
+        self.publicacoes = 0
+        self.inicio = None
+
+        self._relatar()
+
+    def estatisticas(self):
+        lotes = self.total_lotes or 1
+        return {
+            "lotes": self.total_lotes,
+            "entregas": self.total_entregas,
+            "tamanho_medio": self.total_entregas / lotes,
+            "latencia_media_ms": self.latencia_total / lotes * 1000,
+            "latencia_maxima_ms": self.latencia_maxima * 1000
+        }
+
+    def _relatar(self):
+        agora = time.monotonic()
+        if agora - self.ultimo_relatorio < INTERVALO_RELATORIO:
+            return
+        self.ultimo_relatorio = agora
+
+        stats = self.estatisticas()
+        print(
+            f"[{self.nome}] {stats['lotes']} lotes, tamanho médio {stats['tamanho_medio']:.1f}, "
+            f"descarga média {stats['latencia_media_ms']:.2f} ms (máx {stats['latencia_maxima_ms']:.2f} ms)"
+        )
@@ -0,0 +1,312 @@
+import bisect
+import cProfile
+import functools
+import inspect
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Métricas no formato texto do Prometheus, compartilhadas pelos MS. Cada MS
+# expõe o registro em GET /metrics (o ms_notif, que não tem Flask, sobe um
+# http.server só para isso). Os módulos pedem as métricas pelo nome; pedir
+# de novo devolve a mesma métrica.
+#
+# Com PERFIL_AMOSTRAGEM > 0, essa fração das chamadas instrumentadas roda sob
+# o cProfile e o acumulado por callback sai em GET /perfil.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+BUCKETS_PADRAO = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PERFIL_AMOSTRAGEM = float(os.environ.get('PERFIL_AMOSTRAGEM', '0'))
+
+
+def _formatar_rotulos(nomes, valores, extra=None):
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._trava = threading.Lock()
+        self._valores = {}
+
+    def _chave(self, rotulos):
+        return tuple(rotulos.get(nome, '') for nome in self.rotulos)
+
+    def amostras(self):
+        with self._trava:
+            return list(self._valores.items())
+
+    def texto(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        for chave, valor in self.amostras():
+            linhas.append(f"{self.nome}{_formatar_rotulos(self.rotulos, chave)} {_numero(valor)}")
+        return linhas
+
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def inc(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._trava:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+
+class Medidor(_Metrica):
+    # funcao, se definida, é chamada na coleta: devolve um número ou, com
+    # rótulos, um dict {tupla de valores dos rótulos: número}
+    tipo = 'gauge'
+
+    def __init__(self, nome, ajuda, rotulos=(), funcao=None):
+        super().__init__(nome, ajuda, rotulos)
+        self.funcao = funcao
+
+    def definir(self, valor, **rotulos):
+        with self._trava:
+            self._valores[self._chave(rotulos)] = valor
+
+    def amostras(self):
+        if self.funcao is None:
+            return super().amostras()
+        try:
+            valor = self.funcao()
+        except Exception:
+            return []
+        return list(valor.items()) if isinstance(valor, dict) else [((), valor)]
+
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, rotulos=(), buckets=BUCKETS_PADRAO):
+        super().__init__(nome, ajuda, rotulos)
+        self.buckets = tuple(sorted(buckets))
+
+    def observar(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._trava:
+            serie = self._valores.get(chave)
+            if serie is None:
+                # contagens por bucket (+Inf no fim), soma
+                serie = self._valores[chave] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][indice] += 1
+            serie[1] += valor
+
+    def cronometrar(self, **rotulos):
+        return _Cronometro(self, rotulos)
+
+    def texto(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        with self._trava:
+            series = [(chave, list(contagens), soma) for chave, (contagens, soma) in self._valores.items()]
+        for chave, contagens, soma in series:
+            acumulado = 0
+            for limite, contagem in zip(self.buckets + (float('inf'),), contagens):
+                acumulado += contagem
+                rotulos = _formatar_rotulos(self.rotulos, chave, f'le="{_numero(limite)}"')
+                linhas.append(f"{self.nome}_bucket{rotulos} {acumulado}")
+            rotulos = _formatar_rotulos(self.rotulos, chave)
+            linhas.append(f"{self.nome}_sum{rotulos} {_numero(soma)}")
+            linhas.append(f"{self.nome}_count{rotulos} {acumulado}")
+        return linhas
+
+
+class _Cronometro:
+    __slots__ = ('histograma', 'rotulos', 'inicio')
+
+    def __init__(self, histograma, rotulos):
+        self.histograma = histograma
+        self.rotulos = rotulos
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histograma.observar(time.perf_counter() - self.inicio, **self.rotulos)
+
+
+class Registro:
+    def __init__(self):
+        self._trava = threading.Lock()
+        self._metricas = {}
+
+    def _obter(self, classe, nome, *args, **kwargs):
+        with self._trava:
+            metrica = self._metricas.get(nome)
+            if metrica is None:
+                metrica = self._metricas[nome] = classe(nome, *args, **kwargs)
+            return metrica
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self._obter(Contador, nome, ajuda, rotulos)
+
+    def medidor(self, nome, ajuda, rotulos=(), funcao=None):
+        return self._obter(Medidor, nome, ajuda, rotulos, funcao)
+
+    def histograma(self, nome, ajuda, rotulos=(), buckets=BUCKETS_PADRAO):
+        return self._obter(Histograma, nome, ajuda, rotulos, buckets)
+
+    def texto(self):
+        with self._trava:
+            metricas = list(self._metricas.values())
+        linhas = []
+        for metrica in metricas:
+            linhas.extend(metrica.texto())
+        return '\n'.join(linhas) + '\n'
+
+
+registro = Registro()
+
+# Métricas comuns a todos os MS
+duracao_callback = registro.histograma(
+    'callback_duracao_segundos', 'Duração dos callbacks de consumo e das rotas', ('callback',)
+)
+erros_callback = registro.contador(
+    'callback_erros_total', 'Exceções que escaparam de um callback instrumentado', ('callback',)
+)
+erros = registro.contador(
+    'erros_total', 'Erros tratados (impressos ou ignorados) por origem', ('origem',)
+)
+profundidade_fila = registro.medidor(
+    'fila_mensagens', 'Mensagens prontas na fila do broker', ('fila',)
+)
+
+
+def registrar_erro(origem, erro):
+    erros.inc(origem=origem)
+    print(f"Erro em {origem}: {erro}")
+
+
+# Perfil por amostragem: um único perfilador ativo por vez, e o resultado é
+# somado ao acumulado do callback
+_perfis = {}
+_trava_perfil = threading.Lock()
+_perfilando = threading.Lock()
+
+
+def _executar_com_perfil(nome, funcao, args, kwargs):
+    if not _perfilando.acquire(blocking=False):
+        return funcao(*args, **kwargs)
+    try:
+        perfil = cProfile.Profile()
+        try:
+            return perfil.runcall(funcao, *args, **kwargs)
+        finally:
+            with _trava_perfil:
+                if nome in _perfis:
+                    _perfis[nome].add(perfil)
+                else:
+                    _perfis[nome] = pstats.Stats(perfil)
+    finally:
+        _perfilando.release()
+
+
+def perfil_texto(limite=25):
+    saida = io.StringIO()
+    with _trava_perfil:
+        for nome, estatisticas in _perfis.items():
+            saida.write(f"==== {nome} ====\n")
+            estatisticas.stream = saida
+            estatisticas.sort_stats('cumulative').print_stats(limite)
+    return saida.getvalue() or "perfil desativado ou sem amostras (PERFIL_AMOSTRAGEM)\n"
+
+
+def instrumentar(nome):
+    # Decorador dos callback_* e rotas: duração, exceções e perfil amostrado.
+    # Em corrotinas (rotas ASGI) só duração e exceções: o cProfile não
+    # acompanha a corrotina entre um await e outro
+    def decorador(funcao):
+        if inspect.iscoroutinefunction(funcao):
+            @functools.wraps(funcao)
+            async def envoltorio_async(*args, **kwargs):
+                inicio = time.perf_counter()
+                try:
+                    return await funcao(*args, **kwargs)
+                except Exception:
+                    erros_callback.inc(callback=nome)
+                    raise
+                finally:
+                    duracao_callback.observar(time.perf_counter() - inicio, callback=nome)
+            return envoltorio_async
+
+        @functools.wraps(funcao)
+        def envoltorio(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                if PERFIL_AMOSTRAGEM and random.random() < PERFIL_AMOSTRAGEM:
+                    return _executar_com_perfil(nome, funcao, args, kwargs)
+                return funcao(*args, **kwargs)
+            except Exception:
+                erros_callback.inc(callback=nome)
+                raise
+            finally:
+                duracao_callback.observar(time.perf_counter() - inicio, callback=nome)
+        return envoltorio
+    return decorador
+
+
+def monitorar_filas(connection, channel, filas, intervalo=5.0):
+    # Consulta passiva da profundidade das filas, pela thread dona do canal
+    def consultar():
+        for fila in filas:
+            try:
+                resultado = channel.queue_declare(queue=fila, passive=True)
+                profundidade_fila.definir(resultado.method.message_count, fila=fila)
+            except Exception as e:
+                registrar_erro('monitorar_filas', e)
+        connection.call_later(intervalo, consultar)
+
+    connection.call_later(0, consultar)
+
+
+def exposicao():
+    return registro.texto(), CONTENT_TYPE
+
+
+class _TratadorMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            corpo, content_type = exposicao()
+        elif self.path == '/perfil':
+            corpo, content_type = perfil_texto(), 'text/plain; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+        dados = corpo.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def log_message(self, *args):
+        pass
+
+
+def servir_metricas(porta, host='0.0.0.0'):
+    # Para MS sem servidor HTTP próprio
+    servidor = ThreadingHTTPServer((host, porta), _TratadorMetricas)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
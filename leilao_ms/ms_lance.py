@@ -1,9 +1,28 @@
-import pika
-import json
+import os
+import time
 import threading
-from datetime import datetime
-from flask import Flask, request, jsonify
+import multiprocessing
+import uuid
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
+from estado_leiloes import EstadoLeiloes
+from deduplicacao import CacheDeduplicacao
+from espera_resultados import EsperaResultados
+from limite_taxa import LimitadorTaxa, retry_after
+from lote_confirmacao import LoteConfirmacao
+import metricas
+from metricas import instrumentar, registrar_erro
+import codec
+import exportacao_lances
+import snapshot_leiloes
+from persistencia import Diario
+from publicador import Publicador
+from runtime_amqp import Consumidor, declarar_exchanges, declarar_fila_propria
+from registro_lances import RegistroLances, HistoricoEmDisco
+from particionamento import (
+    particao_do_leilao, nome_particao, routing_key_particao,
+    declarar_filas_particionadas, criar_callback_roteador
+)
 
 app = Flask(__name__)
 CORS(app)
@@ -11,218 +30,804 @@ CORS(app)
 connection = None
 channel = None
 running = True
-leiloes_ativos = {}
-lances_por_leilao = {}
+leiloes_ativos = EstadoLeiloes()
+lances_por_leilao = EstadoLeiloes()
 
-def conectar_rabbitmq():
-    global connection, channel
-    try:
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters('localhost')
-        )
-        channel = connection.channel()
-        
-        channel.exchange_declare(exchange='leilao_iniciado', exchange_type='fanout')
-        channel.exchange_declare(exchange='leilao', exchange_type='direct')
-        
-        channel.queue_declare(queue='lance_realizado', durable=True)
-        channel.queue_declare(queue='leilao_finalizado', durable=True)
-        
-        result = channel.queue_declare(queue='', exclusive=True)
-        queue_leilao_iniciado = result.method.queue
-        channel.queue_bind(exchange='leilao_iniciado', queue=queue_leilao_iniciado)
+# Com LANCE_PARTICOES > 1 os lances são divididos por leilao_id entre N
+# processos validadores; cada um é dono apenas da sua fatia dos leilões.
+PARTICOES = int(os.environ.get('LANCE_PARTICOES', '1'))
+particao = None
+
+# Lances são validados em lotes: o broker entrega até PREFETCH mensagens e os
+# resultados são confirmados a cada LOTE_MAXIMO entregas ou LOTE_JANELA segundos
+PREFETCH = int(os.environ.get('LANCE_PREFETCH', '256'))
+LOTE_MAXIMO = int(os.environ.get('LANCE_LOTE_MAXIMO', '128'))
+LOTE_JANELA = float(os.environ.get('LANCE_LOTE_JANELA', '0.005'))
+canal_lote = None
+lote = None
+
+# Quantos lances recentes cada leilão mantém em memória (0 = nenhum) e, se
+# definido, o arquivo NDJSON que recebe o histórico completo
+HISTORICO_MAXIMO = int(os.environ.get('LANCE_HISTORICO_MAXIMO', '0'))
+HISTORICO_ARQUIVO = os.environ.get('LANCE_HISTORICO_ARQUIVO')
+historico_disco = None
+
+# Diário em disco com os leilões ativos e os lances aceitos (vazio desativa).
+# É gravado junto com cada lote, antes do commit no broker; depois do commit
+# vai a marca lote_confirmado. Na recuperação, os eventos de lote sem a marca
+# são descartados: o processo caiu entre os dois commits, as entregas voltam
+# da fila e os lances precisam receber um veredito de novo.
+DIARIO = os.environ.get('LANCE_DIARIO', 'ms_lance.db')
+SNAPSHOT_A_CADA = int(os.environ.get('LANCE_SNAPSHOT_A_CADA', '10000'))
+diario = None
+
+# Alterações do lote aberto no pipeline de lances. O estado em memória muda na
+# hora, porque os próximos lances do lote são validados contra ele, mas só vale
+# depois do tx_commit. Se o commit não acontecer (queda da conexão), as
+# entregas voltam da fila e desfazer_lote() devolve os leilões tocados ao que
+# eram, tira do diário os eventos do lote e descarta as linhas do histórico.
+anteriores_lote = {}    # leilao_id -> (leilão, registro, fim encerrando) antes do lote
+eventos_lote = []       # seqs do diário registrados pelo lote
+ids_lote = set()        # ids dos lances processados pelo lote
+EVENTOS_LOTE = ('lance', 'leilao_encerrando', 'leilao_finalizado')
+eventos_recuperados = []    # eventos de lote lidos do diário ainda sem a marca
+
+# Ids dos lances já processados: uma reentrega (ex.: queda antes do ack) é
+# confirmada sem ser validada de novo. Os ids dos lances aceitos vão no diário
+# e no snapshot, então sobrevivem a um reinício. Capacidade 0 desativa. Os ids
+# do lote aberto só entram no cache depois do tx_commit: se o commit falhar, a
+# reentrega precisa ser validada de novo.
+DEDUP_CAPACIDADE = int(os.environ.get('LANCE_DEDUP_CAPACIDADE', '100000'))
+DEDUP_TTL = float(os.environ.get('LANCE_DEDUP_TTL', '600'))
+lances_vistos = CacheDeduplicacao(DEDUP_CAPACIDADE, DEDUP_TTL, nome='lance_realizado')
+
+# Entrada do POST /lances: antes de publicar, recusa na hora (409) o lance que
+# não supera o preço atual conhecido e aplica token buckets por usuário e por
+# leilão (429). O preço vem do próprio estado quando o validador roda neste
+# processo; com partições, o roteador mantém um cache alimentado pelos
+# lance_validado. O validador continua decidindo: o cache só descarta lances
+# que com certeza perderiam. Taxa 0 desliga o limite correspondente.
+LIMITE_USUARIO = float(os.environ.get('LANCE_LIMITE_USUARIO', '10'))
+RAJADA_USUARIO = float(os.environ.get('LANCE_RAJADA_USUARIO', '20'))
+LIMITE_LEILAO = float(os.environ.get('LANCE_LIMITE_LEILAO', '1000'))
+RAJADA_LEILAO = float(os.environ.get('LANCE_RAJADA_LEILAO', '2000'))
+POSICOES_LIMITE = int(os.environ.get('LANCE_LIMITE_POSICOES', '65536'))
+limite_usuarios = LimitadorTaxa(LIMITE_USUARIO, RAJADA_USUARIO, POSICOES_LIMITE, nome='usuario')
+limite_leiloes = LimitadorTaxa(LIMITE_LEILAO, RAJADA_LEILAO, POSICOES_LIMITE, nome='leilao')
+precos_atuais = {}
+lances_recusados = metricas.registro.contador(
+    'lances_recusados_entrada_total', 'Lances recusados no POST /lances, antes da fila', ('motivo',)
+)
+
+# Resposta síncrona: com ?aguardar=1 (ou LANCE_RESPOSTA_SINCRONA=1 para todos
+# os lances) o POST /lances espera o veredito do validador por até
+# RESPOSTA_PRAZO s e responde 201 (lance_validado) ou 409 (lance_invalidado);
+# se o prazo acabar, responde o 202 de sempre e o resultado segue pelo SSE.
+# Com o validador no mesmo processo o veredito chega direto, depois do commit
+# do lote; com partições ele volta por AMQP, na fila exclusiva de respostas do
+# roteador (reply_to), com o id do lance como correlation_id.
+RESPOSTA_SINCRONA = os.environ.get('LANCE_RESPOSTA_SINCRONA') == '1'
+RESPOSTA_PRAZO = float(os.environ.get('LANCE_RESPOSTA_PRAZO', '2'))
+esperas = EsperaResultados(nome='lance')
+fila_respostas = None
+resultados_locais = []
+espera_veredito = metricas.registro.histograma(
+    'lance_resposta_sincrona_segundos', 'Do POST /lances até o veredito devolvido na resposta', ('resultado',)
+)
+
+# Seq do snapshot de leilões ativos carregado na partida: eventos
+# leilao_iniciado até ele já foram aplicados
+seq_snapshot = 0
+
+# Fechamento: só valem lances com timestamp anterior ao fim do leilão. O
+# leilao_finalizado apenas marca o leilão como encerrando; depois de
+# FECHAMENTO_CARENCIA segundos do fim uma cerca (fechamento_leilao) entra na
+# fila de lances, atrás de todo lance já publicado, e o vencedor só é decidido
+# quando ela é consumida. Os leilões encerrando vão no diário e as cercas são
+# republicadas na partida.
+FECHAMENTO_CARENCIA = float(os.environ.get('LANCE_FECHAMENTO_CARENCIA', '0.1'))
+leiloes_encerrando = {}
+decisao_fechamento = metricas.registro.histograma(
+    'fechamento_decisao_segundos', 'Do fim do leilão até a decisão do vencedor'
+)
+
+# /metrics do processo principal sai pelo Flask; cada partição serve as suas
+# em METRICAS_PORTA + número da partição
+METRICAS_PORTA = int(os.environ.get('LANCE_METRICAS_PORTA', '9110'))
+lances_processados = metricas.registro.contador(
+    'lances_total', 'Lances validados por resultado e motivo da rejeição', ('resultado', 'motivo')
+)
+metricas.registro.medidor('leiloes_ativos', 'Leilões ativos nesta partição', funcao=lambda: len(leiloes_ativos))
+
+# Publicações feitas pelas threads do Flask
+publicador = Publicador(declarar_exchanges, nome='ms_lance')
+
+def fila_da_particao(base):
+    if particao is None:
+        return base
+    return nome_particao(base, particao)
+
+def possui_leilao(leilao_id):
+    return particao is None or particao_do_leilao(leilao_id, PARTICOES) == particao
+
+def arquivo_da_particao(caminho):
+    if particao is None:
+        return caminho
+    raiz, extensao = os.path.splitext(caminho)
+    return f"{nome_particao(raiz, particao)}{extensao}"
+
+def registrar_evento(tipo, dados):
+    if diario is not None:
+        diario.registrar(tipo, dados)
+
+def registrar_evento_lote(tipo, dados):
+    if diario is not None:
+        eventos_lote.append(diario.registrar(tipo, dados))
+
+def preservar_leilao(leilao_id):
+    # Guarda o leilão como estava antes da primeira alteração do lote
+    if leilao_id in anteriores_lote:
+        return
+    registro = lances_por_leilao.obter(leilao_id)
+    anteriores_lote[leilao_id] = (
+        leiloes_ativos.obter(leilao_id),
+        registro.copiar() if registro is not None else None,
+        leiloes_encerrando.get(leilao_id)
+    )
+
+def confirmar_diario():
+    # Antes de cada commit no broker
+    if diario is not None:
+        diario.confirmar()
+
+def confirmar_lote():
+    # Depois do tx_commit: o lote passa a valer. O histórico só vai para o
+    # arquivo agora e o snapshot só enxerga estado confirmado
+    if diario is not None and eventos_lote:
+        diario.confirmar(diario.registrar('lote_confirmado', {'ate': eventos_lote[-1]}))
+    anteriores_lote.clear()
+    eventos_lote.clear()
+    for lance_id in ids_lote:
+        lances_vistos.registrar(lance_id)
+    ids_lote.clear()
+    if historico_disco is not None:
+        historico_disco.descarregar()
+    if diario is not None and diario.precisa_snapshot():
+        diario.gravar_snapshot(estado_atual)
+    entregar_resultados()
+
+def desfazer_lote():
+    # O lote não foi confirmado no broker: as entregas voltam da fila e serão
+    # processadas de novo a partir do estado do último commit
+    for leilao_id, (leilao, registro, fim) in anteriores_lote.items():
+        for estado, valor in ((leiloes_ativos, leilao), (lances_por_leilao, registro)):
+            if valor is None:
+                estado.remover(leilao_id)
+            else:
+                estado.definir(leilao_id, valor)
+        if fim is None:
+            leiloes_encerrando.pop(leilao_id, None)
+        else:
+            leiloes_encerrando[leilao_id] = fim
+    if anteriores_lote:
+        print(f"Lote não confirmado: {len(anteriores_lote)} leilões voltaram ao último commit")
+    anteriores_lote.clear()
+    ids_lote.clear()
+    
+    if diario is not None and eventos_lote:
+        diario.descartar(eventos_lote)
+    eventos_lote.clear()
+    if historico_disco is not None:
+        historico_disco.descartar()
+    resultados_locais.clear()
+
+def estado_atual():
+    registros = []
+    for leilao_id, registro in lances_por_leilao.itens():
+        registros.append([
+            leilao_id, registro.melhor_valor, registro.melhor_usuario,
+            registro.melhor_timestamp, registro.quantidade
+        ])
+    return {
+        "leiloes": list(leiloes_ativos.valores()), "registros": registros,
+        "vistos": lances_vistos.itens(), "encerrando": list(leiloes_encerrando.items())
+    }
+
+def restaurar_snapshot(estado):
+    for leilao in estado['leiloes']:
+        lances_por_leilao.definir(leilao['id'], RegistroLances(HISTORICO_MAXIMO))
+        leiloes_ativos.definir(leilao['id'], leilao)
+    for leilao_id, valor, usuario, timestamp, quantidade in estado['registros']:
+        registro = lances_por_leilao.obter(leilao_id)
+        if registro is not None:
+            registro.melhor_valor = valor
+            registro.melhor_usuario = usuario
+            registro.melhor_timestamp = timestamp
+            registro.quantidade = quantidade
+    for lance_id, instante in estado.get('vistos', []):
+        lances_vistos.registrar(lance_id, instante)
+    leiloes_encerrando.update(estado.get('encerrando', []))
+
+def aplicar_evento(tipo, dados):
+    # Os eventos de lote esperam a marca lote_confirmado
+    if tipo in EVENTOS_LOTE:
+        eventos_recuperados.append((tipo, dados))
+    elif tipo == 'lote_confirmado':
+        for evento in eventos_recuperados:
+            aplicar_evento_confirmado(*evento)
+        eventos_recuperados.clear()
+    else:
+        aplicar_evento_confirmado(tipo, dados)
+
+def aplicar_evento_confirmado(tipo, dados):
+    if tipo == 'leilao_iniciado':
+        lances_por_leilao.definir(dados['id'], RegistroLances(HISTORICO_MAXIMO))
+        leiloes_ativos.definir(dados['id'], dados)
+    elif tipo == 'lance':
+        lances_vistos.registrar(dados.get('id'))
+        registro = lances_por_leilao.obter(dados['leilao_id'])
+        if registro is not None:
+            registro.registrar(dados['user_id'], dados['valor'], dados['timestamp'])
+    elif tipo == 'leilao_encerrando':
+        leiloes_encerrando[dados['id']] = dados['fim']
+    elif tipo == 'leilao_finalizado':
+        lances_por_leilao.remover(dados['id'])
+        leiloes_ativos.remover(dados['id'])
+        leiloes_encerrando.pop(dados['id'], None)
+
+def recuperar_estado():
+    global diario
+    diario = Diario(arquivo_da_particao(DIARIO), SNAPSHOT_A_CADA)
+    diario.recuperar(restaurar_snapshot, aplicar_evento)
+    if eventos_recuperados:
+        # Sem a marca, um lote seguinte não pode confirmá-los por engano
+        print(f"{len(eventos_recuperados)} eventos de um lote não confirmado no broker descartados")
+        diario.descartar_sem_marca('lote_confirmado', EVENTOS_LOTE)
+        eventos_recuperados.clear()
+
+def declarar_topologia(channel):
+    # Refeita a cada conexão; devolve a fila de leilao_iniciado da partição
+    # (None no processo roteador)
+    declarar_exchanges(channel)
+    
+    channel.queue_declare(queue='lance_realizado', durable=True)
+    channel.queue_declare(queue='leilao_finalizado', durable=True)
+    
+    channel.queue_bind(exchange='leilao', queue='lance_realizado', routing_key='lance_realizado')
+    channel.queue_bind(exchange='leilao', queue='leilao_finalizado', routing_key='leilao_finalizado')
+    
+    if PARTICOES > 1:
+        declarar_filas_particionadas(channel, 'leilao', 'lance_realizado', PARTICOES)
+        declarar_filas_particionadas(channel, 'leilao', 'leilao_finalizado', PARTICOES)
         
-        channel.queue_bind(exchange='leilao', queue='lance_realizado', routing_key='lance_realizado')
-        channel.queue_bind(exchange='leilao', queue='leilao_finalizado', routing_key='leilao_finalizado')
-        return queue_leilao_iniciado
-    except Exception as e:
-        print(f"Erro ao conectar: {e}")
+        # O processo roteador não valida lances, só encaminha
+        if particao is None:
+            return None
+    
+    # Fila própria da partição: os leilões iniciados enquanto ela estava
+    # desconectada esperam na fila
+    return declarar_fila_propria(channel, fila_da_particao('ms_lance.leilao_iniciado'), 'leilao_iniciado')
+
+def montar_lance(dados):
+    return {
+        "id": dados.get('id'),
+        "leilao_id": dados.get('leilaoId'),
+        "user_id": dados.get('usuarioId'),
+        "valor": dados.get('valor'),
+        "timestamp": dados.get('data', codec.agora())
+    }
+
+def preco_atual(leilao_id):
+    # Melhor lance conhecido do leilão, ou None
+    if particao is None and PARTICOES > 1:
+        return precos_atuais.get(leilao_id)
+    registro = lances_por_leilao.obter(leilao_id)
+    if registro is None or not registro.quantidade:
         return None
+    return registro.melhor_valor
+
+def admitir_lance(lance):
+    # None se o lance segue para a fila; senão (status, corpo, cabeçalhos)
+    espera = limite_usuarios.consumir(lance['user_id'])
+    motivo = 'limite_usuario'
+    if not espera:
+        espera = limite_leiloes.consumir(lance['leilao_id'])
+        motivo = 'limite_leilao'
+        # O lance não entra: a ficha do usuário volta
+        if espera:
+            limite_usuarios.devolver(lance['user_id'])
+    if espera:
+        lances_recusados.inc(motivo=motivo)
+        return 429, {"error": "muitos lances, tente de novo em instantes", "motivo": motivo}, {"Retry-After": retry_after(espera)}
+    
+    preco = preco_atual(lance['leilao_id'])
+    valor = lance['valor']
+    if preco is not None and isinstance(valor, (int, float)) and valor <= preco:
+        lances_recusados.inc(motivo='valor_insuficiente')
+        return 409, {
+            "error": f"valor {valor} não é maior que o último lance ({preco})",
+            "motivo": "valor_insuficiente",
+            "ultimo_lance": preco
+        }, {}
+    return None
+
+def quer_veredito(parametro):
+    # ?aguardar=1/0 na requisição; sem o parâmetro vale LANCE_RESPOSTA_SINCRONA
+    if parametro is None:
+        return RESPOSTA_SINCRONA
+    return parametro.lower() not in ('', '0', 'false', 'nao')
+
+def destino_resposta(lance):
+    # Propriedades AMQP para o veredito voltar a este processo
+    if particao is None and PARTICOES > 1 and fila_respostas:
+        return {'reply_to': fila_respostas, 'correlation_id': lance['id']}
+    return {}
+
+def resposta_veredito(lance, resultado, inicio):
+    # (status, corpo) do POST /lances que esperou o validador
+    if resultado is None:
+        espera_veredito.observar(time.perf_counter() - inicio, resultado='prazo')
+        return 202, lance
+    routing_key, evento = resultado
+    validado = routing_key == 'lance_validado'
+    espera_veredito.observar(time.perf_counter() - inicio, resultado='validado' if validado else 'invalidado')
+    return (201 if validado else 409), {**evento, "id": lance['id'], "resultado": routing_key}
 
 @app.route('/lances', methods=['POST'])
+@instrumentar('criar_lance')
 def criar_lance():
     try:
-        dados = request.json
-        lance_id = dados.get('id')
+        lance = montar_lance(request.json)
+        recusa = admitir_lance(lance)
+        if recusa is not None:
+            status, corpo, cabecalhos = recusa
+            return jsonify(corpo), status, cabecalhos
         
-        lance = {
-            "id": lance_id,
-            "leilao_id": dados.get('leilaoId'),
-            "user_id": dados.get('usuarioId'),
-            "valor": dados.get('valor'),
-            "timestamp": dados.get('data', datetime.now().isoformat())
-        }
+        espera = None
+        extra = {}
+        if quer_veredito(request.args.get('aguardar')):
+            lance['id'] = lance['id'] or str(uuid.uuid4())
+            espera = esperas.abrir(lance['id'])
+            extra = destino_resposta(lance)
+        inicio = time.perf_counter()
+        body, properties = codec.codificar('lance_realizado', lance, **extra)
         
-        channel.basic_publish(
-            exchange='leilao',
-            routing_key='lance_realizado',
-            body=json.dumps(lance)
-        )        
-        return jsonify(lance), 202
+        try:
+            publicador.publicar(
+                exchange='leilao',
+                routing_key=routing_key_particao('lance_realizado', lance['leilao_id'], PARTICOES),
+                body=body,
+                properties=properties,
+                aguardar=True
+            )
+            if espera is None:
+                return jsonify(lance), 202
+            status, corpo = resposta_veredito(lance, espera.aguardar(RESPOSTA_PRAZO), inicio)
+            return jsonify(corpo), status
+        finally:
+            if espera is not None:
+                esperas.fechar(lance['id'])
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-def callback_leilao_iniciado(ch, method, properties, body):
+def arquivos_historico(leilao_id=None):
+    # No processo roteador, os arquivos das partições (só o do dono do leilão, se filtrado)
+    if particao is not None or PARTICOES <= 1:
+        return [arquivo_da_particao(HISTORICO_ARQUIVO)]
+    raiz, extensao = os.path.splitext(HISTORICO_ARQUIVO)
+    numeros = [particao_do_leilao(leilao_id, PARTICOES)] if leilao_id is not None else range(PARTICOES)
+    return [f"{nome_particao(raiz, numero)}{extensao}" for numero in numeros]
+
+def filtros_exportacao(args):
+    return {
+        "leilao_id": args.get('leilao_id') or None,
+        "desde": exportacao_lances.instante_parametro(args.get('desde')),
+        "ate": exportacao_lances.instante_parametro(args.get('ate'))
+    }
+
+@app.route('/lances/historico', methods=['GET'])
+@instrumentar('exportar_historico')
+def exportar_historico():
+    if not HISTORICO_ARQUIVO:
+        return jsonify({"error": "histórico em disco desativado (LANCE_HISTORICO_ARQUIVO)"}), 404
     try:
-        leilao = json.loads(body)
-        leilao_id = leilao.get('id')
-        
-        if leilao_id:
-            leiloes_ativos[leilao_id] = leilao
-            lances_por_leilao[leilao_id] = []
-            print(f"Leilão {leilao_id} registrado como ativo")
+        filtros = filtros_exportacao(request.args)
+        lances = exportacao_lances.lances(arquivos_historico(filtros['leilao_id']), **filtros)
+        if request.args.get('formato') == 'arrow':
+            return Response(exportacao_lances.para_arrow(lances), content_type=exportacao_lances.CONTENT_TYPE_ARROW)
+        return Response(exportacao_lances.para_ndjson(lances), content_type=exportacao_lances.CONTENT_TYPE_NDJSON)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/lances/resumo', methods=['GET'])
+@instrumentar('resumir_historico')
+def resumir_historico():
+    if not HISTORICO_ARQUIVO:
+        return jsonify({"error": "histórico em disco desativado (LANCE_HISTORICO_ARQUIVO)"}), 404
+    try:
+        filtros = filtros_exportacao(request.args)
+        resumos = exportacao_lances.resumos(arquivos_historico(filtros['leilao_id']), **filtros)
+        return Response(exportacao_lances.para_ndjson(resumos), content_type=exportacao_lances.CONTENT_TYPE_NDJSON)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/saude', methods=['GET'])
+def saude():
+    estado = publicador.estado()
+    estado_consumidor = consumidor.estado()
+    saudavel = estado["saudavel"] and estado_consumidor["conectado"]
+    return jsonify({"publicador": estado, "consumidor": estado_consumidor}), 200 if saudavel else 503
+
+@app.route('/metrics', methods=['GET'])
+def expor_metricas():
+    corpo, content_type = metricas.exposicao()
+    return Response(corpo, content_type=content_type)
+
+@app.route('/perfil', methods=['GET'])
+def expor_perfil():
+    return Response(metricas.perfil_texto(), content_type='text/plain; charset=utf-8')
+
+def registrar_leilao_iniciado(leilao, em_lote=False):
+    leilao_id = leilao.get('id')
+    if not leilao_id or not possui_leilao(leilao_id):
+        return False
+    # Já conhecido (diário ou snapshot): não zera os lances
+    seq = leilao.get('seq')
+    if leiloes_ativos.obter(leilao_id) is not None or (seq is not None and seq <= seq_snapshot):
+        return False
+    
+    lances_por_leilao.definir(leilao_id, RegistroLances(HISTORICO_MAXIMO))
+    leiloes_ativos.definir(leilao_id, leilao)
+    registrar_evento('leilao_iniciado', leilao)
+    if not em_lote:
+        confirmar_diario()
+        print(f"Leilão {leilao_id} registrado como ativo")
+    return True
+
+def carregar_leiloes_ativos():
+    # Na partida, com a fila de leilao_iniciado já vinculada: os leilões que
+    # começaram antes deste processo subir
+    global seq_snapshot
+    seq_snapshot = snapshot_leiloes.carregar(lambda leilao: registrar_leilao_iniciado(leilao, em_lote=True))
+    confirmar_diario()
+
+def rejeitar_lance(lance_data, motivo, **extra):
+    lances_processados.inc(resultado='rejeitado', motivo=motivo)
+    lance_invalidado = {
+        'leilao_id': lance_data.get('leilao_id'),
+        'user_id': lance_data.get('user_id'),
+        'valor': lance_data.get('valor'),
+        'motivo': motivo,
+        **extra,
+        'timestamp': codec.agora()
+    }
+    return 'lance_invalidado', lance_invalidado
+
+def validar_lance(lance_data):
+    # Aplica o lance ao estado e devolve (routing_key, evento) a publicar
+    if not lance_data:
+        print("Lance inválido: dados faltando")
+        return None
+    
+    lance_id = lance_data.get('id')
+    if lance_id is not None:
+        if lance_id in ids_lote or lances_vistos.visto(lance_id, guardar=False):
+            print(f"Lance {lance_id} repetido ignorado")
+            lances_processados.inc(resultado='duplicado', motivo='')
+            return None
+        ids_lote.add(lance_id)
+    
+    leilao_id = lance_data.get('leilao_id')
+    user_id = lance_data.get('user_id')
+    valor = lance_data.get('valor')
             
+    leilao = leiloes_ativos.obter(leilao_id)
+    if leilao is None:
+        print(f"Lance rejeitado: leilão {leilao_id} não está ativo")
+        return rejeitar_lance(lance_data, 'leilao_nao_ativo')
+    
+    fim = codec.instante(leilao.get('fim'))
+    try:
+        instante_lance = codec.instante(lance_data.get('timestamp'))
+    except (TypeError, ValueError, AttributeError):
+        # Sem um instante não dá para saber se o lance veio antes do fim
+        print(f"Lance rejeitado: timestamp inválido ({lance_data.get('timestamp')!r})")
+        return rejeitar_lance(lance_data, 'timestamp_invalido')
+    if fim is not None and instante_lance is not None and instante_lance >= fim:
+        print(f"Lance rejeitado: feito depois do fim do leilão {leilao_id}")
+        return rejeitar_lance(lance_data, 'leilao_encerrado')
+    
+    registro = lances_por_leilao.obter(leilao_id)
+    if registro.quantidade and valor <= registro.melhor_valor:
+        print(f"Lance rejeitado: valor {valor} não é maior que o último lance ({registro.melhor_valor})")
+        return rejeitar_lance(lance_data, 'valor_insuficiente', ultimo_lance=registro.melhor_valor)
+    
+    lance_validado = {
+        'leilao_id': leilao_id,
+        'leilao_nome': leilao.get('nome', leilao_id),
+        'user_id': user_id,
+        'valor': valor,
+        'timestamp': codec.agora()
+    }
+    
+    preservar_leilao(leilao_id)
+    with lances_por_leilao.bloqueio(leilao_id):
+        registro.registrar(user_id, valor, lance_validado['timestamp'])
+    registrar_evento_lote('lance', {
+        'id': lance_id, 'leilao_id': leilao_id, 'user_id': user_id,
+        'valor': valor, 'timestamp': lance_validado['timestamp']
+    })
+    if historico_disco is not None:
+        historico_disco.gravar(leilao_id, user_id, valor, lance_validado['timestamp'])
+    
+    lances_processados.inc(resultado='aceito', motivo='')
+    return 'lance_validado', lance_validado
+
+def encerrar_leilao(leilao_id):
+    # Tira o leilão do estado e devolve o evento de vencedor, se houve lances
+    leilao_ativo = leiloes_ativos.obter(leilao_id)
+    if leilao_ativo is None:
+        return None
+    
+    preservar_leilao(leilao_id)
+    evento_vencedor = None
+    registro = lances_por_leilao.remover(leilao_id)
+    fim = leiloes_encerrando.get(leilao_id) or codec.instante(leilao_ativo.get('fim')) or time.time()
+    
+    if registro is not None and registro.quantidade:
+        evento_vencedor = {
+            'leilao_id': leilao_id,
+            'leilao_nome': leilao_ativo.get('nome', leilao_id),
+            'vencedor_id': registro.melhor_usuario,
+            'valor_final': registro.melhor_valor,
+            'timestamp': codec.agora()
+        }
+        print(f"Leilão {leilao_id} finalizado - Vencedor: {registro.melhor_usuario} com valor {registro.melhor_valor} ({registro.quantidade} lances)")
+    else:
+        print(f"Leilão {leilao_id} finalizado sem lances")
+    
+    leiloes_ativos.remover(leilao_id)
+    leiloes_encerrando.pop(leilao_id, None)
+    registrar_evento_lote('leilao_finalizado', {'id': leilao_id})
+    if historico_disco is not None:
+        historico_disco.gravar_fechamento(
+            leilao_id, fim, registro.melhor_usuario if registro else None, registro.melhor_valor if registro else None
+        )
+    
+    return evento_vencedor
+
+def iniciar_fechamento(leilao_id):
+    # leilao_finalizado: devolve (cerca, atraso) ou None se o leilão não é
+    # desta partição ou já está encerrando
+    leilao = leiloes_ativos.obter(leilao_id)
+    if leilao is None or leilao_id in leiloes_encerrando:
+        return None
+    
+    fim = codec.instante(leilao.get('fim')) or time.time()
+    preservar_leilao(leilao_id)
+    leiloes_encerrando[leilao_id] = fim
+    registrar_evento_lote('leilao_encerrando', {'id': leilao_id, 'fim': fim})
+    return cerca_do_leilao(leilao_id)
+
+def cerca_do_leilao(leilao_id):
+    fim = leiloes_encerrando[leilao_id]
+    return {'leilao_id': leilao_id, 'fim': fim}, max(0.0, fim + FECHAMENTO_CARENCIA - time.time())
+
+def fechamentos_pendentes():
+    # Cercas dos leilões que estavam encerrando quando o processo parou
+    return [cerca_do_leilao(leilao_id) for leilao_id in list(leiloes_encerrando)]
+
+def concluir_fechamento(cerca):
+    # A cerca chegou: todo lance publicado antes dela já foi validado
+    leilao_id = cerca.get('leilao_id')
+    if leilao_id not in leiloes_encerrando:
+        return None
+    evento_vencedor = encerrar_leilao(leilao_id)
+    decisao_fechamento.observar(max(0.0, time.time() - cerca['fim']))
+    return evento_vencedor
+
+def processar_lance(dados, tipo):
+    # Mensagens da fila de lances: lances ou a cerca de fechamento de um leilão
+    if tipo == 'fechamento_leilao':
+        evento_vencedor = concluir_fechamento(dados)
+        return ('leilao_vencedor', evento_vencedor) if evento_vencedor else None
+    return validar_lance(dados)
+
+def publicar_cerca(cerca):
+    # Pela exchange e routing key dos lances: com partições, a cerca passa pelo
+    # roteador como os lances do client.py
+    body, properties = codec.codificar('fechamento_leilao', cerca)
+    lote.publicar(exchange='leilao', routing_key='lance_realizado', body=body, properties=properties)
+    lote.descarregar()
+
+def agendar_cerca(cerca, atraso):
+    connection.call_later(atraso, lambda: publicar_cerca(cerca))
+
+@instrumentar('callback_leilao_iniciado')
+def callback_leilao_iniciado(ch, method, properties, body):
+    try:
+        registrar_leilao_iniciado(codec.decodificar(body, properties))
     except Exception as e:
-        print(f"Erro ao processar leilão iniciado: {e}")
+        registrar_erro('callback_leilao_iniciado', e)
+
+def responder_veredito(properties, lance_id, routing_key, evento):
+    # Para um POST /lances que está esperando: pela fila de respostas do
+    # roteador, na mesma transação do lote, ou direto depois do commit
+    if properties.reply_to:
+        body, propriedades = codec.codificar(routing_key, evento, correlation_id=properties.correlation_id)
+        lote.publicar(exchange='', routing_key=properties.reply_to, body=body, properties=propriedades)
+    elif lance_id is not None and esperas.aguardando(lance_id):
+        resultados_locais.append((lance_id, (routing_key, evento)))
+
+def entregar_resultados():
+    # Depois do tx_commit: o veredito entregue já está no diário e na fila
+    while resultados_locais:
+        esperas.resolver(*resultados_locais.pop())
 
+@instrumentar('callback_lance_realizado')
 def callback_lance_realizado(ch, method, properties, body):
     try:
-        lance_data = json.loads(body)
+        dados = codec.decodificar(body, properties)
+        resultado = processar_lance(dados, properties.type)
         
-        if not lance_data:
-            print("Lance inválido: dados faltando")
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            return
-        
-        leilao_id = lance_data.get('leilao_id')
-        user_id = lance_data.get('user_id')
-        valor = lance_data.get('valor')
-                
-        print(leiloes_ativos)
-        if leilao_id not in leiloes_ativos:
-            print(f"Lance rejeitado: leilão {leilao_id} não está ativo")
-            
-            lance_invalidado = {
-                'leilao_id': leilao_id,
-                'user_id': user_id,
-                'valor': valor,
-                'motivo': 'leilao_nao_ativo',
-                'timestamp': datetime.now().isoformat()
-            }
-            
-            channel.basic_publish(
-                exchange='leilao',
-                routing_key='lance_invalidado',
-                body=json.dumps(lance_invalidado)
-            )
-            
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            return
-        
-        lances_leilao = lances_por_leilao.get(leilao_id, [])
-        if lances_leilao and valor <= lances_leilao[-1]['valor']:
-            print(f"Lance rejeitado: valor {valor} não é maior que o último lance ({lances_leilao[-1]['valor']})")
-            
-            lance_invalidado = {
-                'leilao_id': leilao_id,
-                'user_id': user_id,
-                'valor': valor,
-                'motivo': 'valor_insuficiente',
-                'ultimo_lance': lances_leilao[-1]['valor'],
-                'timestamp': datetime.now().isoformat()
-            }
-            
-            channel.basic_publish(
+        if resultado is not None:
+            routing_key, evento = resultado
+            body_evento, propriedades = codec.codificar(routing_key, evento)
+            lote.publicar(
                 exchange='leilao',
-                routing_key='lance_invalidado',
-                body=json.dumps(lance_invalidado)
+                routing_key=routing_key,
+                body=body_evento,
+                properties=propriedades
             )
-            
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            return
-        
-        lance_validado = {
-            'leilao_id': leilao_id,
-            'leilao_nome': leiloes_ativos[leilao_id].get('nome', leilao_id),
-            'user_id': user_id,
-            'valor': valor,
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        lances_por_leilao[leilao_id].append(lance_validado)
-        
-        channel.basic_publish(
-            exchange='leilao',
-            routing_key='lance_validado',
-            body=json.dumps(lance_validado)
-        )        
+            if properties.type != 'fechamento_leilao':
+                responder_veredito(properties, dados.get('id'), routing_key, evento)
     except Exception as e:
-        print(f"Erro ao processar lance: {e}")
+        registrar_erro('callback_lance_realizado', e)
     
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+    lote.confirmar(method.delivery_tag)
+    # O vencedor não espera a janela do lote
+    if properties.type == 'fechamento_leilao':
+        lote.descarregar()
 
+@instrumentar('callback_leilao_finalizado')
 def callback_leilao_finalizado(ch, method, properties, body):
     try:
-        leilao = json.loads(body)
-        leilao_id = leilao.get('id')
-        
-        if leilao_id in leiloes_ativos:
-            lances = lances_por_leilao.get(leilao_id, [])
-            
-            if lances:
-                vencedor = lances[-1]
-                
-                evento_vencedor = {
-                    'leilao_id': leilao_id,
-                    'leilao_nome': leiloes_ativos[leilao_id].get('nome', leilao_id),
-                    'vencedor_id': vencedor['user_id'],
-                    'valor_final': vencedor['valor'],
-                    'timestamp': datetime.now().isoformat()
-                }
-                
-                channel.basic_publish(
-                    exchange='leilao',
-                    routing_key='leilao_vencedor',
-                    body=json.dumps(evento_vencedor)
-                )
-                
-                print(f"Leilão {leilao_id} finalizado - Vencedor: {vencedor['user_id']} com valor {vencedor['valor']}")
-            else:
-                print(f"Leilão {leilao_id} finalizado sem lances")
-            
-            del leiloes_ativos[leilao_id]
-            
+        leilao = codec.decodificar(body, properties)
+        fechamento = iniciar_fechamento(leilao.get('id'))
+        if fechamento is not None:
+            agendar_cerca(*fechamento)
+    except Exception as e:
+        registrar_erro('callback_leilao_finalizado', e)
+    
+    lote.confirmar(method.delivery_tag)
+
+def callback_preco(ch, method, properties, body):
+    # Cache de preços do roteador: sobe com lance_validado, sai com o vencedor
+    try:
+        evento = codec.decodificar(body, properties)
+        leilao_id = evento.get('leilao_id')
+        if method.routing_key == 'leilao_vencedor':
+            precos_atuais.pop(leilao_id, None)
+        elif evento.get('valor') > precos_atuais.get(leilao_id, float('-inf')):
+            precos_atuais[leilao_id] = evento.get('valor')
     except Exception as e:
-        print(f"Erro ao processar leilão finalizado: {e}")
+        registrar_erro('callback_preco', e)
+
+def callback_resposta(ch, method, properties, body):
+    try:
+        esperas.resolver(properties.correlation_id, (properties.type, codec.decodificar(body, properties)))
+    except Exception as e:
+        registrar_erro('callback_resposta', e)
+
+def iniciar_roteadores():
+    global fila_respostas, canal_lote, lote
+    # Canal próprio em modo transação: cada mensagem sai da fila base no
+    # mesmo tx_commit que a publica na fila da partição
+    canal_lote = connection.channel()
+    canal_lote.basic_qos(prefetch_count=PREFETCH)
+    lote = LoteConfirmacao(connection, canal_lote, LOTE_MAXIMO, LOTE_JANELA, nome='roteador_lance')
+    
+    canal_lote.basic_consume(
+        queue='lance_realizado',
+        on_message_callback=criar_callback_roteador('leilao', 'lance_realizado', PARTICOES, 'leilao_id', lote),
+        auto_ack=False
+    )
+    
+    canal_lote.basic_consume(
+        queue='leilao_finalizado',
+        on_message_callback=criar_callback_roteador('leilao', 'leilao_finalizado', PARTICOES, 'id', lote),
+        auto_ack=False
+    )
+    
+    result = channel.queue_declare(queue='', exclusive=True)
+    for routing_key in ('lance_validado', 'leilao_vencedor'):
+        channel.queue_bind(exchange='leilao', queue=result.method.queue, routing_key=routing_key)
+    channel.basic_consume(queue=result.method.queue, on_message_callback=callback_preco, auto_ack=True)
+    
+    result = channel.queue_declare(queue='', exclusive=True)
+    channel.basic_consume(queue=result.method.queue, on_message_callback=callback_resposta, auto_ack=True)
+    fila_respostas = result.method.queue
     
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+    metricas.monitorar_filas(connection, channel, ['lance_realizado', 'leilao_finalizado'])
 
 def iniciar_consumidores(queue_leilao_iniciado):
+    global canal_lote, lote, historico_disco
+    if HISTORICO_ARQUIVO and historico_disco is None:
+        historico_disco = HistoricoEmDisco(arquivo_da_particao(HISTORICO_ARQUIVO))
+    
     channel.basic_consume(
         queue=queue_leilao_iniciado,
         on_message_callback=callback_leilao_iniciado,
         auto_ack=True
     )
     
-    channel.basic_consume(
-        queue='lance_realizado',
+    # Canal próprio em modo transação para o pipeline de lances
+    canal_lote = connection.channel()
+    canal_lote.basic_qos(prefetch_count=PREFETCH)
+    lote = LoteConfirmacao(
+        connection, canal_lote, LOTE_MAXIMO, LOTE_JANELA,
+        nome=fila_da_particao('lance_realizado'), antes_de_confirmar=confirmar_diario,
+        depois_de_confirmar=confirmar_lote
+    )
+    
+    canal_lote.basic_consume(
+        queue=fila_da_particao('lance_realizado'),
         on_message_callback=callback_lance_realizado,
         auto_ack=False
     )
     
-    channel.basic_consume(
-        queue='leilao_finalizado',
+    canal_lote.basic_consume(
+        queue=fila_da_particao('leilao_finalizado'),
         on_message_callback=callback_leilao_finalizado,
         auto_ack=False
     )
+    
+    metricas.monitorar_filas(connection, channel, [fila_da_particao('lance_realizado'), fila_da_particao('leilao_finalizado')])
 
-def rabbitmq_thread():
-    queue_leilao_iniciado = conectar_rabbitmq()
-    if not queue_leilao_iniciado:
-        print("Erro ao conectar ao RabbitMQ")
+def configurar(conexao, canal):
+    # Em cada (re)conexão: o lote e os timers da conexão anterior se foram e
+    # as entregas sem ack voltam da fila, então o que o lote aberto alterou é
+    # desfeito antes de consumir de novo
+    global connection, channel
+    connection, channel = conexao, canal
+    queue_leilao_iniciado = declarar_topologia(channel)
+    
+    if PARTICOES > 1 and particao is None:
+        iniciar_roteadores()
         return
     
+    desfazer_lote()
+    carregar_leiloes_ativos()
     iniciar_consumidores(queue_leilao_iniciado)
-    
-    try:
-        channel.start_consuming()
-    except Exception:
-        pass
+    for cerca, atraso in fechamentos_pendentes():
+        agendar_cerca(cerca, atraso)
+
+consumidor = Consumidor(configurar, nome='ms_lance')
+
+def rabbitmq_thread():
+    if DIARIO and not (PARTICOES > 1 and particao is None):
+        recuperar_estado()
+    consumidor.executar()
+
+def executar_particao(numero):
+    global particao
+    particao = numero
+    print(f"Validador da partição {numero}/{PARTICOES} iniciado")
+    metricas.servir_metricas(METRICAS_PORTA + numero)
+    rabbitmq_thread()
 
 def main():    
+    # Iniciar um processo validador por partição
+    if PARTICOES > 1:
+        for numero in range(PARTICOES):
+            multiprocessing.Process(target=executar_particao, args=(numero,), daemon=True).start()
+    
     # Iniciar thread do RabbitMQ
     threading.Thread(target=rabbitmq_thread, daemon=True).start()
     
+    # Iniciar thread de publicação do Flask
+    publicador.iniciar()
+    
     # Iniciar servidor Flask
     app.run(host='0.0.0.0', port=5001, debug=False)
 
@@ -0,0 +1,270 @@
+import asyncio
+import contextlib
+import time
+import uuid
+
+import metricas
+from metricas import instrumentar, registrar_erro
+from runtime_amqp import BACKOFF_INICIAL, BACKOFF_MAXIMO, FILA_EXPIRA_MS
+from runtime_async import PublicadorAsync, conectar, declarar_exchanges, mensagem as mensagem_amqp
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import codec
+import exportacao_lances
+import ms_lance
+
+# Modo assíncrono do MS lance: as mesmas rotas e eventos, servidos por ASGI
+# (uvicorn) com o consumidor AMQP no mesmo event loop. Roda como uma partição
+# única, dona de todos os leilões.
+#
+#   uvicorn ms_lance_async:app --port 5001
+
+publicador = PublicadorAsync(nome='ms_lance')
+
+@instrumentar('criar_lance')
+async def criar_lance(request):
+    try:
+        lance = ms_lance.montar_lance(await request.json())
+        recusa = ms_lance.admitir_lance(lance)
+        if recusa is not None:
+            status, corpo, cabecalhos = recusa
+            return JSONResponse(corpo, status_code=status, headers=cabecalhos)
+
+        # Resposta síncrona: o validador roda neste loop, então o veredito é
+        # entregue em processo, depois do commit do lote
+        espera = None
+        if ms_lance.quer_veredito(request.query_params.get('aguardar')):
+            lance['id'] = lance['id'] or str(uuid.uuid4())
+            espera = ms_lance.esperas.abrir(lance['id'], asyncio.get_running_loop())
+        inicio = time.perf_counter()
+        body, properties = codec.codificar('lance_realizado', lance)
+
+        try:
+            await publicador.publicar_async(
+                exchange='leilao',
+                routing_key='lance_realizado',
+                body=body,
+                properties=properties
+            )
+            if espera is None:
+                return JSONResponse(lance, status_code=202)
+            resultado = await espera.aguardar_async(ms_lance.RESPOSTA_PRAZO)
+            status, corpo = ms_lance.resposta_veredito(lance, resultado, inicio)
+            return JSONResponse(corpo, status_code=status)
+        finally:
+            if espera is not None:
+                ms_lance.esperas.fechar(lance['id'])
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+def historico_desativado():
+    return JSONResponse({"error": "histórico em disco desativado (LANCE_HISTORICO_ARQUIVO)"}, status_code=404)
+
+@instrumentar('exportar_historico')
+async def exportar_historico(request):
+    # Mesmas rotas do ms_lance; os geradores de arquivo rodam no threadpool
+    # do Starlette
+    if not ms_lance.HISTORICO_ARQUIVO:
+        return historico_desativado()
+    try:
+        filtros = ms_lance.filtros_exportacao(request.query_params)
+        lances = exportacao_lances.lances(ms_lance.arquivos_historico(filtros['leilao_id']), **filtros)
+        if request.query_params.get('formato') == 'arrow':
+            return StreamingResponse(exportacao_lances.para_arrow(lances), media_type=exportacao_lances.CONTENT_TYPE_ARROW)
+        return StreamingResponse(exportacao_lances.para_ndjson(lances), media_type=exportacao_lances.CONTENT_TYPE_NDJSON)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+@instrumentar('resumir_historico')
+async def resumir_historico(request):
+    if not ms_lance.HISTORICO_ARQUIVO:
+        return historico_desativado()
+    try:
+        filtros = ms_lance.filtros_exportacao(request.query_params)
+        resumos = exportacao_lances.resumos(ms_lance.arquivos_historico(filtros['leilao_id']), **filtros)
+        return StreamingResponse(exportacao_lances.para_ndjson(resumos), media_type=exportacao_lances.CONTENT_TYPE_NDJSON)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+async def saude(request):
+    estado = publicador.estado()
+    return JSONResponse({"publicador": estado}, status_code=200 if estado["saudavel"] else 503)
+
+async def expor_metricas(request):
+    corpo, content_type = metricas.exposicao()
+    return Response(corpo, media_type=content_type)
+
+async def expor_perfil(request):
+    return PlainTextResponse(metricas.perfil_texto())
+
+async def declarar_filas(channel):
+    exchanges = await declarar_exchanges(channel)
+
+    fila_lances = await channel.declare_queue('lance_realizado', durable=True)
+    fila_finalizados = await channel.declare_queue('leilao_finalizado', durable=True)
+    await fila_lances.bind(exchanges['leilao'], routing_key='lance_realizado')
+    await fila_finalizados.bind(exchanges['leilao'], routing_key='leilao_finalizado')
+
+    fila_iniciados = await channel.declare_queue(
+        'ms_lance.leilao_iniciado', durable=True, arguments={'x-expires': FILA_EXPIRA_MS}
+    )
+    await fila_iniciados.bind(exchanges['leilao_iniciado'])
+
+    return exchanges, fila_lances, fila_finalizados, fila_iniciados
+
+def agendar_cerca(entregas, cerca, atraso):
+    # A cerca é publicada pela própria tarefa de lotes, dentro da transação
+    asyncio.get_running_loop().call_later(atraso, entregas.put_nowait, ('cerca', cerca))
+
+# A parte síncrona de cada entrega, medida com os mesmos nomes dos callbacks
+# do ms_lance
+@instrumentar('callback_lance_realizado')
+def validar_entrega(mensagem):
+    dados = codec.decodificar(mensagem.body, mensagem)
+    return dados, ms_lance.processar_lance(dados, mensagem.type)
+
+@instrumentar('callback_leilao_finalizado')
+def finalizar_entrega(mensagem, entregas):
+    fechamento = ms_lance.iniciar_fechamento(codec.decodificar(mensagem.body, mensagem).get('id'))
+    if fechamento is not None:
+        agendar_cerca(entregas, *fechamento)
+
+@instrumentar('callback_leilao_iniciado')
+def registrar_leilao_iniciado(mensagem):
+    try:
+        ms_lance.registrar_leilao_iniciado(codec.decodificar(mensagem.body, mensagem))
+    except Exception as e:
+        registrar_erro('callback_leilao_iniciado', e)
+
+async def processar_lotes(channel, exchange, entregas):
+    # Mesmo esquema do LoteConfirmacao: valida o que já chegou (até
+    # LOTE_MAXIMO), publica os resultados e confirma tudo num tx_commit
+    transacao = channel.transaction()
+    await transacao.select()
+
+    while True:
+        lote = [await entregas.get()]
+        while len(lote) < ms_lance.LOTE_MAXIMO and not entregas.empty():
+            lote.append(entregas.get_nowait())
+
+        ultima_mensagem = None
+        vereditos = []
+        for tipo, item in lote:
+            try:
+                if tipo == 'cerca':
+                    await exchange.publish(
+                        mensagem_amqp(*codec.codificar('fechamento_leilao', item)), routing_key='lance_realizado'
+                    )
+                    continue
+
+                ultima_mensagem = item
+                if tipo == 'lance':
+                    dados, resultado = validar_entrega(item)
+                else:
+                    resultado = None
+                    finalizar_entrega(item, entregas)
+
+                if resultado is not None:
+                    routing_key, evento = resultado
+                    await exchange.publish(mensagem_amqp(*codec.codificar(routing_key, evento)), routing_key=routing_key)
+                    if tipo == 'lance' and ms_lance.esperas.aguardando(dados.get('id')):
+                        vereditos.append((dados.get('id'), resultado))
+            except Exception as e:
+                registrar_erro(f'processar_{tipo}', e)
+
+        ms_lance.confirmar_diario()
+        if ultima_mensagem is not None:
+            await ultima_mensagem.ack(multiple=True)
+        await transacao.commit()
+        ms_lance.confirmar_lote()
+        for lance_id, resultado in vereditos:
+            ms_lance.esperas.resolver(lance_id, resultado)
+
+async def consumir(channel):
+    await channel.set_qos(prefetch_count=ms_lance.PREFETCH)
+    exchanges, fila_lances, fila_finalizados, fila_iniciados = await declarar_filas(channel)
+    await asyncio.to_thread(ms_lance.carregar_leiloes_ativos)
+
+    async def ao_iniciar_leilao(mensagem):
+        registrar_leilao_iniciado(mensagem)
+
+    # Lances e finalizações entram na mesma fila interna, na ordem de chegada
+    # no canal, para que o ack múltiplo cubra exatamente o que foi processado
+    entregas = asyncio.Queue()
+
+    async def ao_receber_lance(mensagem):
+        entregas.put_nowait(('lance', mensagem))
+
+    async def ao_finalizar_leilao(mensagem):
+        entregas.put_nowait(('finalizado', mensagem))
+
+    await fila_iniciados.consume(ao_iniciar_leilao, no_ack=True)
+    await fila_lances.consume(ao_receber_lance)
+    await fila_finalizados.consume(ao_finalizar_leilao)
+    for cerca, atraso in ms_lance.fechamentos_pendentes():
+        agendar_cerca(entregas, cerca, atraso)
+
+    await processar_lotes(channel, exchanges['leilao'], entregas)
+
+async def consumir_lances(connection):
+    # Se um lote falhar (ex.: o broker caiu antes do commit), a transação e as
+    # delivery tags do canal não valem mais: o lote é desfeito, o canal é
+    # fechado (as entregas sem ack voltam da fila) e tudo recomeça num canal
+    # novo, como no Consumidor do runtime_amqp
+    backoff = BACKOFF_INICIAL
+    while True:
+        channel = None
+        try:
+            channel = await connection.channel(publisher_confirms=False)
+            backoff = BACKOFF_INICIAL
+            await consumir(channel)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            registrar_erro('ms_lance_async', e)
+            ms_lance.desfazer_lote()
+            if channel is not None:
+                with contextlib.suppress(Exception):
+                    await channel.close()
+            print(f"[ms_lance_async] canal de lances refeito em {backoff:.1f}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, BACKOFF_MAXIMO)
+
+@contextlib.asynccontextmanager
+async def ciclo_de_vida(app):
+    if ms_lance.DIARIO:
+        ms_lance.recuperar_estado()
+
+    connection = await conectar()
+    await publicador.conectar(connection)
+    tarefa = asyncio.create_task(consumir_lances(connection))
+    try:
+        yield
+    finally:
+        tarefa.cancel()
+        publicador.parar()
+        await connection.close()
+
+app = Starlette(
+    routes=[
+        Route('/lances', criar_lance, methods=['POST']),
+        Route('/lances/historico', exportar_historico, methods=['GET']),
+        Route('/lances/resumo', resumir_historico, methods=['GET']),
+        Route('/saude', saude, methods=['GET']),
+        Route('/metrics', expor_metricas, methods=['GET']),
+        Route('/perfil', expor_perfil, methods=['GET']),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=ciclo_de_vida
+)
+
+def main():
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5001)
+
+if __name__ == "__main__":
+    main()
@@ -1,138 +1,396 @@
-import pika
-import json
+import os
 import threading
 import time
+import uuid
+import zlib
 from datetime import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
+from agendador import Agendador
+from catalogo_leiloes import CatalogoLeiloes
+import metricas
+from metricas import instrumentar, registrar_erro
+import codec
+from persistencia import Diario
+from precos_leiloes import PrecosLeiloes
+from publicador import Publicador
+from runtime_amqp import Consumidor, declarar_exchanges, declarar_fila_propria
 
 app = Flask(__name__)
 CORS(app)
 
-connection = None
-channel = None
 running = True
 
-leiloes = {}
+leiloes = CatalogoLeiloes()
+agendador = Agendador()
 
-def conectar_rabbitmq():
-    global connection, channel
+FORMATO_DATA = "%Y-%m-%d %H:%M:%S"
+
+# Entra na ETag para que versões de uma execução anterior nunca casem
+INSTANCIA = uuid.uuid4().hex[:8]
+
+# Número de sequência dos eventos de início/fim de leilão. Começa no relógio
+# (em microssegundos) para continuar crescendo depois de um reinício mesmo
+# sem diário. GET /leiloes/snapshot devolve o último seq junto com os ativos.
+seq_eventos = time.time_ns() // 1000
+lock_eventos = threading.Lock()
+TAMANHO_BLOCO_SNAPSHOT = 1000
+
+# Diário em disco com os leilões criados e as mudanças de status (vazio
+# desativa). O snapshot é gravado a cada SNAPSHOT_INTERVALO segundos.
+DIARIO = os.environ.get('LEILAO_DIARIO', 'ms_leilao.db')
+SNAPSHOT_INTERVALO = float(os.environ.get('LEILAO_SNAPSHOT_INTERVALO', '60'))
+diario = None
+
+# Preço atual, líder e número de lances dos leilões ativos, a partir dos
+# lance_validado do MS lance. O /leiloes/ativos mescla esses campos nos
+# leilões (ultimoLance, lider, lances) e o GET /leiloes/quentes devolve os mais
+# disputados, pela soma dos lances com decaimento de ATIVIDADE_JANELA s. O
+# cache fica só em memória: depois de um reinício volta a encher com os
+# próximos lances.
+ATIVIDADE_JANELA = float(os.environ.get('LEILAO_ATIVIDADE_JANELA', '60'))
+FILA_LANCES = 'ms_leilao.lance_validado'
+precos = PrecosLeiloes(ATIVIDADE_JANELA)
+
+STATUS = ('pendente', 'ativo', 'encerrado')
+leiloes_criados = metricas.registro.contador('leiloes_criados_total', 'Leilões cadastrados via POST /leiloes')
+metricas.registro.medidor(
+    'leiloes', 'Leilões no catálogo por status', ('status',),
+    funcao=lambda: {(status,): leiloes.contagem(status) for status in STATUS}
+)
+metricas.registro.medidor('leiloes_com_preco', 'Leilões ativos no cache de preços', funcao=lambda: len(precos))
+metricas.registro.medidor(
+    'agendador_pendentes', 'Inícios/fins de leilão aguardando no agendador', funcao=lambda: agendador.pendentes()
+)
+
+# Os eventos saem do agendador e do Flask; o publicador reenvia o que estiver
+# pendente quando a conexão volta
+publicador = Publicador(declarar_exchanges, nome='ms_leilao')
+
+class LeilaoDuplicado(Exception):
+    # POST de um id já cadastrado: os eventos agendados do leilão antigo
+    # iniciariam ou encerrariam o novo nos horários antigos
+    pass
+
+def cadastrar_leilao(dados):
+    # Levanta ValueError se falta o id ou se inicio/fim não estão em
+    # FORMATO_DATA, e LeilaoDuplicado se o id já existe
     try:
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters('localhost')
-        )
-        channel = connection.channel()
-        
-        channel.exchange_declare(exchange='leilao_iniciado', exchange_type='fanout')
-        channel.exchange_declare(exchange='leilao', exchange_type='direct')
-        
-        return True
-    except Exception:
-        return False
+        instantes(dados)
+    except (TypeError, ValueError):
+        raise ValueError(f"inicio e fim devem estar no formato {FORMATO_DATA}")
+    
+    leilao_id = dados.get('id')
+    if leilao_id is None or leilao_id == '':
+        # Sem id, todos os POSTs cairiam na mesma chave
+        raise ValueError("id é obrigatório")
+    leilao = {
+        "id": leilao_id,
+        "nome": dados.get('nome'),
+        "descricao": dados.get('descricao'),
+        "valorInicial": dados.get('valorInicial'),
+        "inicio": dados.get('inicio'),
+        "fim": dados.get('fim'),
+        "status": "pendente",
+        "ultimoLance": None
+    }
+    
+    with leiloes.bloqueio(leilao_id):
+        if leilao_id in leiloes:
+            raise LeilaoDuplicado(f"leilão {leilao_id} já existe")
+        leiloes.definir(leilao_id, leilao)
+    registrar_evento('leilao_criado', leilao)
+    agendar_ciclo_vida(leilao)
+    
+    leiloes_criados.inc()
+    print(f"leilao {leilao_id} criado, pendente inicio")
+    return leilao
 
 @app.route('/leiloes', methods=['POST'])
+@instrumentar('criar_leilao')
 def criar_leilao():
     try:
-        dados = request.json
-        leilao_id = dados.get('id')
-        
-        leilao = {
-            "id": leilao_id,
-            "nome": dados.get('nome'),
-            "descricao": dados.get('descricao'),
-            "valorInicial": dados.get('valorInicial'),
-            "inicio": dados.get('inicio'),
-            "fim": dados.get('fim'),
-            "status": "pendente",
-            "ultimoLance": None
-        }
-        
-        leiloes[leilao_id] = leilao
-        
-        print(f"leilao {leilao_id} criado, pendente inicio")
+        leilao = cadastrar_leilao(request.json)
         return jsonify(leilao), 201
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except LeilaoDuplicado as e:
+        return jsonify({"error": str(e)}), 409
     except Exception as e:
-        pass
+        registrar_erro('criar_leilao', e)
+        return jsonify({"error": str(e)}), 500
+
+def projetar(leiloes_lista, campos):
+    if not campos:
+        return leiloes_lista
+    campos = campos.split(',')
+    return [{campo: leilao.get(campo) for campo in campos} for leilao in leiloes_lista]
+
+def etag_consulta(status, query_string):
+    consulta = zlib.crc32(query_string)
+    return f"{INSTANCIA}-{status}-{leiloes.versao(status)}-{precos.versao}-{consulta:08x}"
+
+def com_precos(leiloes_lista):
+    # Mescla o preço atual do cache nos leilões (cópias, o catálogo não muda)
+    resultado = []
+    for leilao in leiloes_lista:
+        preco = precos.obter(leilao["id"])
+        resultado.append({**leilao, **preco} if preco is not None else leilao)
+    return resultado
+
+def leiloes_quentes(limite):
+    resultado = []
+    for leilao_id, atividade, preco in precos.quentes(limite):
+        leilao = leiloes.obter(leilao_id)
+        if leilao is not None:
+            resultado.append({**leilao, **preco, "atividade": round(atividade, 3)})
+    return resultado
+
+def resposta_nao_modificada(etag):
+    resposta = app.response_class(status=304)
+    resposta.set_etag(etag)
+    return resposta
 
 @app.route('/leiloes/ativos', methods=['GET'])
+@instrumentar('listar_leiloes_ativos')
 def listar_leiloes_ativos():
     try:
-        ativos = [l for l in leiloes.values() if l.get('status') == 'ativo']
-        return jsonify(ativos), 200
+        # A ETag é calculada antes de montar a página: se o índice mudar no
+        # meio, a versão seguinte já não casa e o cliente recebe um 200
+        etag = etag_consulta('ativo', request.query_string)
+        if etag in request.if_none_match:
+            return resposta_nao_modificada(etag)
+        
+        cursor = request.args.get('cursor', type=int)
+        limite = request.args.get('limite', type=int)
+        ativos, proximo_cursor = leiloes.pagina('ativo', cursor, limite)
+        
+        resposta = jsonify(projetar(com_precos(ativos), request.args.get('campos')))
+        resposta.set_etag(etag)
+        if proximo_cursor is not None:
+            resposta.headers['X-Proximo-Cursor'] = str(proximo_cursor)
+        return resposta, 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/leiloes/encerrando', methods=['GET'])
+@instrumentar('listar_leiloes_encerrando')
+def listar_leiloes_encerrando():
+    try:
+        etag = etag_consulta('ativo', request.query_string)
+        if etag in request.if_none_match:
+            return resposta_nao_modificada(etag)
+        
+        limite = request.args.get('limite', default=10, type=int)
+        resposta = jsonify(projetar(com_precos(leiloes.encerrando(limite)), request.args.get('campos')))
+        resposta.set_etag(etag)
+        return resposta, 200
     except Exception as e:
-        pass
+        return jsonify({"error": str(e)}), 500
 
-def publicar_leilao_iniciado(leilao):
+@app.route('/leiloes/quentes', methods=['GET'])
+@instrumentar('listar_leiloes_quentes')
+def listar_leiloes_quentes():
     try:
-        evento = {
-            "id": leilao["id"],
-            "nome": leilao.get("nome"),
-            "descricao": leilao["descricao"],
-            "valorInicial": leilao.get("valorInicial"),
-            "inicio": leilao["inicio"],
-            "fim": leilao["fim"]
-        }
-        channel.basic_publish(
+        limite = request.args.get('limite', default=10, type=int)
+        return jsonify(projetar(leiloes_quentes(limite), request.args.get('campos'))), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def evento_leilao_iniciado(leilao, seq=None):
+    evento = {
+        "id": leilao["id"],
+        "nome": leilao.get("nome"),
+        "descricao": leilao["descricao"],
+        "valorInicial": leilao.get("valorInicial"),
+        "inicio": leilao["inicio"],
+        "fim": leilao["fim"]
+    }
+    if seq is not None:
+        evento["seq"] = seq
+    return evento
+
+def snapshot_ativos():
+    # Blocos de NDJSON: cabeçalho com o seq e a quantidade, depois um leilão
+    # por linha. O seq e a lista são lidos juntos, sob o mesmo lock das
+    # mudanças de status.
+    with lock_eventos:
+        seq = seq_eventos
+        ativos, _ = leiloes.pagina('ativo')
+    
+    yield codec.para_json({"seq": seq, "quantidade": len(ativos)}) + b'\n'
+    for i in range(0, len(ativos), TAMANHO_BLOCO_SNAPSHOT):
+        bloco = ativos[i:i + TAMANHO_BLOCO_SNAPSHOT]
+        yield b''.join(codec.para_json(evento_leilao_iniciado(leilao)) + b'\n' for leilao in bloco)
+
+@app.route('/leiloes/snapshot', methods=['GET'])
+@instrumentar('snapshot_leiloes')
+def snapshot_leiloes():
+    return Response(snapshot_ativos(), content_type='application/x-ndjson')
+
+def publicar_leilao_iniciado(leilao, seq):
+    try:
+        evento = evento_leilao_iniciado(leilao, seq)
+        body, properties = codec.codificar('leilao_iniciado', evento)
+        publicador.publicar(
             exchange='leilao_iniciado',
             routing_key='',
-            body=json.dumps(evento)
+            body=body,
+            properties=properties
         )
     except Exception as e:
-        pass
+        registrar_erro('publicar_leilao_iniciado', e)
 
-def publicar_leilao_finalizado(leilao):
+def publicar_leilao_finalizado(leilao, seq):
     try:
         evento = {
             "id": leilao["id"],
             "descricao": leilao.get("descricao"),
-            "timestamp": datetime.now().isoformat(),
-            "status": "encerrado"
+            "timestamp": codec.agora(),
+            "status": "encerrado",
+            "seq": seq
         }
 
-        channel.basic_publish(
+        body, properties = codec.codificar('leilao_finalizado', evento)
+        publicador.publicar(
             exchange='leilao',
             routing_key='leilao_finalizado',
-            body=json.dumps(evento)
+            body=body,
+            properties=properties
         )
     except Exception as e:
-        pass
-
-def verificar_ciclo_vida_leiloes():
-    global running
-    while running:
-        try:
-            agora = datetime.now()
-            
-            for leilao_id, leilao in list(leiloes.items()):
-                inicio = datetime.strptime(leilao["inicio"], "%Y-%m-%d %H:%M:%S")
-                fim = datetime.strptime(leilao["fim"], "%Y-%m-%d %H:%M:%S")
-                
-                if leilao["status"] == "pendente" and agora >= inicio and agora < fim:
-                    leilao["status"] = "ativo"
-                    publicar_leilao_iniciado(leilao)
-                    print(f"leilao {leilao_id} iniciado")
-                
-                elif leilao["status"] == "ativo" and agora >= fim:
-                    leilao["status"] = "encerrado"
-                    publicar_leilao_finalizado(leilao)
-                    print(f"leilao {leilao_id} finalizado")
-            
-            time.sleep(1)
-        except Exception as e:
-            print(f"Erro no ciclo de vida: {e}")
-            time.sleep(1)
-
-def rabbitmq_thread():
-    if not conectar_rabbitmq():
-        print("Erro ao conectar ao RabbitMQ")
+        registrar_erro('publicar_leilao_finalizado', e)
+
+def instantes(leilao):
+    inicio = datetime.strptime(leilao['inicio'], FORMATO_DATA).timestamp()
+    fim = datetime.strptime(leilao['fim'], FORMATO_DATA).timestamp()
+    return inicio, fim
+
+def agendar_ciclo_vida(leilao):
+    inicio, fim = instantes(leilao)
+    if leilao['status'] == 'pendente':
+        agendador.agendar(inicio, iniciar_leilao, leilao['id'], fim)
+    agendador.agendar(fim, finalizar_leilao, leilao['id'])
+
+def registrar_evento(tipo, dados):
+    # Chamado depois de aplicar a mudança no catálogo; só retorna quando o
+    # evento está em disco
+    if diario is not None:
+        diario.confirmar(diario.registrar(tipo, dados))
+
+def mudar_status(leilao_id, status):
+    # Aplica a mudança e numera o evento correspondente
+    global seq_eventos
+    with lock_eventos:
+        leilao = leiloes.atualizar(leilao_id, status=status)
+        seq_eventos += 1
+        seq = seq_eventos
+    registrar_evento('status', {"id": leilao_id, "status": status, "seq": seq})
+    return leilao, seq
+
+def iniciar_leilao(leilao_id, fim):
+    leilao = leiloes.obter(leilao_id)
+    if leilao is None or leilao["status"] != "pendente" or time.time() >= fim:
+        return
+    
+    leilao, seq = mudar_status(leilao_id, "ativo")
+    publicar_leilao_iniciado(leilao, seq)
+    print(f"leilao {leilao_id} iniciado")
+
+def finalizar_leilao(leilao_id):
+    leilao = leiloes.obter(leilao_id)
+    if leilao is None or leilao["status"] != "ativo":
         return
     
+    leilao, seq = mudar_status(leilao_id, "encerrado")
+    precos.remover(leilao_id)
+    publicar_leilao_finalizado(leilao, seq)
+    print(f"leilao {leilao_id} finalizado")
+
+def restaurar_snapshot(estado):
+    global seq_eventos
+    for leilao in estado['leiloes']:
+        leiloes.definir(leilao['id'], leilao)
+    seq_eventos = max(seq_eventos, estado.get('seq', 0))
+
+def aplicar_evento(tipo, dados):
+    global seq_eventos
+    if tipo == 'leilao_criado':
+        leiloes.definir(dados['id'], dados)
+    elif tipo == 'status':
+        leiloes.atualizar(dados['id'], status=dados['status'])
+        seq_eventos = max(seq_eventos, dados.get('seq', 0))
+
+def gravar_snapshot():
+    if diario.eventos_desde_snapshot:
+        diario.gravar_snapshot(lambda: {"leiloes": list(leiloes.valores()), "seq": seq_eventos})
+    agendador.agendar(time.time() + SNAPSHOT_INTERVALO, gravar_snapshot)
+
+def recuperar_estado():
+    global diario
+    diario = Diario(DIARIO)
+    diario.recuperar(restaurar_snapshot, aplicar_evento)
+    
+    # Leilões que terminaram com o serviço parado são encerrados assim que o
+    # agendador começar a rodar
+    for leilao in leiloes.valores():
+        if leilao['status'] in ('pendente', 'ativo'):
+            agendar_ciclo_vida(leilao)
+    
+    agendador.agendar(time.time() + SNAPSHOT_INTERVALO, gravar_snapshot)
+
+def aplicar_lance_validado(lance):
+    # Lances de leilões que não estão ativos aqui (ex.: chegaram depois do
+    # fim) não entram no cache
+    leilao = leiloes.obter(lance.get('leilao_id'))
+    if leilao is None or leilao["status"] != "ativo":
+        return
+    precos.registrar(leilao["id"], lance.get('valor'), lance.get('user_id'))
+
+@instrumentar('callback_lance_validado')
+def callback_lance_validado(ch, method, properties, body):
+    try:
+        aplicar_lance_validado(codec.decodificar(body, properties))
+    except Exception as e:
+        registrar_erro('callback_lance_validado', e)
+
+def configurar(connection, channel):
+    # Em cada (re)conexão; os lances validados enquanto o MS estava
+    # desconectado esperam na fila própria
+    declarar_exchanges(channel)
+    declarar_fila_propria(channel, FILA_LANCES, 'leilao', ('lance_validado',))
+    channel.basic_consume(queue=FILA_LANCES, on_message_callback=callback_lance_validado, auto_ack=True)
+
+consumidor = Consumidor(configurar, nome='ms_leilao')
+
+@app.route('/saude', methods=['GET'])
+def saude():
+    estado = publicador.estado()
+    estado_consumidor = consumidor.estado()
+    saudavel = estado["saudavel"] and estado_consumidor["conectado"]
+    return jsonify({"publicador": estado, "consumidor": estado_consumidor}), 200 if saudavel else 503
+
+@app.route('/metrics', methods=['GET'])
+def expor_metricas():
+    corpo, content_type = metricas.exposicao()
+    return Response(corpo, content_type=content_type)
+
+@app.route('/perfil', methods=['GET'])
+def expor_perfil():
+    return Response(metricas.perfil_texto(), content_type='text/plain; charset=utf-8')
+
 def main():
-    # Iniciar thread do RabbitMQ
-    threading.Thread(target=rabbitmq_thread, daemon=True).start()
+    if DIARIO:
+        recuperar_estado()
+    
+    # Iniciar thread de publicação no RabbitMQ
+    publicador.iniciar()
+    
+    # Iniciar thread que consome os lances validados (cache de preços)
+    threading.Thread(target=consumidor.executar, daemon=True).start()
     
     # Iniciar thread do ciclo de vida dos leilões
-    threading.Thread(target=verificar_ciclo_vida_leiloes, daemon=True).start()
+    threading.Thread(target=agendador.executar, daemon=True).start()
     
     # Iniciar servidor Flask
     app.run(host='0.0.0.0', port=5000, debug=False)
@@ -0,0 +1,156 @@
+import contextlib
+import threading
+
+import metricas
+from metricas import instrumentar, registrar_erro
+from runtime_amqp import FILA_EXPIRA_MS
+from runtime_async import PublicadorAsync, conectar, declarar_exchanges
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import codec
+import ms_leilao
+
+# Modo assíncrono do MS leilão: as mesmas rotas servidas por ASGI (uvicorn).
+# O catálogo e o agendador são os do ms_leilao; os eventos do agendador saem
+# pelo canal aio-pika do event loop.
+#
+#   uvicorn ms_leilao_async:app --port 5000
+
+publicador = PublicadorAsync(nome='ms_leilao')
+
+@instrumentar('criar_leilao')
+async def criar_leilao(request):
+    try:
+        leilao = ms_leilao.cadastrar_leilao(await request.json())
+        return JSONResponse(leilao, status_code=201)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except ms_leilao.LeilaoDuplicado as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+def nao_modificado(request, etag):
+    # If-None-Match pode trazer várias ETags, com ou sem aspas/W/
+    enviadas = request.headers.get('if-none-match', '')
+    return any(valor.strip().removeprefix('W/').strip('"') == etag for valor in enviadas.split(','))
+
+def inteiro(request, nome, padrao=None):
+    valor = request.query_params.get(nome)
+    try:
+        return int(valor) if valor is not None else padrao
+    except ValueError:
+        return padrao
+
+@instrumentar('listar_leiloes_ativos')
+async def listar_leiloes_ativos(request):
+    try:
+        etag = ms_leilao.etag_consulta('ativo', request.url.query.encode())
+        if nao_modificado(request, etag):
+            return Response(status_code=304, headers={'ETag': f'"{etag}"'})
+
+        ativos, proximo_cursor = ms_leilao.leiloes.pagina('ativo', inteiro(request, 'cursor'), inteiro(request, 'limite'))
+
+        headers = {'ETag': f'"{etag}"'}
+        if proximo_cursor is not None:
+            headers['X-Proximo-Cursor'] = str(proximo_cursor)
+        return JSONResponse(ms_leilao.projetar(ms_leilao.com_precos(ativos), request.query_params.get('campos')), headers=headers)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@instrumentar('listar_leiloes_encerrando')
+async def listar_leiloes_encerrando(request):
+    try:
+        etag = ms_leilao.etag_consulta('ativo', request.url.query.encode())
+        if nao_modificado(request, etag):
+            return Response(status_code=304, headers={'ETag': f'"{etag}"'})
+
+        encerrando = ms_leilao.com_precos(ms_leilao.leiloes.encerrando(inteiro(request, 'limite', 10)))
+        return JSONResponse(ms_leilao.projetar(encerrando, request.query_params.get('campos')), headers={'ETag': f'"{etag}"'})
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@instrumentar('listar_leiloes_quentes')
+async def listar_leiloes_quentes(request):
+    try:
+        quentes = ms_leilao.leiloes_quentes(inteiro(request, 'limite', 10))
+        return JSONResponse(ms_leilao.projetar(quentes, request.query_params.get('campos')))
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def consumir_lances_validados(connection):
+    # Cache de preços: mesmo consumidor do ms_leilao, no event loop
+    channel = await connection.channel()
+    exchanges = await declarar_exchanges(channel)
+    fila = await channel.declare_queue(ms_leilao.FILA_LANCES, durable=True, arguments={'x-expires': FILA_EXPIRA_MS})
+    await fila.bind(exchanges['leilao'], routing_key='lance_validado')
+
+    @instrumentar('callback_lance_validado')
+    def aplicar(mensagem):
+        try:
+            ms_leilao.aplicar_lance_validado(codec.decodificar(mensagem.body, mensagem))
+        except Exception as e:
+            registrar_erro('callback_lance_validado', e)
+
+    async def ao_validar_lance(mensagem):
+        aplicar(mensagem)
+
+    await fila.consume(ao_validar_lance, no_ack=True)
+
+@instrumentar('snapshot_leiloes')
+async def snapshot_leiloes(request):
+    return StreamingResponse(ms_leilao.snapshot_ativos(), media_type='application/x-ndjson')
+
+async def saude(request):
+    estado = publicador.estado()
+    return JSONResponse({"publicador": estado}, status_code=200 if estado["saudavel"] else 503)
+
+async def expor_metricas(request):
+    corpo, content_type = metricas.exposicao()
+    return Response(corpo, media_type=content_type)
+
+async def expor_perfil(request):
+    return PlainTextResponse(metricas.perfil_texto())
+
+@contextlib.asynccontextmanager
+async def ciclo_de_vida(app):
+    connection = await conectar()
+    await publicador.conectar(connection)
+    ms_leilao.publicador = publicador
+    await consumir_lances_validados(connection)
+
+    if ms_leilao.DIARIO:
+        ms_leilao.recuperar_estado()
+    threading.Thread(target=ms_leilao.agendador.executar, daemon=True).start()
+    try:
+        yield
+    finally:
+        ms_leilao.agendador.parar()
+        publicador.parar()
+        await connection.close()
+
+app = Starlette(
+    routes=[
+        Route('/leiloes', criar_leilao, methods=['POST']),
+        Route('/leiloes/ativos', listar_leiloes_ativos, methods=['GET']),
+        Route('/leiloes/encerrando', listar_leiloes_encerrando, methods=['GET']),
+        Route('/leiloes/quentes', listar_leiloes_quentes, methods=['GET']),
+        Route('/leiloes/snapshot', snapshot_leiloes, methods=['GET']),
+        Route('/saude', saude, methods=['GET']),
+        Route('/metrics', expor_metricas, methods=['GET']),
+        Route('/perfil', expor_perfil, methods=['GET']),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=ciclo_de_vida
+)
+
+def main():
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5000)
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,111 @@
-import pika
-import json
-from datetime import datetime
+import os
+import time
+import signal
+import collections
+import multiprocessing
+from lote_confirmacao import LoteConfirmacao
+import metricas
+from metricas import instrumentar, registrar_erro
+import codec
+from particionamento import nome_particao, declarar_filas_particionadas, criar_callback_roteador
+from runtime_amqp import Consumidor, declarar_exchanges
 
 connection = None
 channel = None
 running = True
 
-def conectar_rabbitmq():
-    global connection, channel
-    try:
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters('localhost')
-        )
-        channel = connection.channel()
-        
-        channel.exchange_declare(exchange='leilao', exchange_type='direct')
-        channel.exchange_declare(exchange='notificacoes_leilao', exchange_type='direct')
-        
-        channel.queue_declare(queue='lance_validado', durable=True)
-        channel.queue_declare(queue='leilao_vencedor', durable=True)
+# Lances de um mesmo leilão que chegam dentro de JANELA segundos viram uma só
+# notificação com o preço mais recente (e quantos lances ela agrupa). As
+# notificações da janela e os acks saem juntos num tx_commit; o vencedor
+# nunca é agrupado e descarrega a janela antes de ser publicado.
+JANELA = float(os.environ.get('NOTIF_JANELA', '0.05'))
+LOTE_MAXIMO = int(os.environ.get('NOTIF_LOTE_MAXIMO', '256'))
+lote = None
+ultimos_lances = {}
 
-        channel.queue_bind(exchange='leilao', queue='lance_validado', routing_key='lance_validado')
-        channel.queue_bind(exchange='leilao', queue='leilao_vencedor', routing_key='leilao_vencedor')
-        
-        return True
-    except Exception:
-        return False
+# Com NOTIF_TRABALHADORES > 1 o processo principal vira supervisor: sobe N
+# processos trabalhadores e encaminha cada mensagem para a fila do dono do
+# leilão (crc32 do leilao_id, como as partições do MS lance), o que mantém a
+# ordem por leilão. Cada trabalhador consome com NOTIF_PREFETCH mensagens em
+# voo; SIGINT/SIGTERM param todos depois de publicar a janela pendente.
+TRABALHADORES = int(os.environ.get('NOTIF_TRABALHADORES', '1'))
+PREFETCH = int(os.environ.get('NOTIF_PREFETCH', str(LOTE_MAXIMO * 2)))
+FILAS = ('lance_validado', 'leilao_vencedor')
+ROTEADOR_JANELA = float(os.environ.get('NOTIF_ROTEADOR_JANELA', '0.005'))
+trabalhador = None
+INTERVALO_RELATORIO = 10
+contagem = collections.Counter()
+processos = {}
+resultados = None
 
+# Sem Flask: /metrics e /perfil saem de um http.server próprio
+METRICAS_PORTA = int(os.environ.get('NOTIF_METRICAS_PORTA', '5003'))
+TRABALHADOR_METRICAS_PORTA = int(os.environ.get('NOTIF_TRABALHADOR_METRICAS_PORTA', '9130'))
+notificacoes = metricas.registro.contador(
+    'notificacoes_total', 'Notificações publicadas em notificacoes_leilao por tipo', ('tipo',)
+)
+lances_agrupados = metricas.registro.contador(
+    'notificacoes_agrupadas_total', 'Lances que não geraram notificação própria por terem sido agrupados'
+)
+
+def declarar_topologia(channel):
+    declarar_exchanges(channel)
+    
+    channel.queue_declare(queue='lance_validado', durable=True)
+    channel.queue_declare(queue='leilao_vencedor', durable=True)
+
+    channel.queue_bind(exchange='leilao', queue='lance_validado', routing_key='lance_validado')
+    channel.queue_bind(exchange='leilao', queue='leilao_vencedor', routing_key='leilao_vencedor')
+    
+    if TRABALHADORES > 1:
+        for base in FILAS:
+            declarar_filas_particionadas(channel, 'leilao', base, TRABALHADORES)
+
+@instrumentar('callback_lance_validado')
 def callback_lance_validado(ch, method, properties, body):
+    contagem['lances'] += 1
     try:
-        evento = json.loads(body)
+        evento = codec.decodificar(body, properties)
         leilao_id = evento.get('leilao_id')
         
         if leilao_id:
-            notificacao = {
+            anterior = ultimos_lances.get(leilao_id)
+            ultimos_lances[leilao_id] = {
                 "tipo": "novo_lance",
                 "leilao_id": leilao_id,
                 "user_id": evento.get('user_id'),
                 "valor": evento.get('valor'),
-                "timestamp": datetime.now().isoformat()
+                "lances_agrupados": anterior["lances_agrupados"] + 1 if anterior else 1,
+                "timestamp": codec.agora()
             }
-            
-            channel.basic_publish(
-                exchange='notificacoes_leilao',
-                routing_key=f'leilao_{leilao_id}',
-                body=json.dumps(notificacao)
-            )
                 
     except Exception as e:
-        print(f"Erro ao processar lance validado: {e}")
+        registrar_erro('callback_lance_validado', e)
     
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+    # O ack só sai quando a janela for publicada
+    lote.confirmar(method.delivery_tag)
+
+def publicar_ultimos_lances():
+    # Gancho do lote: roda antes do ack e do tx_commit
+    global ultimos_lances
+    pendentes, ultimos_lances = ultimos_lances, {}
+    for leilao_id, notificacao in pendentes.items():
+        body, properties = codec.codificar('notificacao', notificacao)
+        lote.publicar(
+            exchange='notificacoes_leilao',
+            routing_key=f'leilao_{leilao_id}',
+            body=body,
+            properties=properties
+        )
+        notificacoes.inc(tipo='novo_lance')
+        contagem['notificacoes'] += 1
+        if notificacao["lances_agrupados"] > 1:
+            lances_agrupados.inc(notificacao["lances_agrupados"] - 1)
 
+@instrumentar('callback_leilao_vencedor')
 def callback_leilao_vencedor(ch, method, properties, body):
     try:
-        evento = json.loads(body)
+        evento = codec.decodificar(body, properties)
         leilao_id = evento.get('leilao_id')
         
         if leilao_id:
@@ -63,53 +114,166 @@ def callback_leilao_vencedor(ch, method, properties, body):
                 "leilao_id": leilao_id,
                 "vencedor_id": evento.get('vencedor_id'),
                 "valor_final": evento.get('valor_final'),
-                "timestamp": datetime.now().isoformat()
+                "timestamp": codec.agora()
             }
             
-            channel.basic_publish(
+            # Os últimos preços da janela saem antes do vencedor
+            lote.descarregar()
+            body_notificacao, propriedades = codec.codificar('notificacao', notificacao)
+            lote.publicar(
                 exchange='notificacoes_leilao',
                 routing_key=f'leilao_{leilao_id}',
-                body=json.dumps(notificacao)
+                body=body_notificacao,
+                properties=propriedades
             )
+            notificacoes.inc(tipo='leilao_vencedor')
+            contagem['notificacoes'] += 1
             
     except Exception as e:
-        print(f"Erro ao processar leilão vencedor: {e}")
+        registrar_erro('callback_leilao_vencedor', e)
     
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+    lote.confirmar(method.delivery_tag)
+    lote.descarregar()
+
+def fila_do_trabalhador(base):
+    if trabalhador is None:
+        return base
+    return nome_particao(base, trabalhador)
 
 def iniciar_consumidores():
+    global lote, ultimos_lances
+    # A janela de uma conexão anterior não foi confirmada: os lances dela
+    # voltam da fila
+    ultimos_lances = {}
+    # Canal em modo transação; o prefetch deixa uma janela cheia em voo
+    channel.basic_qos(prefetch_count=PREFETCH)
+    lote = LoteConfirmacao(
+        connection, channel, LOTE_MAXIMO, JANELA,
+        nome=fila_do_trabalhador('notificacoes_leilao'), antes_de_confirmar=publicar_ultimos_lances
+    )
+    
     channel.basic_consume(
-        queue='lance_validado',
+        queue=fila_do_trabalhador('lance_validado'),
         on_message_callback=callback_lance_validado,
         auto_ack=False
     )
     
     channel.basic_consume(
-        queue='leilao_vencedor',
+        queue=fila_do_trabalhador('leilao_vencedor'),
         on_message_callback=callback_leilao_vencedor,
         auto_ack=False
     )
+    
+    metricas.monitorar_filas(connection, channel, [fila_do_trabalhador(base) for base in FILAS])
 
-def main():
-    global running
+def iniciar_roteadores():
+    global lote
+    # Os encaminhamentos e os acks saem juntos num tx_commit
+    channel.basic_qos(prefetch_count=PREFETCH)
+    lote = LoteConfirmacao(connection, channel, LOTE_MAXIMO, ROTEADOR_JANELA, nome='roteador_notif')
+    for base in FILAS:
+        channel.basic_consume(
+            queue=base,
+            on_message_callback=criar_callback_roteador('leilao', base, TRABALHADORES, 'leilao_id', lote),
+            auto_ack=False
+        )
+    
+    filas = list(FILAS) + [nome_particao(base, numero) for base in FILAS for numero in range(TRABALHADORES)]
+    metricas.monitorar_filas(connection, channel, filas)
+
+def verificar_trabalhadores():
+    # Trabalhador que caiu (não os que pararam por sinal) sobe de novo
+    for numero, processo in processos.items():
+        if running and processo.exitcode not in (None, 0):
+            print(f"Trabalhador {numero} saiu com código {processo.exitcode}, reiniciando")
+            processos[numero] = iniciar_trabalhador(numero, resultados)
+    connection.call_later(1, verificar_trabalhadores)
+
+def configurar(conexao, canal):
+    # Em cada (re)conexão: topologia, consumo e timers, conforme o papel do
+    # processo (supervisor, trabalhador ou processo único)
+    global connection, channel
+    connection, channel = conexao, canal
+    declarar_topologia(channel)
     
-    if not conectar_rabbitmq():
-        print("Erro ao conectar ao RabbitMQ")
+    if trabalhador is None and TRABALHADORES > 1:
+        iniciar_roteadores()
+        connection.call_later(1, verificar_trabalhadores)
         return
     
     iniciar_consumidores()
+    if trabalhador is not None:
+        atuais = collections.Counter(contagem)
+        connection.call_later(INTERVALO_RELATORIO, lambda: relatar(atuais))
+
+def descarregar_janela():
+    if lote is not None:
+        lote.descarregar()
+
+consumidor = Consumidor(configurar, nome='ms_notif', ao_parar=descarregar_janela)
+
+def parar(*args):
+    global running
+    running = False
+    consumidor.parar()
+
+def consumir():
+    # Até SIGINT/SIGTERM, reconectando se o broker cair; a janela pendente
+    # sai antes de fechar a conexão
+    signal.signal(signal.SIGINT, parar)
+    signal.signal(signal.SIGTERM, parar)
+    consumidor.executar()
+
+def relatar(anteriores):
+    lances = contagem['lances'] - anteriores['lances']
+    enviadas = contagem['notificacoes'] - anteriores['notificacoes']
+    print(f"[trabalhador {trabalhador}] {lances / INTERVALO_RELATORIO:.0f} lances/s, "
+          f"{enviadas / INTERVALO_RELATORIO:.0f} notificações/s")
+    atuais = collections.Counter(contagem)
+    connection.call_later(INTERVALO_RELATORIO, lambda: relatar(atuais))
+
+def executar_trabalhador(numero, resultados):
+    global trabalhador
+    trabalhador = numero
+    metricas.servir_metricas(TRABALHADOR_METRICAS_PORTA + numero)
     
-    try:
-        channel.start_consuming()
-    except KeyboardInterrupt:
-        running = False
-        try:
-            if channel:
-                channel.stop_consuming()
-            if connection and not connection.is_closed:
-                connection.close()
-        except Exception:
-            pass
+    inicio = time.monotonic()
+    consumir()
+    resultados.put((numero, contagem['lances'], contagem['notificacoes'], time.monotonic() - inicio))
+
+def iniciar_trabalhador(numero, resultados):
+    processo = multiprocessing.Process(target=executar_trabalhador, args=(numero, resultados))
+    processo.start()
+    return processo
+
+def supervisionar():
+    global resultados
+    resultados = multiprocessing.Queue()
+    processos.update({numero: iniciar_trabalhador(numero, resultados) for numero in range(TRABALHADORES)})
+    consumir()
+    
+    for processo in processos.values():
+        processo.terminate()
+    for processo in processos.values():
+        processo.join(10)
+    
+    total_lances = total_notificacoes = 0
+    while not resultados.empty():
+        numero, lances, enviadas, duracao = resultados.get()
+        print(f"Trabalhador {numero}: {lances} lances, {enviadas} notificações em {duracao:.1f}s "
+              f"({lances / (duracao or 1):.0f} lances/s)")
+        total_lances += lances
+        total_notificacoes += enviadas
+    print(f"Total: {total_lances} lances, {total_notificacoes} notificações")
+
+def main():
+    metricas.servir_metricas(METRICAS_PORTA)
+    
+    if TRABALHADORES > 1:
+        supervisionar()
+        return
+    
+    consumir()
 
 if __name__ == "__main__":
     main()
@@ -1,104 +1,308 @@
-import pika, json, threading, requests
-from flask import Flask, request, jsonify
+import os, threading, time, requests
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-from datetime import datetime
+from persistencia import Diario
+from publicador import Publicador
+from runtime_amqp import Consumidor, declarar_exchanges as declarar_exchanges_leilao
+import metricas
+from metricas import instrumentar, registrar_erro
+import codec
 
 app = Flask(__name__)
 CORS(app)
 
-RABBITMQ_HOST = "localhost"
 SISTEMA_PAGAMENTO_URL = "http://localhost:7000/criar_transacao"
 WEBHOOK_URL = "http://localhost:5002/webhook_pagamento"
 
+pagamentos = metricas.registro.contador(
+    'pagamentos_total', 'Vencedores enviados ao sistema de pagamento por resultado', ('resultado',)
+)
+duracao_transacao = metricas.registro.histograma(
+    'sistema_pagamento_segundos', 'Duração do POST /criar_transacao no sistema de pagamento'
+)
 
-def conectar_rabbitmq():
-    connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST))
-    channel = connection.channel()
-    channel.exchange_declare(exchange='leilao', exchange_type='direct')
-    channel.queue_declare(queue='leilao_vencedor', durable=True)
-    channel.queue_bind(exchange='leilao', queue='leilao_vencedor', routing_key='leilao_vencedor')
-    return connection, channel
 
+# Os vencedores são despachados para um pool de TRABALHADORES threads; o
+# callback do pika só decodifica e entrega. Cada thread tem sua sessão HTTP
+# (conexões reaproveitadas) e tenta até TENTATIVAS vezes com backoff
+# exponencial; o que não passar vai para a fila FILA_DLQ. A criação da
+# transação é idempotente por leilao_id: a chave vai no header
+# Idempotency-Key e as transações criadas ficam no diário local.
+FILA_VENCEDORES = 'pagamento.leilao_vencedor'
+FILA_DLQ = 'pagamento.leilao_vencedor.dlq'
+TRABALHADORES = int(os.environ.get('PAGAMENTO_TRABALHADORES', '8'))
+TENTATIVAS = int(os.environ.get('PAGAMENTO_TENTATIVAS', '5'))
+BACKOFF_INICIAL = float(os.environ.get('PAGAMENTO_BACKOFF_INICIAL', '0.5'))
+BACKOFF_MAXIMO = 30
+DIARIO = os.environ.get('PAGAMENTO_DIARIO', 'ms_pagamento.db')
 
+pool = None
+diario = None
+sessoes = threading.local()
+
+# leilao_id -> transação criada; em_andamento evita duas tentativas simultâneas
+transacoes = {}
+em_andamento = set()
+lock_transacoes = threading.Lock()
+
+metricas.registro.medidor(
+    'pagamentos_em_andamento', 'Vencedores sendo processados pelo pool', funcao=lambda: len(em_andamento)
+)
+
+
+def declarar_exchanges(ch):
+    declarar_exchanges_leilao(ch)
+    ch.queue_declare(queue=FILA_DLQ, durable=True)
+    ch.queue_bind(exchange='leilao', queue=FILA_DLQ, routing_key=FILA_DLQ)
+
+
+publicador = Publicador(declarar_exchanges, nome='ms_pagamento')
 
-def callback_leilao_vencedor(ch, method, properties, body):
-    evento = json.loads(body)
 
+def sessao_http():
+    if not hasattr(sessoes, 'sessao'):
+        sessoes.sessao = requests.Session()
+    return sessoes.sessao
+
+
+def confirmar_entrega(entrega, devolver=False):
+    # Chamado pelas threads do pool; o ack (ou o nack, com devolver=True) roda
+    # na thread dona do canal. Se a conexão caiu nesse meio tempo a mensagem já
+    # voltou para a fila, e a reentrega é descartada se a transação está no
+    # diário
+    connection, channel, delivery_tag = entrega
+
+    def responder():
+        if not channel.is_open:
+            return
+        if devolver:
+            channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+        else:
+            channel.basic_ack(delivery_tag=delivery_tag)
+
+    try:
+        connection.add_callback_threadsafe(responder)
+    except Exception as e:
+        registrar_erro('confirmar_entrega', e)
+
+
+class RecusaDefinitiva(Exception):
+    # Resposta que não adianta repetir (4xx, exceto 408/429)
+    pass
+
+
+def criar_transacao(dados_pagamento):
+    with duracao_transacao.cronometrar():
+        resposta = sessao_http().post(
+            SISTEMA_PAGAMENTO_URL,
+            json=dados_pagamento,
+            headers={"Idempotency-Key": str(dados_pagamento["leilao_id"])},
+            timeout=5
+        )
+
+    if resposta.status_code in (200, 201):
+        return resposta.json()
+    if 400 <= resposta.status_code < 500 and resposta.status_code not in (408, 429):
+        raise RecusaDefinitiva(f"sistema de pagamento recusou: HTTP {resposta.status_code}")
+    raise ConnectionError(f"sistema de pagamento indisponível: HTTP {resposta.status_code}")
+
+
+def enviar_para_dlq(evento, erro, tentativas):
+    body, properties = codec.codificar(FILA_DLQ, {
+        "evento": evento,
+        "erro": str(erro),
+        "tentativas": tentativas,
+        "timestamp": codec.agora()
+    })
+    publicador.publicar(
+        exchange='leilao',
+        routing_key=FILA_DLQ,
+        body=body,
+        properties=properties,
+        aguardar=True
+    )
+    pagamentos.inc(resultado='dlq')
+    print(f"Pagamento do leilão {evento.get('leilao_id')} enviado para {FILA_DLQ}: {erro}")
+
+
+def pagar_vencedor(evento):
+    leilao_id = evento["leilao_id"]
     dados_pagamento = {
-        "leilao_id": evento["leilao_id"],
+        "leilao_id": leilao_id,
         "vencedor_id": evento["vencedor_id"],
         "valor": evento["valor_final"],
         "webhook_url": WEBHOOK_URL
     }
 
-    try:
-        resposta = requests.post(SISTEMA_PAGAMENTO_URL, json=dados_pagamento, timeout=5)
-
-        if resposta.status_code != 201:
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+    backoff = BACKOFF_INICIAL
+    for tentativa in range(1, TENTATIVAS + 1):
+        try:
+            data = criar_transacao(dados_pagamento)
+            break
+        except RecusaDefinitiva as e:
+            enviar_para_dlq(evento, e, tentativa)
             return
+        except Exception as e:
+            if tentativa == TENTATIVAS:
+                enviar_para_dlq(evento, e, tentativa)
+                return
+            pagamentos.inc(resultado='retentativa')
+            time.sleep(backoff)
+            backoff = min(backoff * 2, BACKOFF_MAXIMO)
+
+    transacao = {
+        "leilao_id": leilao_id,
+        "transacao_id": data.get("transacao_id"),
+        "link": data.get("link_pagamento")
+    }
 
-        data = resposta.json()
-        link = data.get("link_pagamento")
-        transacao_id = data.get("transacao_id")
-
+    # A transação só conta como feita depois que o link saiu: se a publicação
+    # falhar, a reentrega passa de novo pelo sistema de pagamento (idempotente
+    # pela Idempotency-Key) e publica o link
+    evento_link = {
+        "leilao_id": leilao_id,
+        "vencedor_id": evento["vencedor_id"],
+        "link": transacao["link"],
+        "timestamp": codec.agora()
+    }
+    body, properties = codec.codificar('link_pagamento', evento_link)
+    publicador.publicar(
+        exchange='leilao',
+        routing_key='link_pagamento',
+        body=body,
+        properties=properties,
+        aguardar=True
+    )
+    with lock_transacoes:
+        transacoes[leilao_id] = transacao
+    if diario is not None:
+        diario.confirmar(diario.registrar('transacao', transacao))
+        if diario.precisa_snapshot():
+            diario.gravar_snapshot(lambda: {"transacoes": list(transacoes.values())})
+    pagamentos.inc(resultado='link_gerado')
+
+
+def processar_vencedor(evento, entrega):
+    # Roda no pool
+    devolver = False
+    try:
+        pagar_vencedor(evento)
+    except Exception as e:
+        # Falha ao publicar (link ou DLQ): a entrega volta para a fila na
+        # hora, sem ocupar uma posição do prefetch até a conexão cair
+        pagamentos.inc(resultado='erro')
+        registrar_erro('processar_vencedor', e)
+        devolver = True
 
-        evento_link = {
-            "leilao_id": evento["leilao_id"],
-            "vencedor_id": evento["vencedor_id"],
-            "link": link,
-            "timestamp": datetime.now().isoformat()
-        }
+    # Antes do ack/nack, para a reentrega não ser tomada por duplicada
+    with lock_transacoes:
+        em_andamento.discard(evento["leilao_id"])
+    confirmar_entrega(entrega, devolver)
 
-        ch.basic_publish(
-            exchange='leilao',
-            routing_key='link_pagamento',
-            body=json.dumps(evento_link)
-        )
 
+@instrumentar('callback_leilao_vencedor')
+def callback_leilao_vencedor(ch, method, properties, body):
+    try:
+        evento = codec.decodificar(body, properties)
+        leilao_id = evento["leilao_id"]
     except Exception as e:
+        registrar_erro('callback_leilao_vencedor', e)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
         return
 
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+    with lock_transacoes:
+        duplicado = leilao_id in transacoes or leilao_id in em_andamento
+        if not duplicado:
+            em_andamento.add(leilao_id)
+
+    if duplicado:
+        pagamentos.inc(resultado='duplicado')
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        return
+
+    pool.submit(processar_vencedor, evento, (consumidor.connection, ch, method.delivery_tag))
+
 
+def recuperar_transacoes():
+    global diario
+    diario = Diario(DIARIO)
 
+    def restaurar(estado):
+        transacoes.update({transacao["leilao_id"]: transacao for transacao in estado["transacoes"]})
+
+    def aplicar(tipo, dados):
+        transacoes[dados["leilao_id"]] = dados
+
+    diario.recuperar(restaurar, aplicar)
 
 
 @app.route('/webhook_pagamento', methods=['POST'])
+@instrumentar('receber_webhook')
 def receber_webhook():
     dados = request.json
 
-    connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST))
-    channel = connection.channel()
-    channel.exchange_declare(exchange='leilao', exchange_type='direct')
-
     evento_status = {
         "leilao_id": dados.get("leilao_id"),
         "vencedor_id": dados.get("comprador", {}).get("id"),
         "status": dados.get("status"),
-        "timestamp": datetime.now().isoformat()
+        "timestamp": codec.agora()
     }
 
-    channel.basic_publish(
+    body, properties = codec.codificar('status_pagamento', evento_status)
+    publicador.publicar(
         exchange='leilao',
         routing_key='status_pagamento',
-        body=json.dumps(evento_status)
+        body=body,
+        properties=properties,
+        aguardar=True
     )
 
-
-    connection.close()
     return jsonify({"message": "Webhook processado com sucesso"}), 200
 
 
+@app.route('/saude', methods=['GET'])
+def saude():
+    estado = publicador.estado()
+    estado_consumidor = consumidor.estado()
+    saudavel = estado["saudavel"] and estado_consumidor["conectado"]
+    return jsonify({"publicador": estado, "consumidor": estado_consumidor}), 200 if saudavel else 503
+
+
+@app.route('/metrics', methods=['GET'])
+def expor_metricas():
+    corpo, content_type = metricas.exposicao()
+    return Response(corpo, content_type=content_type)
+
 
-def consumidor_thread():
-    connection, channel = conectar_rabbitmq()
-    channel.basic_consume(queue='leilao_vencedor', on_message_callback=callback_leilao_vencedor)
-    channel.start_consuming()
+@app.route('/perfil', methods=['GET'])
+def expor_perfil():
+    return Response(metricas.perfil_texto(), content_type='text/plain; charset=utf-8')
+
+
+
+def configurar(connection, channel):
+    # Em cada (re)conexão
+    declarar_exchanges(channel)
+    # Fila própria: a leilao_vencedor é consumida pelo ms_notif
+    channel.queue_declare(queue=FILA_VENCEDORES, durable=True)
+    channel.queue_bind(exchange='leilao', queue=FILA_VENCEDORES, routing_key='leilao_vencedor')
+    channel.basic_qos(prefetch_count=TRABALHADORES * 2)
+    channel.basic_consume(queue=FILA_VENCEDORES, on_message_callback=callback_leilao_vencedor)
+    metricas.monitorar_filas(connection, channel, [FILA_VENCEDORES, FILA_DLQ])
+
+
+consumidor = Consumidor(configurar, nome='ms_pagamento')
 
 
 def main():
-    threading.Thread(target=consumidor_thread, daemon=True).start()
+    global pool
+    if DIARIO:
+        recuperar_transacoes()
+    pool = ThreadPoolExecutor(max_workers=TRABALHADORES, thread_name_prefix='pagamento')
+
+    threading.Thread(target=consumidor.executar, daemon=True).start()
+    publicador.iniciar()
     app.run(host="0.0.0.0", port=5002, debug=False)
 
 
@@ -0,0 +1,53 @@
+import zlib
+import codec
+
+
+def particao_do_leilao(leilao_id, particoes):
+    # crc32 é estável entre processos (o hash() de str muda a cada execução)
+    return zlib.crc32(str(leilao_id).encode()) % particoes
+
+def nome_particao(base, particao):
+    return f"{base}.p{particao}"
+
+def routing_key_particao(base, leilao_id, particoes):
+    if particoes <= 1:
+        return base
+    return nome_particao(base, particao_do_leilao(leilao_id, particoes))
+
+def declarar_filas_particionadas(channel, exchange, base, particoes):
+    for particao in range(particoes):
+        fila = nome_particao(base, particao)
+        channel.queue_declare(queue=fila, durable=True)
+        channel.queue_bind(exchange=exchange, queue=fila, routing_key=fila)
+
+def criar_callback_roteador(exchange, base, particoes, campo_id, lote):
+    # Reencaminha cada mensagem da fila base para a fila da partição dona do
+    # leilão. Um único consumidor na fila base mantém a ordem por leilão. O
+    # canal do consumidor é o do lote (modo transação): o ack só vale junto
+    # com o tx_commit que publica na partição, e se a publicação falhar a
+    # mensagem volta para a fila base.
+    def callback_roteador(ch, method, properties, body):
+        try:
+            leilao_id = codec.decodificar(body, properties).get(campo_id)
+        except Exception as e:
+            # Nenhuma partição saberia tratar: devolver só a faria voltar
+            print(f"Mensagem de {base} descartada: {e}")
+            lote.confirmar(method.delivery_tag)
+            return
+
+        try:
+            lote.publicar(
+                exchange=exchange,
+                routing_key=routing_key_particao(base, leilao_id, particoes),
+                body=body,
+                properties=properties
+            )
+        except Exception as e:
+            print(f"Erro ao rotear mensagem de {base}: {e}")
+            if ch.is_open:
+                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            return
+
+        lote.confirmar(method.delivery_tag)
+
+    return callback_roteador
@@ -0,0 +1,175 @@
+import json
+import sqlite3
+import threading
+import time
+from metricas import registro
+
+# Diário de eventos em SQLite (modo WAL): cada serviço acrescenta eventos e
+# periodicamente grava um snapshot do estado, descartando os eventos já
+# cobertos. Na inicialização o estado é refeito a partir do último snapshot
+# mais os eventos posteriores.
+#
+# As gravações são em grupo: registrar() só enfileira e confirmar() grava
+# tudo o que estiver pendente numa única transação (um fsync). Quem chega
+# enquanto outro confirma pega carona no commit seguinte ou já sai coberto.
+INTERVALO_RELATORIO = 10
+
+duracao_commit = registro.histograma(
+    'diario_commit_segundos', 'Duração de cada commit em grupo do diário (inclui o fsync)', ('diario',)
+)
+eventos_commit = registro.histograma(
+    'diario_eventos_por_commit', 'Eventos gravados por commit do diário', ('diario',),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+)
+
+
+class Diario:
+    def __init__(self, caminho, snapshot_a_cada=10000):
+        self.caminho = caminho
+        self.snapshot_a_cada = snapshot_a_cada
+
+        self.con = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=FULL")
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS eventos (seq INTEGER PRIMARY KEY, tipo TEXT NOT NULL, dados TEXT NOT NULL)"
+        )
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots (seq INTEGER PRIMARY KEY, dados TEXT NOT NULL)"
+        )
+
+        self.lock = threading.Lock()
+        self.lock_commit = threading.Lock()
+        self.pendentes = []
+
+        ultimo = self.con.execute(
+            "SELECT MAX(seq) FROM (SELECT seq FROM eventos UNION ALL SELECT seq FROM snapshots)"
+        ).fetchone()[0] or 0
+        self.ultimo_seq = ultimo
+        self.seq_confirmado = ultimo
+        self.eventos_desde_snapshot = 0
+
+        self.total_commits = 0
+        self.total_eventos = 0
+        self.tempo_commits = 0.0
+        self.ultimo_relatorio = time.monotonic()
+
+    def registrar(self, tipo, dados):
+        with self.lock:
+            self.ultimo_seq += 1
+            self.pendentes.append((self.ultimo_seq, tipo, json.dumps(dados)))
+            return self.ultimo_seq
+
+    def confirmar(self, ate=None):
+        with self.lock_commit:
+            if ate is not None and ate <= self.seq_confirmado:
+                return
+
+            with self.lock:
+                lote, self.pendentes = self.pendentes, []
+            if not lote:
+                return
+
+            inicio = time.perf_counter()
+            self.con.execute("BEGIN")
+            self.con.executemany("INSERT INTO eventos (seq, tipo, dados) VALUES (?, ?, ?)", lote)
+            self.con.execute("COMMIT")
+            duracao = time.perf_counter() - inicio
+            self.tempo_commits += duracao
+            duracao_commit.observar(duracao, diario=self.caminho)
+            eventos_commit.observar(len(lote), diario=self.caminho)
+
+            self.seq_confirmado = lote[-1][0]
+            self.eventos_desde_snapshot += len(lote)
+            self.total_commits += 1
+            self.total_eventos += len(lote)
+            self._relatar()
+
+    def descartar(self, seqs):
+        # Retira eventos que não valem mais (ex.: o commit no broker do lote
+        # que os registrou falhou), estejam pendentes ou já gravados
+        seqs = set(seqs)
+        with self.lock_commit:
+            with self.lock:
+                self.pendentes = [evento for evento in self.pendentes if evento[0] not in seqs]
+            self.con.execute("BEGIN")
+            self.con.executemany("DELETE FROM eventos WHERE seq = ?", [(seq,) for seq in seqs])
+            self.con.execute("COMMIT")
+
+    def descartar_sem_marca(self, marca, tipos):
+        # Retira os eventos dos tipos dados gravados depois da última marca
+        with self.lock_commit:
+            ultima = self.con.execute("SELECT MAX(seq) FROM eventos WHERE tipo = ?", (marca,)).fetchone()[0] or 0
+            self.con.execute("BEGIN")
+            self.con.execute(
+                f"DELETE FROM eventos WHERE seq > ? AND tipo IN ({', '.join('?' * len(tipos))})",
+                (ultima, *tipos)
+            )
+            self.con.execute("COMMIT")
+
+    def precisa_snapshot(self):
+        return self.eventos_desde_snapshot >= self.snapshot_a_cada
+
+    def gravar_snapshot(self, obter_estado):
+        # O estado é lido depois de fixar o seq do snapshot. Como os serviços
+        # registram cada evento depois de aplicá-lo, tudo até o seq já está no
+        # estado; eventos posteriores podem estar também, então precisam ser
+        # idempotentes ou registrados pela mesma thread que chama o snapshot.
+        self.confirmar()
+        with self.lock_commit:
+            seq = self.seq_confirmado
+            estado = obter_estado()
+            self.con.execute("BEGIN")
+            self.con.execute("INSERT OR REPLACE INTO snapshots (seq, dados) VALUES (?, ?)", (seq, json.dumps(estado)))
+            self.con.execute("DELETE FROM eventos WHERE seq <= ?", (seq,))
+            self.con.execute("DELETE FROM snapshots WHERE seq < ?", (seq,))
+            self.con.execute("COMMIT")
+            self.eventos_desde_snapshot = 0
+
+    def recuperar(self, restaurar_snapshot, aplicar_evento):
+        inicio = time.perf_counter()
+
+        snapshot = self.con.execute("SELECT seq, dados FROM snapshots ORDER BY seq DESC LIMIT 1").fetchone()
+        seq_snapshot = 0
+        if snapshot is not None:
+            seq_snapshot = snapshot[0]
+            restaurar_snapshot(json.loads(snapshot[1]))
+
+        eventos = 0
+        cursor = self.con.execute("SELECT tipo, dados FROM eventos WHERE seq > ? ORDER BY seq", (seq_snapshot,))
+        for tipo, dados in cursor:
+            aplicar_evento(tipo, json.loads(dados))
+            eventos += 1
+        self.eventos_desde_snapshot = eventos
+
+        duracao = (time.perf_counter() - inicio) * 1000
+        print(
+            f"[{self.caminho}] recuperado em {duracao:.1f} ms "
+            f"(snapshot seq {seq_snapshot} + {eventos} eventos)"
+        )
+        return duracao
+
+    def estatisticas(self):
+        commits = self.total_commits or 1
+        return {
+            "commits": self.total_commits,
+            "eventos": self.total_eventos,
+            "eventos_por_commit": self.total_eventos / commits,
+            "commit_medio_ms": self.tempo_commits / commits * 1000
+        }
+
+    def _relatar(self):
+        agora = time.monotonic()
+        if agora - self.ultimo_relatorio < INTERVALO_RELATORIO:
+            return
+        self.ultimo_relatorio = agora
+
+        stats = self.estatisticas()
+        print(
+            f"[{self.caminho}] {stats['commits']} commits, {stats['eventos_por_commit']:.1f} eventos/commit, "
+            f"fsync médio {stats['commit_medio_ms']:.2f} ms"
+        )
+
+    def fechar(self):
+        self.confirmar()
+        self.con.close()
@@ -0,0 +1,90 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+
+# Cache do MS leilão com o preço atual, o líder e o número de lances de cada
+# leilão ativo, alimentado pelos lance_validado, e o ranking dos leilões mais
+# disputados.
+#
+# A atividade de um leilão é a soma dos seus lances com decaimento exponencial
+# de constante `janela` segundos (~ lances na última janela). Como todos os
+# leilões decaem no mesmo ritmo, a ordem entre eles não muda com o tempo: basta
+# guardar o log da atividade relativo a um instante fixo, sem reescrever
+# ninguém. Cada lance empurra uma entrada nova no heap (O(log n)); as entradas
+# antigas do mesmo leilão ficam lá e são descartadas quando aparecem no topo
+# (heap preguiçoso). O heap é compactado quando passa do dobro dos leilões.
+
+
+class PrecosLeiloes:
+    def __init__(self, janela=60.0):
+        self.janela = janela
+        self.versao = 0
+        self._precos = {}       # leilao_id -> {"ultimoLance", "lider", "lances"}
+        self._atividade = {}    # leilao_id -> log da atividade (entrada válida do heap)
+        self._heap = []         # (-log da atividade, desempate, leilao_id)
+        self._desempate = itertools.count()
+        self._origem = time.time()
+        self._trava = threading.Lock()
+
+    def registrar(self, leilao_id, valor, lider, instante=None):
+        instante = time.time() if instante is None else instante
+        with self._trava:
+            preco = self._precos.get(leilao_id)
+            if preco is None:
+                preco = self._precos[leilao_id] = {"ultimoLance": None, "lider": None, "lances": 0}
+            preco["lances"] += 1
+            if preco["ultimoLance"] is None or valor > preco["ultimoLance"]:
+                preco["ultimoLance"] = valor
+                preco["lider"] = lider
+            self._aquecer(leilao_id, instante)
+            self.versao += 1
+
+    def _aquecer(self, leilao_id, instante):
+        termo = (instante - self._origem) / self.janela
+        anterior = self._atividade.get(leilao_id)
+        if anterior is None:
+            atual = termo
+        else:
+            # log(e^anterior + e^termo) sem estourar o exp
+            atual = max(anterior, termo) + math.log1p(math.exp(-abs(anterior - termo)))
+        self._atividade[leilao_id] = atual
+        heapq.heappush(self._heap, (-atual, next(self._desempate), leilao_id))
+
+        if len(self._heap) > 2 * len(self._atividade) + 64:
+            self._heap = [entrada for entrada in self._heap if self._valida(entrada)]
+            heapq.heapify(self._heap)
+
+    def _valida(self, entrada):
+        return self._atividade.get(entrada[2]) == -entrada[0]
+
+    def remover(self, leilao_id):
+        # Leilão encerrado: sai do cache; a entrada no heap vira lixo
+        with self._trava:
+            if self._precos.pop(leilao_id, None) is not None:
+                self._atividade.pop(leilao_id, None)
+                self.versao += 1
+
+    def obter(self, leilao_id):
+        preco = self._precos.get(leilao_id)
+        return dict(preco) if preco is not None else None
+
+    def quentes(self, limite, agora=None):
+        # [(leilao_id, atividade, preço)] dos `limite` leilões mais disputados
+        referencia = ((time.time() if agora is None else agora) - self._origem) / self.janela
+        with self._trava:
+            escolhidos = []
+            while self._heap and len(escolhidos) < limite:
+                entrada = heapq.heappop(self._heap)
+                if self._valida(entrada):
+                    escolhidos.append(entrada)
+            for entrada in escolhidos:
+                heapq.heappush(self._heap, entrada)
+            return [
+                (leilao_id, math.exp(-negativo - referencia), dict(self._precos[leilao_id]))
+                for negativo, _, leilao_id in escolhidos
+            ]
+
+    def __len__(self):
+        return len(self._precos)
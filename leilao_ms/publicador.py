@@ -0,0 +1,169 @@
+import queue
+import threading
+import time
+import pika
+from metricas import registro, erros
+from runtime_amqp import HOST, parametros
+
+# Publicador compartilhado pelas threads do Flask (e demais threads que não
+# são donas de um canal). Canais do pika não são thread-safe, então uma única
+# thread é dona da conexão e recebe as mensagens por uma fila. Cada rodada
+# publica tudo o que estiver na fila e confirma com um único tx_commit.
+# Se a conexão cair, a thread reconecta com backoff e republica o lote.
+#
+# publicar(aguardar=True) que estoura o tempo_limite retira a mensagem antes
+# de levantar o TimeoutError: ela não sai mais, e quem recebe o erro pode
+# repetir sem duplicar. Se a mensagem já está num commit em andamento, espera
+# o resultado dele (publicada, ou de volta à fila se o commit falhou).
+LOTE_MAXIMO = 256
+INTERVALO_OCIOSO = 0.5
+BACKOFF_INICIAL = 0.5
+BACKOFF_MAXIMO = 30
+
+latencia_publicacao = registro.histograma(
+    'publicacao_segundos', 'De publicar() até o tx_commit que cobre a mensagem', ('publicador',)
+)
+pendentes = registro.medidor(
+    'publicador_pendentes', 'Mensagens aguardando publicação', ('publicador',)
+)
+
+
+class _Mensagem:
+    __slots__ = ('exchange', 'routing_key', 'body', 'properties', 'publicada', 'criada', 'enviando', 'cancelada')
+
+    def __init__(self, exchange, routing_key, body, properties, aguardar):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.body = body
+        self.properties = properties
+        self.publicada = threading.Event() if aguardar else None
+        self.criada = time.perf_counter()
+        self.enviando = False
+        self.cancelada = False
+
+
+class Publicador:
+    def __init__(self, declarar=None, host=HOST, nome='publicador'):
+        self.declarar = declarar
+        self.host = host
+        self.nome = nome
+
+        self._fila = queue.Queue()
+        self._retentativas = []
+        self._trava = threading.Lock()
+        self._connection = None
+        self._channel = None
+        self._rodando = False
+        self._thread = None
+        self._ultimo_erro = None
+
+    def iniciar(self):
+        self._rodando = True
+        self._thread = threading.Thread(target=self._executar, daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._rodando = False
+
+    def publicar(self, exchange, routing_key, body, properties=None, aguardar=False, tempo_limite=5):
+        mensagem = _Mensagem(exchange, routing_key, body, properties, aguardar)
+        self._fila.put(mensagem)
+        if aguardar:
+            espera = tempo_limite
+            while not mensagem.publicada.wait(espera):
+                if self._cancelar(mensagem):
+                    raise TimeoutError(f"{self.nome}: publicação em {routing_key} não confirmada em {tempo_limite}s")
+                espera = INTERVALO_OCIOSO
+
+    def _cancelar(self, mensagem):
+        with self._trava:
+            if mensagem.enviando or mensagem.publicada.is_set():
+                return False
+            mensagem.cancelada = True
+            return True
+
+    def saudavel(self):
+        return (
+            self._thread is not None and self._thread.is_alive()
+            and self._connection is not None and self._connection.is_open
+        )
+
+    def estado(self):
+        return {
+            "saudavel": self.saudavel(),
+            "pendentes": self._fila.qsize() + len(self._retentativas),
+            "ultimo_erro": self._ultimo_erro
+        }
+
+    def _conectar(self):
+        self._connection = pika.BlockingConnection(parametros(self.host))
+        self._channel = self._connection.channel()
+        if self.declarar is not None:
+            self.declarar(self._channel)
+        self._channel.tx_select()
+
+    def _proximo_lote(self):
+        lote, self._retentativas = self._retentativas, []
+        if not lote:
+            try:
+                lote.append(self._fila.get(timeout=INTERVALO_OCIOSO))
+            except queue.Empty:
+                return lote
+        while len(lote) < LOTE_MAXIMO:
+            try:
+                lote.append(self._fila.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _executar(self):
+        backoff = BACKOFF_INICIAL
+        while self._rodando:
+            lote = []
+            try:
+                if self._connection is None or self._connection.is_closed:
+                    self._conectar()
+                    backoff = BACKOFF_INICIAL
+
+                lote = self._proximo_lote()
+                with self._trava:
+                    lote = [mensagem for mensagem in lote if not mensagem.cancelada]
+                    for mensagem in lote:
+                        mensagem.enviando = True
+                pendentes.definir(self._fila.qsize(), publicador=self.nome)
+                if not lote:
+                    # Mantém os heartbeats em dia enquanto não há o que publicar
+                    self._connection.process_data_events(time_limit=0)
+                    continue
+
+                for mensagem in lote:
+                    self._channel.basic_publish(
+                        exchange=mensagem.exchange,
+                        routing_key=mensagem.routing_key,
+                        body=mensagem.body,
+                        properties=mensagem.properties
+                    )
+                self._channel.tx_commit()
+
+                agora = time.perf_counter()
+                for mensagem in lote:
+                    latencia_publicacao.observar(agora - mensagem.criada, publicador=self.nome)
+                    if mensagem.publicada is not None:
+                        mensagem.publicada.set()
+            except Exception as e:
+                self._ultimo_erro = str(e)
+                erros.inc(origem=self.nome + '.publicador')
+                print(f"[{self.nome}] erro ao publicar, reconectando em {backoff:.1f}s: {e}")
+                with self._trava:
+                    for mensagem in lote:
+                        mensagem.enviando = False
+                self._retentativas = lote + self._retentativas
+                try:
+                    if self._connection is not None and self._connection.is_open:
+                        self._connection.close()
+                except Exception:
+                    pass
+                self._connection = None
+                time.sleep(backoff)
+                backoff = min(backoff * 2, BACKOFF_MAXIMO)
@@ -0,0 +1,93 @@
+import json
+import threading
+from collections import deque
+
+# Para validar um lance e escolher o vencedor só importa o melhor lance, então
+# cada leilão guarda apenas ele e a contagem. O histórico é opcional: em
+# memória fica limitado aos últimos N lances e o completo pode ir para disco.
+
+
+class RegistroLances:
+    __slots__ = ('melhor_valor', 'melhor_usuario', 'melhor_timestamp', 'quantidade', 'historico')
+
+    def __init__(self, historico_maximo=0):
+        self.melhor_valor = None
+        self.melhor_usuario = None
+        self.melhor_timestamp = None
+        self.quantidade = 0
+        self.historico = deque(maxlen=historico_maximo) if historico_maximo > 0 else None
+
+    def registrar(self, user_id, valor, timestamp):
+        self.melhor_valor = valor
+        self.melhor_usuario = user_id
+        self.melhor_timestamp = timestamp
+        self.quantidade += 1
+        if self.historico is not None:
+            self.historico.append((user_id, valor, timestamp))
+
+    def copiar(self):
+        copia = RegistroLances()
+        copia.melhor_valor = self.melhor_valor
+        copia.melhor_usuario = self.melhor_usuario
+        copia.melhor_timestamp = self.melhor_timestamp
+        copia.quantidade = self.quantidade
+        if self.historico is not None:
+            copia.historico = deque(self.historico, maxlen=self.historico.maxlen)
+        return copia
+
+    def ultimos_lances(self):
+        if self.historico is None:
+            return []
+        return [
+            {"user_id": user_id, "valor": valor, "timestamp": timestamp}
+            for user_id, valor, timestamp in self.historico
+        ]
+
+
+class HistoricoEmDisco:
+    # Um arquivo NDJSON só de acréscimo, com um lance validado por linha e uma
+    # linha de fechamento por leilão encerrado (lida por exportacao_lances.py).
+    # As linhas ficam em memória até descarregar(), chamado depois que o lote
+    # que as gerou foi confirmado; descartar() joga fora as de um lote perdido.
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.lock = threading.Lock()
+        self.arquivo = open(caminho, 'a', encoding='utf-8')
+        self.pendentes = []
+
+    def gravar(self, leilao_id, user_id, valor, timestamp):
+        linha = json.dumps({
+            "leilao_id": leilao_id,
+            "user_id": user_id,
+            "valor": valor,
+            "timestamp": timestamp
+        })
+        with self.lock:
+            self.pendentes.append(linha)
+
+    def gravar_fechamento(self, leilao_id, fim, vencedor_id, valor_final):
+        # Linha com "fim": marca o encerramento do leilão para os resumos
+        linha = json.dumps({
+            "leilao_id": leilao_id,
+            "fim": fim,
+            "vencedor_id": vencedor_id,
+            "valor_final": valor_final
+        })
+        with self.lock:
+            self.pendentes.append(linha)
+
+    def descarregar(self):
+        with self.lock:
+            if self.pendentes:
+                self.arquivo.write('\n'.join(self.pendentes) + '\n')
+                self.pendentes = []
+            self.arquivo.flush()
+
+    def descartar(self):
+        with self.lock:
+            self.pendentes = []
+
+    def fechar(self):
+        self.descarregar()
+        with self.lock:
+            self.arquivo.close()
@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+import pika
+from metricas import registro, registrar_erro
+
+# Conexões AMQP dos MS com pika (os modos assíncronos usam o connect_robust do
+# aio-pika, em runtime_async). As exchanges são duráveis: com as filas
+# duráveis e as mensagens persistentes (codec), a topologia e o que estava na
+# fila sobrevivem a um reinício do broker.
+#
+# O Consumidor roda o laço de consumo de uma thread. Se a conexão cair
+# (broker reiniciado, heartbeat perdido), reconecta com backoff e chama de
+# novo configurar(connection, channel), que redeclara a topologia, registra os
+# basic_consume e reagenda os timers; as entregas sem ack voltam para a fila e
+# são reentregues. Estado preso à conexão antiga (lotes, timers, delivery
+# tags) deve ser refeito em configurar.
+HOST = os.environ.get('RABBITMQ_HOST', 'localhost')
+HEARTBEAT = int(os.environ.get('RABBITMQ_HEARTBEAT', '30'))
+BLOQUEIO_TIMEOUT = float(os.environ.get('RABBITMQ_BLOQUEIO_TIMEOUT', '60'))
+FILA_EXPIRA_MS = int(os.environ.get('RABBITMQ_FILA_EXPIRA_MS', str(24 * 3600 * 1000)))
+BACKOFF_INICIAL = 0.5
+BACKOFF_MAXIMO = 30
+INTERVALO_EVENTOS = 0.5
+
+EXCHANGES = {
+    'leilao_iniciado': 'fanout',
+    'leilao': 'direct',
+    'notificacoes_leilao': 'direct',
+}
+
+reconexoes = registro.contador(
+    'amqp_reconexoes_total', 'Conexões ao broker refeitas depois de uma queda', ('consumidor',)
+)
+conectado = registro.medidor('amqp_conectado', '1 se o consumidor está conectado ao broker', ('consumidor',))
+
+
+def parametros(host=HOST):
+    return pika.ConnectionParameters(host, heartbeat=HEARTBEAT, blocked_connection_timeout=BLOQUEIO_TIMEOUT)
+
+
+def declarar_exchanges(ch):
+    for nome, tipo in EXCHANGES.items():
+        ch.exchange_declare(exchange=nome, exchange_type=tipo, durable=True)
+
+
+def declarar_fila_propria(ch, fila, exchange, routing_keys=(None,)):
+    # Fila durável com nome fixo para um único consumidor, no lugar de uma
+    # exclusiva: guarda os eventos enquanto o MS está desconectado e é
+    # apagada pelo broker depois de FILA_EXPIRA_MS sem uso
+    ch.queue_declare(queue=fila, durable=True, arguments={'x-expires': FILA_EXPIRA_MS})
+    for routing_key in routing_keys:
+        ch.queue_bind(exchange=exchange, queue=fila, routing_key=routing_key)
+    return fila
+
+
+class Consumidor:
+    def __init__(self, configurar, host=HOST, nome='consumidor', ao_parar=None):
+        self.configurar = configurar
+        self.host = host
+        self.nome = nome
+        # Roda na conexão ainda aberta, antes de fechá-la (ex.: descarregar o lote)
+        self.ao_parar = ao_parar
+
+        self.connection = None
+        self.channel = None
+        self.reconexoes = 0
+        self._rodando = False
+        self._conectado = threading.Event()
+        self._ultimo_erro = None
+
+    def parar(self):
+        # Pode ser chamado de um tratador de sinal ou de outra thread
+        self._rodando = False
+
+    def aguardar_conexao(self, tempo_limite=None):
+        return self._conectado.wait(tempo_limite)
+
+    def estado(self):
+        return {
+            "conectado": self._conectado.is_set(),
+            "reconexoes": self.reconexoes,
+            "ultimo_erro": self._ultimo_erro
+        }
+
+    def _conectar(self):
+        self.connection = pika.BlockingConnection(parametros(self.host))
+        self.channel = self.connection.channel()
+        self.configurar(self.connection, self.channel)
+        self._conectado.set()
+        conectado.definir(1, consumidor=self.nome)
+
+    def _descartar_conexao(self):
+        self._conectado.clear()
+        conectado.definir(0, consumidor=self.nome)
+        try:
+            if self.connection is not None and self.connection.is_open:
+                self.connection.close()
+        except Exception:
+            pass
+
+    def executar(self):
+        # Consome até parar(); cada queda vira uma nova conexão
+        self._rodando = True
+        backoff = BACKOFF_INICIAL
+        caiu = False
+        while self._rodando:
+            try:
+                self._conectar()
+                if caiu:
+                    self.reconexoes += 1
+                    reconexoes.inc(consumidor=self.nome)
+                    print(f"[{self.nome}] reconectado ao RabbitMQ")
+                caiu = False
+                backoff = BACKOFF_INICIAL
+                while self._rodando:
+                    self.connection.process_data_events(time_limit=INTERVALO_EVENTOS)
+            except Exception as e:
+                self._ultimo_erro = str(e)
+                registrar_erro(self.nome, e)
+                self._descartar_conexao()
+                caiu = True
+                if self._rodando:
+                    print(f"[{self.nome}] nova tentativa de conexão em {backoff:.1f}s")
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, BACKOFF_MAXIMO)
+
+        try:
+            if self.connection is not None and self.connection.is_open and self.ao_parar is not None:
+                self.ao_parar()
+        finally:
+            self._descartar_conexao()
@@ -0,0 +1,38 @@
+import os
+import time
+import urllib.request
+
+import codec
+from metricas import registrar_erro
+
+# Carga inicial dos leilões ativos a partir do GET /leiloes/snapshot do MS
+# leilão (NDJSON: um cabeçalho {"seq", "quantidade"} e um leilão por linha).
+# Quem usa deve declarar e vincular a fila de leilao_iniciado antes de
+# carregar e, ao consumir, ignorar os eventos com seq <= o seq devolvido:
+# eles já estão no snapshot. Com URL vazia a carga fica desligada.
+URL = os.environ.get('LEILAO_SNAPSHOT_URL', 'http://localhost:5000/leiloes/snapshot')
+TIMEOUT = float(os.environ.get('LEILAO_SNAPSHOT_TIMEOUT', '5'))
+
+
+def carregar(aplicar, url=URL, timeout=TIMEOUT):
+    # Chama aplicar(leilao) para cada leilão ativo e devolve o seq do
+    # snapshot, ou 0 se não foi possível carregar
+    if not url:
+        return 0
+
+    inicio = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as resposta:
+            cabecalho = codec.de_json(resposta.readline())
+            quantidade = 0
+            for linha in resposta:
+                if linha.strip():
+                    aplicar(codec.de_json(linha))
+                    quantidade += 1
+    except Exception as e:
+        registrar_erro('snapshot_leiloes', e)
+        return 0
+
+    duracao = (time.perf_counter() - inicio) * 1000
+    print(f"{quantidade} leilões ativos carregados em {duracao:.1f} ms (seq {cabecalho['seq']})")
+    return cabecalho['seq']
@@ -0,0 +1,85 @@
+import threading
+import time
+
+from agendador import Agendador
+
+
+def iniciar(agendador):
+    thread = threading.Thread(target=agendador.executar, daemon=True)
+    thread.start()
+    return thread
+
+
+def esperar(condicao, prazo=5):
+    limite = time.monotonic() + prazo
+    while time.monotonic() < limite:
+        if condicao():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_dispara_pelo_instante_e_na_ordem_de_agendamento_nos_empates():
+    agendador = Agendador()
+    disparos = []
+    agora = time.time()
+    agendador.agendar(agora + 0.15, disparos.append, 'c')
+    agendador.agendar(agora + 0.05, disparos.append, 'a')
+    agendador.agendar(agora + 0.10, disparos.append, 'b1')
+    agendador.agendar(agora + 0.10, disparos.append, 'b2')
+    agendador.agendar(agora - 1, disparos.append, 'atrasado')
+
+    thread = iniciar(agendador)
+    try:
+        assert esperar(lambda: len(disparos) == 5)
+    finally:
+        agendador.parar()
+        thread.join(1)
+    assert disparos == ['atrasado', 'a', 'b1', 'b2', 'c']
+    assert agendador.pendentes() == 0
+
+
+def test_evento_mais_proximo_acorda_a_thread_que_dormia():
+    agendador = Agendador()
+    disparos = []
+    thread = iniciar(agendador)
+    try:
+        agendador.agendar(time.time() + 60, disparos.append, 'depois')
+        time.sleep(0.05)
+        agendador.agendar(time.time() + 0.05, disparos.append, 'antes')
+        assert esperar(lambda: disparos == ['antes'], prazo=1)
+    finally:
+        agendador.parar()
+        thread.join(1)
+    assert agendador.pendentes() == 1
+
+
+def test_erro_num_evento_nao_impede_os_seguintes():
+    agendador = Agendador()
+    disparos = []
+
+    def falhar():
+        raise RuntimeError('falha')
+
+    agora = time.time()
+    agendador.agendar(agora, falhar)
+    agendador.agendar(agora, disparos.append, 'seguinte')
+    thread = iniciar(agendador)
+    try:
+        assert esperar(lambda: disparos == ['seguinte'])
+    finally:
+        agendador.parar()
+        thread.join(1)
+
+
+def test_parar_cancela_os_eventos_pendentes():
+    agendador = Agendador()
+    disparos = []
+    agendador.agendar(time.time() + 0.2, disparos.append, 'cancelado')
+    thread = iniciar(agendador)
+
+    agendador.parar()
+    thread.join(1)
+    time.sleep(0.3)
+    assert not thread.is_alive()
+    assert disparos == []
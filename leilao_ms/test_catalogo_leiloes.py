@@ -0,0 +1,79 @@
+from catalogo_leiloes import CatalogoLeiloes
+
+
+def catalogo_com_ativos(quantidade):
+    catalogo = CatalogoLeiloes(listras=4)
+    for leilao_id in range(quantidade):
+        catalogo.definir(leilao_id, {
+            'id': leilao_id, 'status': 'ativo', 'fim': f'2099-01-01 10:{59 - leilao_id:02d}:00'
+        })
+    return catalogo
+
+
+def paginar(catalogo, limite):
+    paginas, cursor = [], None
+    while True:
+        leiloes, cursor = catalogo.pagina('ativo', cursor, limite)
+        paginas.append([leilao['id'] for leilao in leiloes])
+        if cursor is None:
+            return paginas
+
+
+def test_cursor_percorre_os_ativos_na_ordem_de_entrada():
+    catalogo = catalogo_com_ativos(7)
+    assert paginar(catalogo, 3) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert paginar(catalogo, None) == [[0, 1, 2, 3, 4, 5, 6]]
+    assert catalogo.contagem('ativo') == 7
+
+
+def test_cursor_continua_valido_quando_leiloes_saem_do_status():
+    catalogo = catalogo_com_ativos(6)
+    primeira, cursor = catalogo.pagina('ativo', None, 2)
+    assert [leilao['id'] for leilao in primeira] == [0, 1]
+
+    # Um já lido e um ainda por ler deixam de ser ativos; um novo entra no fim
+    catalogo.atualizar(1, status='encerrado')
+    catalogo.atualizar(3, status='encerrado')
+    catalogo.definir(9, {'id': 9, 'status': 'ativo', 'fim': '2099-01-01 09:00:00'})
+
+    resto, cursor = catalogo.pagina('ativo', cursor, None)
+    assert [leilao['id'] for leilao in resto] == [2, 4, 5, 9]
+    assert cursor is None
+    assert [leilao['id'] for leilao in catalogo.pagina('encerrado')[0]] == [1, 3]
+
+
+def test_encerrando_ordena_pelo_fim_e_acompanha_as_remocoes():
+    catalogo = catalogo_com_ativos(5)
+    assert [leilao['id'] for leilao in catalogo.encerrando(3)] == [4, 3, 2]
+
+    catalogo.atualizar(4, status='encerrado')
+    catalogo.remover(3)
+    assert [leilao['id'] for leilao in catalogo.encerrando(3)] == [2, 1, 0]
+
+
+def test_versao_muda_so_com_alteracoes_do_status():
+    catalogo = catalogo_com_ativos(2)
+    ativos, encerrados = catalogo.versao('ativo'), catalogo.versao('encerrado')
+
+    catalogo.pagina('ativo')
+    assert catalogo.versao('ativo') == ativos
+
+    catalogo.atualizar(0, nome='novo nome')
+    assert catalogo.versao('ativo') > ativos and catalogo.versao('encerrado') == encerrados
+
+    ativos = catalogo.versao('ativo')
+    catalogo.atualizar(1, status='encerrado')
+    assert catalogo.versao('ativo') > ativos and catalogo.versao('encerrado') > encerrados
+
+
+def test_compactacao_das_posicoes_nao_perde_leiloes():
+    catalogo = CatalogoLeiloes()
+    for leilao_id in range(300):
+        catalogo.definir(leilao_id, {'id': leilao_id, 'status': 'ativo', 'fim': None})
+    for leilao_id in range(0, 300, 3):
+        catalogo.remover(leilao_id)
+    for leilao_id in range(1, 300, 3):
+        catalogo.atualizar(leilao_id, status='encerrado')
+
+    assert paginar(catalogo, 50) == [list(range(2, 150, 3)), list(range(152, 300, 3))]
+    assert catalogo.contagem('ativo') == 100 and catalogo.contagem('encerrado') == 100
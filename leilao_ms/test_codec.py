@@ -0,0 +1,85 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import codec
+import ms_lance
+from estado_leiloes import EstadoLeiloes
+from registro_lances import RegistroLances
+
+LANCE = {'id': 'lance-1', 'leilao_id': 3, 'user_id': 'u1', 'valor': 10.5, 'timestamp': '2099-01-01T10:00:00'}
+
+
+def test_json_ida_e_volta_com_as_propriedades_do_tipo():
+    body, properties = codec.codificar('lance_realizado', LANCE)
+    assert properties.content_type == codec.JSON
+    assert properties.type == 'lance_realizado'
+    assert properties.delivery_mode == codec.PERSISTENTE
+    assert codec.decodificar(body, properties) == LANCE
+
+    # As propriedades de um tipo são reaproveitadas; as extras não
+    assert codec.codificar('lance_realizado', LANCE)[1] is properties
+    _, extras = codec.codificar('lance_realizado', LANCE, reply_to='respostas', correlation_id='lance-1')
+    assert extras is not properties
+    assert (extras.reply_to, extras.correlation_id, extras.type) == ('respostas', 'lance-1', 'lance_realizado')
+
+
+def test_mensagem_sem_content_type_e_lida_como_json():
+    assert codec.decodificar(b'{"leilao_id": 1}') == {'leilao_id': 1}
+    assert codec.decodificar(b'{"leilao_id": 1}', object()) == {'leilao_id': 1}
+
+
+def test_msgpack_ida_e_volta_so_nos_eventos_internos(monkeypatch):
+    pytest.importorskip('msgpack')
+    monkeypatch.setattr(codec, 'FORMATO', 'msgpack')
+
+    body, properties = codec.codificar('lance_realizado', {**LANCE, 'fora_do_esquema': 1})
+    assert properties.content_type == codec.MSGPACK
+    # Só os campos do esquema viajam
+    assert codec.decodificar(body, properties) == LANCE
+
+    evento = {'leilao_id': 3, 'leilao_nome': 'x', 'user_id': 'u1', 'valor': 11, 'timestamp': 't'}
+    body, properties = codec.codificar('lance_validado', evento)
+    assert properties.content_type == codec.JSON
+    assert codec.decodificar(body, properties) == evento
+
+
+def test_validar_confere_os_tipos_do_esquema():
+    esquema = codec.ESQUEMAS['lance_realizado']
+    assert esquema.validar({**LANCE, 'timestamp': None}) is not None
+    with pytest.raises(TypeError, match='lance_realizado.valor'):
+        esquema.validar({**LANCE, 'valor': '10'})
+    assert esquema.de_lista(esquema.para_lista(LANCE)) == LANCE
+
+
+def test_instante_aceita_iso_com_e_sem_fuso_e_epoch_em_ms():
+    utc = datetime(2099, 1, 1, 10, 0, tzinfo=timezone.utc).timestamp()
+    assert codec.instante('2099-01-01T10:00:00Z') == utc
+    assert codec.instante('2099-01-01T10:00:00+00:00') == utc
+    assert codec.instante(int(utc * 1000)) == utc
+    assert codec.instante('2099-01-01T10:00:00') == datetime(2099, 1, 1, 10, 0).timestamp()
+    assert codec.instante(None) is None
+
+
+@pytest.mark.parametrize('valor', ['ontem', '', '2099-13-01T00:00:00', ['2099'], {'t': 1}])
+def test_instante_invalido_levanta_erro(valor):
+    with pytest.raises((TypeError, ValueError, AttributeError)):
+        codec.instante(valor)
+
+
+def test_agora_segue_o_formato_configurado(monkeypatch):
+    assert isinstance(codec.instante(codec.agora()), float)
+    monkeypatch.setattr(codec, 'TIMESTAMP', 'epoch')
+    assert isinstance(codec.agora(), int)
+
+
+def test_lance_com_timestamp_invalido_e_rejeitado(monkeypatch):
+    monkeypatch.setattr(ms_lance, 'leiloes_ativos', EstadoLeiloes())
+    monkeypatch.setattr(ms_lance, 'lances_por_leilao', EstadoLeiloes())
+    monkeypatch.setattr(ms_lance, 'ids_lote', set())
+    ms_lance.leiloes_ativos.definir(3, {'id': 3, 'nome': 'x', 'fim': '2099-01-01T00:00:00'})
+    ms_lance.lances_por_leilao.definir(3, RegistroLances())
+
+    routing_key, evento = ms_lance.validar_lance({**LANCE, 'id': 'lance-ruim', 'timestamp': 'ontem'})
+    assert (routing_key, evento['motivo']) == ('lance_invalidado', 'timestamp_invalido')
+    assert ms_lance.lances_por_leilao.obter(3).quantidade == 0
@@ -0,0 +1,51 @@
+from deduplicacao import CacheDeduplicacao
+
+
+def test_reentrega_dentro_do_ttl_e_duplicada_e_depois_dele_nao():
+    cache = CacheDeduplicacao(10, ttl=60)
+    assert not cache.visto('a', agora=100)
+    assert cache.visto('a', agora=159)
+    # Passado o TTL o id vale como novo e é guardado de novo
+    assert not cache.visto('a', agora=160)
+    assert cache.visto('a', agora=200)
+    assert cache.estatisticas()['duplicados'] == 2
+
+
+def test_ids_expirados_saem_do_inicio_ao_guardar():
+    cache = CacheDeduplicacao(10, ttl=60)
+    for instante, chave in enumerate('abc'):
+        cache.visto(chave, agora=instante)
+    cache.visto('d', agora=61)
+    assert [chave for chave, _ in cache.itens()] == ['c', 'd']
+
+
+def test_capacidade_despeja_os_mais_antigos():
+    cache = CacheDeduplicacao(3, ttl=600)
+    for instante, chave in enumerate('abcd'):
+        cache.visto(chave, agora=instante)
+    assert len(cache) == 3
+    assert not cache.visto('a', agora=10)
+    assert [chave for chave, _ in cache.itens()] == ['c', 'd', 'a']
+
+
+def test_guardar_false_so_consulta():
+    cache = CacheDeduplicacao(10, ttl=60)
+    assert not cache.visto('a', agora=0, guardar=False)
+    assert not cache.visto('a', agora=1)
+    assert cache.visto('a', agora=2, guardar=False)
+
+
+def test_registrar_guarda_sem_contar_consulta():
+    cache = CacheDeduplicacao(10, ttl=60)
+    cache.registrar('a', instante=0)
+    cache.registrar(None)
+    assert cache.itens() == [['a', 0]]
+    assert cache.estatisticas()['consultas'] == 0
+    assert cache.visto('a', agora=30) and not cache.visto('a', agora=61)
+
+
+def test_capacidade_zero_desliga_o_cache():
+    cache = CacheDeduplicacao(0, ttl=60)
+    cache.registrar('a')
+    assert not cache.visto('a') and not cache.visto('a')
+    assert len(cache) == 0
@@ -0,0 +1,84 @@
+import threading
+
+from estado_leiloes import EstadoLeiloes
+
+
+def test_definir_obter_e_remover():
+    estado = EstadoLeiloes(listras=4)
+    for leilao_id in range(10):
+        estado.definir(leilao_id, {'id': leilao_id})
+
+    assert len(estado) == 10
+    assert 3 in estado and 11 not in estado
+    assert estado.obter(3) == {'id': 3}
+    assert estado.obter(11, 'nenhum') == 'nenhum'
+    assert estado.remover(3) == {'id': 3}
+    assert estado.remover(3) is None
+    assert len(estado) == 9 and 3 not in estado
+
+
+def test_atualizar_nao_altera_o_registro_ja_lido():
+    estado = EstadoLeiloes()
+    estado.definir(1, {'id': 1, 'status': 'ativo'})
+    lido = estado.obter(1)
+
+    novo = estado.atualizar(1, status='encerrado')
+    assert lido == {'id': 1, 'status': 'ativo'}
+    assert novo == estado.obter(1) == {'id': 1, 'status': 'encerrado'}
+    assert estado.atualizar(2, status='encerrado') is None
+
+
+def test_itens_e_um_snapshot_que_acompanha_as_alteracoes():
+    estado = EstadoLeiloes(listras=2)
+    for leilao_id in range(4):
+        estado.definir(leilao_id, leilao_id)
+
+    # Alterar durante a iteração não quebra a leitura em andamento
+    vistos = []
+    for leilao_id, valor in estado.itens():
+        vistos.append(leilao_id)
+        estado.definir(leilao_id + 100, valor)
+    assert sorted(vistos) == [0, 1, 2, 3]
+    assert sorted(estado.valores()) == [0, 0, 1, 1, 2, 2, 3, 3]
+
+    estado.remover(0)
+    assert 0 not in dict(estado.itens())
+
+
+def test_alterado_recebe_valor_anterior_e_atual():
+    mudancas = []
+
+    class EstadoIndexado(EstadoLeiloes):
+        def _alterado(self, leilao_id, anterior, atual):
+            mudancas.append((leilao_id, anterior, atual))
+
+    estado = EstadoIndexado()
+    estado.definir(1, {'status': 'ativo'})
+    estado.atualizar(1, status='encerrado')
+    estado.remover(1)
+    estado.remover(1)
+
+    assert mudancas == [
+        (1, None, {'status': 'ativo'}),
+        (1, {'status': 'ativo'}, {'status': 'encerrado'}),
+        (1, {'status': 'encerrado'}, None),
+    ]
+
+
+def test_bloqueio_serializa_ler_validar_escrever_entre_threads():
+    estado = EstadoLeiloes(listras=4)
+    for leilao_id in range(3):
+        estado.definir(leilao_id, 0)
+
+    def incrementar(leilao_id):
+        for _ in range(2000):
+            with estado.bloqueio(leilao_id):
+                estado.definir(leilao_id, estado.obter(leilao_id) + 1)
+
+    threads = [threading.Thread(target=incrementar, args=(numero % 3,)) for numero in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert dict(estado.itens()) == {0: 4000, 1: 4000, 2: 4000}
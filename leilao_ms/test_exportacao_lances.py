@@ -0,0 +1,83 @@
+import pytest
+
+import exportacao_lances
+from exportacao_lances import ContagemDistinta
+from registro_lances import HistoricoEmDisco
+
+# Resumos do histórico em disco: a agregação em blocos do pyarrow tem que dar
+# o mesmo resultado que a passada lance a lance, e a contagem de licitantes
+# distintos não guarda mais que LICITANTES_AMOSTRA hashes por leilão.
+INICIO = 4_000_000_000
+
+
+def gravar_historico(caminho, lances=3000):
+    historico = HistoricoEmDisco(str(caminho))
+    for numero in range(lances):
+        leilao_id = (1, 2, 3, 2)[numero % 4]
+        historico.gravar(leilao_id, f'u{numero // 4 % (7 * leilao_id)}', 10 + numero, (INICIO + numero) * 1000)
+    historico.gravar_fechamento(2, INICIO + lances + 5, 'u1', 10 + lances)
+    historico.fechar()
+    # Linha ainda sendo escrita pelo MS: fica de fora
+    with open(caminho, 'a') as arquivo:
+        arquivo.write('{"leilao_id": 1, "user_id": "u9", "valor": 99')
+    return [str(caminho)]
+
+
+def por_leilao(resumos):
+    return {resumo['leilao_id']: resumo for resumo in resumos}
+
+
+def test_resumo_por_leilao(tmp_path, monkeypatch):
+    monkeypatch.setattr(exportacao_lances, 'pyarrow', None)
+    caminhos = gravar_historico(tmp_path / 'historico.ndjson')
+    resumos = por_leilao(exportacao_lances.resumos(caminhos))
+
+    assert sorted(resumos) == [1, 2, 3]
+    leilao = resumos[2]
+    assert leilao['lances'] == 1500 and leilao['licitantes'] == 14 and not leilao['licitantes_estimado']
+    assert (leilao['primeiro_lance'], leilao['ultimo_lance']) == (INICIO + 1, INICIO + 2999)
+    assert (leilao['valor_inicial'], leilao['valor_final']) == (11, 3009)
+    assert (leilao['vencedor_id'], leilao['segundos_ate_fim']) == ('u1', 6)
+    assert resumos[1]['fim'] is None
+
+    # Curva reduzida, com o primeiro e o último lance
+    curva = leilao['curva']
+    assert len(curva) <= 2 * exportacao_lances.PONTOS_CURVA + 1
+    assert curva[0] == [INICIO + 1, 11] and curva[-1] == [INICIO + 2999, 3009]
+
+
+def test_resumo_respeita_o_intervalo(tmp_path, monkeypatch):
+    monkeypatch.setattr(exportacao_lances, 'pyarrow', None)
+    caminhos = gravar_historico(tmp_path / 'historico.ndjson')
+    resumos = por_leilao(exportacao_lances.resumos(caminhos, leilao_id='3', desde=INICIO + 100, ate=INICIO + 200))
+    assert list(resumos) == [3]
+    assert resumos[3]['lances'] == 25 and resumos[3]['primeiro_lance'] == INICIO + 102
+
+
+@pytest.mark.parametrize('tamanho_lote', [1, 7, 1000, 65536])
+def test_blocos_do_pyarrow_dao_o_mesmo_resumo_que_lance_a_lance(tmp_path, monkeypatch, tamanho_lote):
+    pytest.importorskip('pyarrow')
+    caminhos = gravar_historico(tmp_path / 'historico.ndjson')
+    em_blocos = por_leilao(exportacao_lances.resumos(caminhos, tamanho_lote=tamanho_lote))
+
+    monkeypatch.setattr(exportacao_lances, 'pyarrow', None)
+    assert em_blocos == por_leilao(exportacao_lances.resumos(caminhos))
+
+
+def test_contagem_distinta_exata_ate_a_amostra():
+    contagem = ContagemDistinta(amostra=64)
+    for numero in range(200):
+        contagem.adicionar(f'u{numero % 64}')
+    assert contagem.exata() and contagem.estimativa() == 64
+    contagem.adicionar('u64')
+    assert not contagem.exata()
+
+
+def test_contagem_distinta_estimada_com_memoria_fixa():
+    contagem = ContagemDistinta(amostra=1024)
+    for numero in range(50000):
+        contagem.adicionar(f'u{numero}')
+        contagem.adicionar(f'u{numero // 2}')
+    assert not contagem.exata()
+    assert len(contagem._hashes) == 1024
+    assert contagem.estimativa() == pytest.approx(50000, rel=0.2)
@@ -0,0 +1,77 @@
+import time
+from datetime import datetime
+
+import ms_lance
+from deduplicacao import CacheDeduplicacao
+from estado_leiloes import EstadoLeiloes
+
+# A cerca de fechamento do ms_lance, sem broker: o vencedor só sai quando a
+# cerca é consumida, então um lance feito antes do fim que chega depois do
+# leilao_finalizado ainda conta; lances feitos depois do fim são recusados.
+
+
+def iso(instante):
+    return datetime.fromtimestamp(instante).isoformat()
+
+
+def lance(numero, valor, instante):
+    return {'id': f'lance-{numero}', 'leilao_id': 1, 'user_id': f'u{numero}', 'valor': valor, 'timestamp': iso(instante)}
+
+
+def iniciar_leilao(monkeypatch, fim):
+    for nome, valor in (
+        ('leiloes_ativos', EstadoLeiloes()), ('lances_por_leilao', EstadoLeiloes()),
+        ('leiloes_encerrando', {}), ('anteriores_lote', {}), ('eventos_lote', []), ('ids_lote', set()),
+        ('lances_vistos', CacheDeduplicacao(100, 600)), ('diario', None), ('historico_disco', None)
+    ):
+        monkeypatch.setattr(ms_lance, nome, valor)
+    monkeypatch.setattr(ms_lance, 'FECHAMENTO_CARENCIA', 5.0)
+    assert ms_lance.registrar_leilao_iniciado({'id': 1, 'nome': 'teste', 'fim': iso(fim)})
+
+
+def test_vencedor_sai_na_cerca_com_os_lances_feitos_antes_do_fim(monkeypatch):
+    fim = int(time.time()) - 1
+    iniciar_leilao(monkeypatch, fim)
+    assert ms_lance.processar_lance(lance(0, 10, fim - 5), 'lance_realizado')[0] == 'lance_validado'
+
+    cerca, atraso = ms_lance.iniciar_fechamento(1)
+    assert cerca == {'leilao_id': 1, 'fim': fim}
+    assert 3 < atraso <= 4
+    # leilao_finalizado repetido não cria outra cerca
+    assert ms_lance.iniciar_fechamento(1) is None
+
+    # Feito antes do fim, chegou depois do leilao_finalizado: ainda vale
+    assert ms_lance.processar_lance(lance(1, 15, fim - 0.5), 'lance_realizado')[0] == 'lance_validado'
+    routing_key, evento = ms_lance.processar_lance(lance(2, 20, fim), 'lance_realizado')
+    assert (routing_key, evento['motivo']) == ('lance_invalidado', 'leilao_encerrado')
+
+    routing_key, vencedor = ms_lance.processar_lance(cerca, 'fechamento_leilao')
+    assert routing_key == 'leilao_vencedor'
+    assert (vencedor['vencedor_id'], vencedor['valor_final']) == ('u1', 15)
+    assert ms_lance.leiloes_encerrando == {} and ms_lance.leiloes_ativos.obter(1) is None
+
+    # Cerca repetida e lances depois da decisão não mudam nada
+    assert ms_lance.processar_lance(cerca, 'fechamento_leilao') is None
+    routing_key, evento = ms_lance.processar_lance(lance(3, 30, fim - 0.1), 'lance_realizado')
+    assert evento['motivo'] == 'leilao_nao_ativo'
+
+
+def test_leilao_sem_lances_fecha_sem_vencedor(monkeypatch):
+    iniciar_leilao(monkeypatch, time.time() - 10)
+    cerca, atraso = ms_lance.iniciar_fechamento(1)
+    assert atraso == 0
+    assert ms_lance.processar_lance(cerca, 'fechamento_leilao') is None
+    assert ms_lance.leiloes_ativos.obter(1) is None
+
+
+def test_lote_desfeito_volta_o_leilao_para_antes_da_cerca(monkeypatch):
+    fim = int(time.time()) + 60
+    iniciar_leilao(monkeypatch, fim)
+    cerca, atraso = ms_lance.iniciar_fechamento(1)
+    assert atraso > 64
+    assert [pendente for pendente, _ in ms_lance.fechamentos_pendentes()] == [cerca]
+
+    ms_lance.desfazer_lote()
+    assert ms_lance.leiloes_encerrando == {} and ms_lance.fechamentos_pendentes() == []
+    # A reentrega do leilao_finalizado cria a cerca de novo
+    assert ms_lance.iniciar_fechamento(1)[0] == cerca
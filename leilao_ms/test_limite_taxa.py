@@ -0,0 +1,64 @@
+import pytest
+
+import ms_lance
+from estado_leiloes import EstadoLeiloes
+from limite_taxa import LimitadorTaxa, retry_after
+
+
+def test_rajada_esgota_e_as_fichas_voltam_com_o_tempo():
+    limite = LimitadorTaxa(2, rajada=3)
+    assert [limite.consumir('u1', agora=0) for _ in range(3)] == [0, 0, 0]
+    assert limite.consumir('u1', agora=0) == pytest.approx(0.5)
+    # Outra chave tem o próprio balde
+    assert limite.consumir('u2', agora=0) == 0
+
+    assert limite.consumir('u1', agora=0.5) == 0
+    assert limite.consumir('u1', agora=0.5) == pytest.approx(0.5)
+    # Parado por muito tempo, não passa da rajada
+    assert [limite.consumir('u1', agora=100) for _ in range(4)][-1] > 0
+
+
+def test_devolver_nao_passa_da_rajada():
+    limite = LimitadorTaxa(1, rajada=1)
+    assert limite.consumir('u1', agora=0) == 0
+    limite.devolver('u1')
+    limite.devolver('u1')
+    assert limite.consumir('u1', agora=0) == 0
+    assert limite.consumir('u1', agora=0) > 0
+
+
+def test_taxa_zero_desliga_o_limite():
+    limite = LimitadorTaxa(0)
+    assert all(limite.consumir('u1', agora=0) == 0 for _ in range(100))
+
+
+@pytest.mark.parametrize('espera, cabecalho', [(0.01, '1'), (1, '1'), (1.2, '2'), (30, '30')])
+def test_retry_after_arredonda_para_cima_em_segundos(espera, cabecalho):
+    assert retry_after(espera) == cabecalho
+
+
+@pytest.fixture
+def limites(monkeypatch):
+    monkeypatch.setattr(ms_lance, 'lances_por_leilao', EstadoLeiloes())
+    monkeypatch.setattr(ms_lance, 'limite_usuarios', LimitadorTaxa(1, rajada=2))
+    monkeypatch.setattr(ms_lance, 'limite_leiloes', LimitadorTaxa(1, rajada=1))
+
+
+def lance(user_id, leilao_id=1):
+    return {'id': None, 'leilao_id': leilao_id, 'user_id': user_id, 'valor': 10, 'timestamp': None}
+
+
+def test_admitir_lance_responde_429_com_retry_after(limites):
+    assert ms_lance.admitir_lance(lance('u1')) is None
+    status, corpo, cabecalhos = ms_lance.admitir_lance(lance('u2'))
+    assert (status, corpo['motivo'], cabecalhos) == (429, 'limite_leilao', {'Retry-After': '1'})
+
+
+def test_recusa_do_leilao_nao_gasta_a_ficha_do_usuario(limites):
+    assert ms_lance.admitir_lance(lance('u1', leilao_id=1)) is None
+    for _ in range(3):
+        assert ms_lance.admitir_lance(lance('u2', leilao_id=1))[1]['motivo'] == 'limite_leilao'
+    # u2 ainda tem a rajada inteira para outros leilões
+    assert ms_lance.admitir_lance(lance('u2', leilao_id=2)) is None
+    assert ms_lance.admitir_lance(lance('u2', leilao_id=3)) is None
+    assert ms_lance.admitir_lance(lance('u2', leilao_id=4))[1]['motivo'] == 'limite_usuario'
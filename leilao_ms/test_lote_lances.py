@@ -0,0 +1,150 @@
+import os
+import sqlite3
+import threading
+import time
+
+os.environ.setdefault('LEILAO_SNAPSHOT_URL', '')
+
+import pika
+import pika.exceptions
+
+import broker_memoria
+import codec
+import ms_lance
+import runtime_amqp
+from deduplicacao import CacheDeduplicacao
+from estado_leiloes import EstadoLeiloes
+
+# Queda da conexão no tx_commit de um lote do ms_lance, sobre o broker em
+# memória: as entregas voltam da fila e, depois da reconexão, cada lance tem
+# que sair validado uma vez, com o estado, o diário e o histórico iguais aos
+# de uma execução sem queda.
+
+
+def esperar(condicao, prazo=5):
+    limite = time.monotonic() + prazo
+    while time.monotonic() < limite:
+        if condicao():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_commit_perdido_e_revalidado_depois_da_reconexao(tmp_path, monkeypatch):
+    broker_memoria.resetar()
+    broker_memoria.instalar()
+    monkeypatch.setattr(runtime_amqp, 'BACKOFF_INICIAL', 0.05)
+    monkeypatch.setattr(ms_lance, 'DIARIO', str(tmp_path / 'ms_lance.db'))
+    monkeypatch.setattr(ms_lance, 'HISTORICO_ARQUIVO', str(tmp_path / 'historico.ndjson'))
+    monkeypatch.setattr(ms_lance, 'LOTE_JANELA', 0.2)
+
+    # O primeiro commit com acks do pipeline de lances cai no meio
+    quedas = []
+    tx_commit = broker_memoria.CanalMemoria.tx_commit
+
+    def tx_commit_com_queda(canal):
+        if canal._acks and not quedas:
+            quedas.append(len(canal._acks))
+            canal.tx_rollback()
+            canal.conexao.close()
+            raise pika.exceptions.ConnectionClosed(320, 'CONNECTION_FORCED')
+        tx_commit(canal)
+
+    monkeypatch.setattr(broker_memoria.CanalMemoria, 'tx_commit', tx_commit_com_queda)
+
+    consumidor = threading.Thread(target=ms_lance.rabbitmq_thread, daemon=True)
+    consumidor.start()
+    try:
+        assert ms_lance.consumidor.aguardar_conexao(5)
+
+        conexao = pika.BlockingConnection()
+        canal = conexao.channel()
+        runtime_amqp.declarar_exchanges(canal)
+        fila = canal.queue_declare(queue='', exclusive=True).method.queue
+        for routing_key in ('lance_validado', 'lance_invalidado'):
+            canal.queue_bind(exchange='leilao', queue=fila, routing_key=routing_key)
+        eventos = []
+        canal.basic_consume(
+            queue=fila, auto_ack=True,
+            on_message_callback=lambda ch, method, properties, body: eventos.append(
+                (method.routing_key, codec.decodificar(body, properties))
+            )
+        )
+
+        body, properties = codec.codificar('leilao_iniciado', {'id': 1, 'nome': 'teste', 'fim': '2099-01-01T00:00:00'})
+        canal.basic_publish(exchange='leilao_iniciado', routing_key='', body=body, properties=properties)
+        assert esperar(lambda: ms_lance.leiloes_ativos.obter(1) is not None)
+
+        for numero, valor in enumerate((10, 11, 12)):
+            body, properties = codec.codificar('lance_realizado', {
+                'id': f'lance-{numero}', 'leilao_id': 1, 'user_id': f'u{numero}',
+                'valor': valor, 'timestamp': codec.agora()
+            })
+            canal.basic_publish(exchange='leilao', routing_key='lance_realizado', body=body, properties=properties)
+
+        limite = time.monotonic() + 5
+        while len(eventos) < 3 and time.monotonic() < limite:
+            conexao.process_data_events(time_limit=0.05)
+        conexao.process_data_events(time_limit=0.3)
+        conexao.close()
+
+        assert quedas and ms_lance.consumidor.reconexoes == 1
+        assert [(routing_key, evento['user_id'], evento['valor']) for routing_key, evento in eventos] == [
+            ('lance_validado', 'u0', 10), ('lance_validado', 'u1', 11), ('lance_validado', 'u2', 12)
+        ]
+
+        registro = ms_lance.lances_por_leilao.obter(1)
+        assert (registro.melhor_valor, registro.melhor_usuario, registro.quantidade) == (12, 'u2', 3)
+
+        lances_no_diario = sqlite3.connect(ms_lance.DIARIO).execute(
+            "SELECT COUNT(*) FROM eventos WHERE tipo = 'lance'"
+        ).fetchone()[0]
+        assert lances_no_diario == 3
+        with open(ms_lance.HISTORICO_ARQUIVO, encoding='utf-8') as arquivo:
+            assert len(arquivo.readlines()) == 3
+    finally:
+        ms_lance.consumidor.parar()
+        consumidor.join(5)
+
+
+def reiniciar_ms_lance(monkeypatch, diario):
+    # Estado de um processo recém-iniciado sobre o mesmo diário
+    if ms_lance.diario is not None:
+        ms_lance.diario.con.close()
+    monkeypatch.setattr(ms_lance, 'DIARIO', diario)
+    monkeypatch.setattr(ms_lance, 'diario', None)
+    monkeypatch.setattr(ms_lance, 'historico_disco', None)
+    monkeypatch.setattr(ms_lance, 'leiloes_ativos', EstadoLeiloes())
+    monkeypatch.setattr(ms_lance, 'lances_por_leilao', EstadoLeiloes())
+    monkeypatch.setattr(ms_lance, 'lances_vistos', CacheDeduplicacao(100, 600))
+    monkeypatch.setattr(ms_lance, 'leiloes_encerrando', {})
+    monkeypatch.setattr(ms_lance, 'anteriores_lote', {})
+    monkeypatch.setattr(ms_lance, 'eventos_lote', [])
+    monkeypatch.setattr(ms_lance, 'ids_lote', set())
+    monkeypatch.setattr(ms_lance, 'eventos_recuperados', [])
+    ms_lance.recuperar_estado()
+
+
+def test_lote_sem_marca_de_confirmacao_e_descartado_na_recuperacao(tmp_path, monkeypatch):
+    diario = str(tmp_path / 'ms_lance.db')
+    lance = {'id': 'lance-1', 'leilao_id': 1, 'user_id': 'u1', 'valor': 10, 'timestamp': codec.agora()}
+    reiniciar_ms_lance(monkeypatch, diario)
+    ms_lance.registrar_leilao_iniciado({'id': 1, 'nome': 'teste', 'fim': '2099-01-01T00:00:00'})
+
+    # O diário do lote foi gravado, mas o processo caiu antes do tx_commit
+    assert ms_lance.validar_lance(dict(lance))[0] == 'lance_validado'
+    ms_lance.confirmar_diario()
+
+    reiniciar_ms_lance(monkeypatch, diario)
+    assert ms_lance.lances_por_leilao.obter(1).quantidade == 0
+    # A reentrega recebe um veredito
+    assert ms_lance.validar_lance(dict(lance))[0] == 'lance_validado'
+    ms_lance.confirmar_diario()
+    ms_lance.confirmar_lote()
+
+    # Confirmado no broker: volta do diário e a reentrega é descartada
+    reiniciar_ms_lance(monkeypatch, diario)
+    registro = ms_lance.lances_por_leilao.obter(1)
+    assert (registro.melhor_valor, registro.melhor_usuario, registro.quantidade) == (10, 'u1', 1)
+    assert ms_lance.validar_lance(dict(lance)) is None
+    ms_lance.diario.con.close()
@@ -0,0 +1,106 @@
+import os
+import time
+
+os.environ.setdefault('LEILAO_SNAPSHOT_URL', '')
+
+import pytest
+
+import ms_leilao
+from agendador import Agendador
+from catalogo_leiloes import CatalogoLeiloes
+
+
+@pytest.fixture
+def cliente(monkeypatch):
+    monkeypatch.setattr(ms_leilao, 'leiloes', CatalogoLeiloes())
+    monkeypatch.setattr(ms_leilao, 'agendador', Agendador())
+    monkeypatch.setattr(ms_leilao, 'diario', None)
+    return ms_leilao.app.test_client()
+
+
+def leilao(**campos):
+    return {'nome': 'teste', 'inicio': '2099-01-01 10:00:00', 'fim': '2099-01-01 11:00:00', **campos}
+
+
+def test_post_sem_id_e_recusado_com_400(cliente):
+    for _ in range(2):
+        resposta = cliente.post('/leiloes', json=leilao())
+        assert resposta.status_code == 400
+        assert 'id' in resposta.get_json()['error']
+    assert len(ms_leilao.leiloes) == 0
+
+
+def test_post_com_id_repetido_e_recusado_com_409(cliente):
+    assert cliente.post('/leiloes', json=leilao(id=1)).status_code == 201
+    assert cliente.post('/leiloes', json=leilao(id=1, nome='outro')).status_code == 409
+    assert ms_leilao.leiloes.obter(1)['nome'] == 'teste'
+    # Início e fim do primeiro cadastro, nada do segundo
+    assert ms_leilao.agendador.pendentes() == 2
+
+
+def test_post_com_datas_fora_do_formato_e_recusado_com_400(cliente):
+    resposta = cliente.post('/leiloes', json=leilao(id=1, fim='amanhã'))
+    assert resposta.status_code == 400
+    assert 1 not in ms_leilao.leiloes
+
+
+class PublicadorFalso:
+    def __init__(self):
+        self.publicadas = []
+
+    def publicar(self, exchange, routing_key, body, properties=None, **kwargs):
+        self.publicadas.append(properties.type)
+
+
+def test_eventos_agendados_que_ficaram_velhos_nao_fazem_nada(cliente, monkeypatch):
+    publicador = PublicadorFalso()
+    monkeypatch.setattr(ms_leilao, 'publicador', publicador)
+    cliente.post('/leiloes', json=leilao(id=1))
+    fim = ms_leilao.instantes(ms_leilao.leiloes.obter(1))[1]
+
+    # Fim antes do início: o leilão nunca foi ativado
+    ms_leilao.finalizar_leilao(1)
+    assert ms_leilao.leiloes.obter(1)['status'] == 'pendente'
+
+    ms_leilao.iniciar_leilao(1, fim)
+    ms_leilao.iniciar_leilao(1, fim)
+    ms_leilao.finalizar_leilao(1)
+    ms_leilao.finalizar_leilao(1)
+    ms_leilao.iniciar_leilao(1, fim)
+    ms_leilao.iniciar_leilao(2, fim)
+
+    assert ms_leilao.leiloes.obter(1)['status'] == 'encerrado'
+    assert publicador.publicadas == ['leilao_iniciado', 'leilao_finalizado']
+
+
+def test_inicio_que_chega_depois_do_fim_e_ignorado(cliente, monkeypatch):
+    publicador = PublicadorFalso()
+    monkeypatch.setattr(ms_leilao, 'publicador', publicador)
+    cliente.post('/leiloes', json=leilao(id=1))
+
+    ms_leilao.iniciar_leilao(1, time.time() - 1)
+    assert ms_leilao.leiloes.obter(1)['status'] == 'pendente'
+    assert publicador.publicadas == []
+
+
+def test_ativos_paginados_com_cursor_e_etag(cliente, monkeypatch):
+    monkeypatch.setattr(ms_leilao, 'publicador', PublicadorFalso())
+    for leilao_id in range(3):
+        cliente.post('/leiloes', json=leilao(id=leilao_id))
+        ms_leilao.iniciar_leilao(leilao_id, time.time() + 60)
+
+    primeira = cliente.get('/leiloes/ativos?limite=2')
+    assert [item['id'] for item in primeira.get_json()] == [0, 1]
+    cursor = primeira.headers['X-Proximo-Cursor']
+    segunda = cliente.get(f'/leiloes/ativos?limite=2&cursor={cursor}')
+    assert [item['id'] for item in segunda.get_json()] == [2]
+    assert 'X-Proximo-Cursor' not in segunda.headers
+
+    etag = primeira.headers['ETag']
+    assert cliente.get('/leiloes/ativos?limite=2', headers={'If-None-Match': etag}).status_code == 304
+    # Outra consulta, outra ETag
+    assert cliente.get('/leiloes/ativos', headers={'If-None-Match': etag}).status_code == 200
+
+    ms_leilao.finalizar_leilao(2)
+    depois = cliente.get('/leiloes/ativos?limite=2', headers={'If-None-Match': etag})
+    assert depois.status_code == 200 and depois.headers['ETag'] != etag
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pika
+
+import broker_memoria
+import codec
+import ms_notif
+import runtime_amqp
+
+# ms_notif sobre o broker em memória: os lances de um leilão dentro da janela
+# viram uma notificação só, com o preço mais recente, e o vencedor sai depois
+# dela, sem esperar a janela.
+
+
+def esperar(condicao, prazo=5):
+    limite = time.monotonic() + prazo
+    while time.monotonic() < limite:
+        if condicao():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def publicar(canal, routing_key, evento):
+    body, properties = codec.codificar(routing_key, evento)
+    canal.basic_publish(exchange='leilao', routing_key=routing_key, body=body, properties=properties)
+
+
+def lance(leilao_id, user_id, valor):
+    return {
+        'leilao_id': leilao_id, 'leilao_nome': f'leilão {leilao_id}', 'user_id': user_id,
+        'valor': valor, 'timestamp': codec.agora()
+    }
+
+
+def test_janela_agrupa_os_lances_e_o_vencedor_sai_depois_dela(monkeypatch):
+    broker_memoria.resetar()
+    broker_memoria.instalar()
+    monkeypatch.setattr(ms_notif, 'JANELA', 0.3)
+
+    thread = threading.Thread(target=ms_notif.consumidor.executar, daemon=True)
+    thread.start()
+    try:
+        assert ms_notif.consumidor.aguardar_conexao(5)
+
+        conexao = pika.BlockingConnection()
+        canal = conexao.channel()
+        runtime_amqp.declarar_exchanges(canal)
+        fila = canal.queue_declare(queue='', exclusive=True).method.queue
+        for leilao_id in (1, 2):
+            canal.queue_bind(exchange='notificacoes_leilao', queue=fila, routing_key=f'leilao_{leilao_id}')
+        notificacoes = []
+        canal.basic_consume(
+            queue=fila, auto_ack=True,
+            on_message_callback=lambda ch, method, properties, body: notificacoes.append(
+                codec.decodificar(body, properties)
+            )
+        )
+
+        for valor in range(10, 15):
+            publicar(canal, 'lance_validado', lance(1, f'u{valor}', valor))
+        for valor in (20, 21):
+            publicar(canal, 'lance_validado', lance(2, f'u{valor}', valor))
+
+        # Dentro da janela nada foi publicado nem confirmado
+        conexao.process_data_events(time_limit=0.1)
+        assert notificacoes == []
+        assert broker_memoria.broker.profundidade('lance_validado') == 0
+
+        publicar(canal, 'leilao_vencedor', {
+            'leilao_id': 1, 'leilao_nome': 'leilão 1', 'vencedor_id': 'u14', 'valor_final': 14,
+            'timestamp': codec.agora()
+        })
+        limite = time.monotonic() + 5
+        while len(notificacoes) < 3 and time.monotonic() < limite:
+            conexao.process_data_events(time_limit=0.05)
+        conexao.process_data_events(time_limit=0.4)
+        conexao.close()
+    finally:
+        ms_notif.consumidor.parar()
+        thread.join(5)
+
+    resumo = [
+        (notificacao['tipo'], notificacao['leilao_id'], notificacao.get('valor', notificacao.get('valor_final')),
+         notificacao.get('lances_agrupados'))
+        for notificacao in notificacoes
+    ]
+    assert resumo == [
+        ('novo_lance', 1, 14, 5), ('novo_lance', 2, 21, 2), ('leilao_vencedor', 1, 14, None)
+    ]
+    assert ms_notif.lote.estatisticas()['entregas'] == 8
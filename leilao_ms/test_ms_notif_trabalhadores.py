@@ -0,0 +1,117 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pika
+
+import broker_memoria
+import codec
+import ms_notif
+import runtime_amqp
+from particionamento import nome_particao, particao_do_leilao
+
+# ms_notif como supervisor (NOTIF_TRABALHADORES > 1) sobre o broker em
+# memória: cada mensagem vai para a fila do trabalhador dono do leilão, na
+# ordem em que chegou, e trabalhador que cai é reiniciado.
+TRABALHADORES = 3
+# Um leilão para cada trabalhador
+LEILOES = (0, 2, 7)
+
+
+def esperar(condicao, prazo=5):
+    limite = time.monotonic() + prazo
+    while time.monotonic() < limite:
+        if condicao():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_supervisor_encaminha_para_a_fila_do_dono_do_leilao(monkeypatch):
+    broker_memoria.resetar()
+    broker_memoria.instalar()
+    monkeypatch.setattr(ms_notif, 'TRABALHADORES', TRABALHADORES)
+    monkeypatch.setattr(ms_notif, 'trabalhador', None)
+    monkeypatch.setattr(ms_notif, 'processos', {})
+
+    thread = threading.Thread(target=ms_notif.consumidor.executar, daemon=True)
+    thread.start()
+    try:
+        assert ms_notif.consumidor.aguardar_conexao(5)
+
+        conexao = pika.BlockingConnection()
+        canal = conexao.channel()
+        runtime_amqp.declarar_exchanges(canal)
+        enviados = []
+        for numero in range(12):
+            leilao_id = LEILOES[numero % 3]
+            evento = {
+                'leilao_id': leilao_id, 'leilao_nome': 'x', 'user_id': f'u{numero}', 'valor': numero,
+                'timestamp': codec.agora()
+            }
+            body, properties = codec.codificar('lance_validado', evento)
+            canal.basic_publish(exchange='leilao', routing_key='lance_validado', body=body, properties=properties)
+            enviados.append(evento)
+        vencedor = {'leilao_id': 2, 'leilao_nome': 'x', 'vencedor_id': 'u10', 'valor_final': 10, 'timestamp': codec.agora()}
+        body, properties = codec.codificar('leilao_vencedor', vencedor)
+        canal.basic_publish(exchange='leilao', routing_key='leilao_vencedor', body=body, properties=properties)
+
+        filas = {
+            (base, numero): nome_particao(base, numero) for base in ms_notif.FILAS for numero in range(TRABALHADORES)
+        }
+        assert esperar(lambda: sum(broker_memoria.broker.profundidade(fila) for fila in filas.values()) == 13)
+        assert broker_memoria.broker.profundidade('lance_validado') == 0
+
+        recebidas = {chave: [] for chave in filas}
+        for chave, fila in filas.items():
+            canal.basic_consume(
+                queue=fila, auto_ack=True,
+                on_message_callback=lambda ch, method, properties, body, chave=chave: recebidas[chave].append(
+                    codec.decodificar(body, properties)
+                )
+            )
+        conexao.process_data_events(time_limit=0.2)
+        conexao.close()
+    finally:
+        ms_notif.consumidor.parar()
+        thread.join(5)
+
+    for numero in range(TRABALHADORES):
+        assert len(recebidas['lance_validado', numero]) == 4
+        assert recebidas['lance_validado', numero] == [
+            evento for evento in enviados if particao_do_leilao(evento['leilao_id'], TRABALHADORES) == numero
+        ]
+    dono = particao_do_leilao(2, TRABALHADORES)
+    assert recebidas['leilao_vencedor', dono] == [vencedor]
+
+
+def test_trabalhador_consome_so_as_proprias_filas(monkeypatch):
+    assert ms_notif.fila_do_trabalhador('lance_validado') == 'lance_validado'
+    monkeypatch.setattr(ms_notif, 'trabalhador', 2)
+    assert ms_notif.fila_do_trabalhador('lance_validado') == 'lance_validado.p2'
+
+
+def test_trabalhador_que_caiu_e_reiniciado(monkeypatch):
+    timers = []
+    iniciados = []
+    processos = {
+        0: SimpleNamespace(exitcode=None), 1: SimpleNamespace(exitcode=1), 2: SimpleNamespace(exitcode=0)
+    }
+    monkeypatch.setattr(ms_notif, 'processos', processos)
+    monkeypatch.setattr(ms_notif, 'running', True)
+    monkeypatch.setattr(ms_notif, 'connection', SimpleNamespace(call_later=lambda atraso, callback: timers.append(atraso)))
+
+    def iniciar_trabalhador(numero, resultados):
+        iniciados.append(numero)
+        return SimpleNamespace(exitcode=None)
+
+    monkeypatch.setattr(ms_notif, 'iniciar_trabalhador', iniciar_trabalhador)
+    ms_notif.verificar_trabalhadores()
+    # Só o que saiu com erro; o que parou normalmente fica parado
+    assert iniciados == [1] and timers == [1]
+    assert processos[1].exitcode is None
+
+    monkeypatch.setattr(ms_notif, 'running', False)
+    processos[0].exitcode = -15
+    ms_notif.verificar_trabalhadores()
+    assert iniciados == [1]
@@ -0,0 +1,123 @@
+from types import SimpleNamespace
+
+import pytest
+
+import codec
+import ms_pagamento
+
+# Pagamento de um vencedor com o sistema de pagamento, o publicador e o canal
+# falsos: retentativas com backoff, DLQ, idempotência e devolução da entrega.
+
+
+class SessaoFalsa:
+    def __init__(self, *status):
+        self.status = list(status)
+        self.chamadas = []
+
+    def post(self, url, json, headers, timeout):
+        self.chamadas.append(headers['Idempotency-Key'])
+        status = self.status.pop(0)
+        corpo = {'transacao_id': 't-1', 'link_pagamento': 'https://pagar/t-1'}
+        return SimpleNamespace(status_code=status, json=lambda: corpo)
+
+
+class PublicadorFalso:
+    def __init__(self, falhar=False):
+        self.falhar = falhar
+        self.publicadas = []
+
+    def publicar(self, exchange, routing_key, body, properties=None, aguardar=False):
+        if self.falhar:
+            raise TimeoutError('publicação não confirmada')
+        self.publicadas.append((routing_key, codec.decodificar(body, properties)))
+
+
+class CanalFalso:
+    is_open = True
+
+    def __init__(self):
+        self.respostas = []
+
+    def basic_ack(self, delivery_tag):
+        self.respostas.append(('ack', delivery_tag))
+
+    def basic_nack(self, delivery_tag, requeue):
+        self.respostas.append(('nack', delivery_tag, requeue))
+
+
+class ConexaoFalsa:
+    def add_callback_threadsafe(self, callback):
+        callback()
+
+
+VENCEDOR = {'leilao_id': 7, 'vencedor_id': 'u1', 'valor_final': 100}
+
+
+@pytest.fixture
+def ambiente(monkeypatch):
+    esperas = []
+    monkeypatch.setattr(ms_pagamento, 'time', SimpleNamespace(sleep=esperas.append))
+    monkeypatch.setattr(ms_pagamento, 'BACKOFF_INICIAL', 0.5)
+    monkeypatch.setattr(ms_pagamento, 'TENTATIVAS', 3)
+    monkeypatch.setattr(ms_pagamento, 'transacoes', {})
+    monkeypatch.setattr(ms_pagamento, 'em_andamento', set())
+    monkeypatch.setattr(ms_pagamento, 'diario', None)
+    publicador = PublicadorFalso()
+    monkeypatch.setattr(ms_pagamento, 'publicador', publicador)
+
+    def usar_sessao(sessao):
+        monkeypatch.setattr(ms_pagamento, 'sessao_http', lambda: sessao)
+        return sessao
+
+    return SimpleNamespace(esperas=esperas, publicador=publicador, usar_sessao=usar_sessao)
+
+
+def test_falha_temporaria_e_repetida_com_backoff(ambiente):
+    sessao = ambiente.usar_sessao(SessaoFalsa(503, 429, 201))
+    ms_pagamento.pagar_vencedor(VENCEDOR)
+
+    assert sessao.chamadas == ['7', '7', '7']
+    assert ambiente.esperas == [0.5, 1.0]
+    assert [routing_key for routing_key, _ in ambiente.publicador.publicadas] == ['link_pagamento']
+    assert ms_pagamento.transacoes[7]['link'] == 'https://pagar/t-1'
+
+
+def test_recusa_definitiva_vai_direto_para_a_dlq(ambiente):
+    ambiente.usar_sessao(SessaoFalsa(400))
+    ms_pagamento.pagar_vencedor(VENCEDOR)
+
+    [(routing_key, evento)] = ambiente.publicador.publicadas
+    assert routing_key == ms_pagamento.FILA_DLQ
+    assert evento['tentativas'] == 1 and evento['evento'] == VENCEDOR
+    assert ambiente.esperas == [] and ms_pagamento.transacoes == {}
+
+
+def test_tentativas_esgotadas_vao_para_a_dlq(ambiente):
+    ambiente.usar_sessao(SessaoFalsa(500, 500, 500))
+    ms_pagamento.pagar_vencedor(VENCEDOR)
+
+    [(routing_key, evento)] = ambiente.publicador.publicadas
+    assert routing_key == ms_pagamento.FILA_DLQ and evento['tentativas'] == 3
+    assert ambiente.esperas == [0.5, 1.0]
+
+
+def test_vencedor_repetido_e_confirmado_sem_nova_cobranca(ambiente, monkeypatch):
+    ms_pagamento.transacoes[7] = {'leilao_id': 7}
+    enviados = []
+    monkeypatch.setattr(ms_pagamento, 'pool', SimpleNamespace(submit=lambda *args: enviados.append(args)))
+    canal = CanalFalso()
+    body, properties = codec.codificar('leilao_vencedor', {**VENCEDOR, 'leilao_nome': 'x', 'timestamp': codec.agora()})
+
+    ms_pagamento.callback_leilao_vencedor(canal, SimpleNamespace(delivery_tag=3), properties, body)
+    assert canal.respostas == [('ack', 3)] and enviados == []
+
+
+def test_link_nao_publicado_devolve_a_entrega_sem_registrar_a_transacao(ambiente, monkeypatch):
+    ambiente.usar_sessao(SessaoFalsa(201))
+    ambiente.publicador.falhar = True
+    ms_pagamento.em_andamento.add(7)
+    canal = CanalFalso()
+
+    ms_pagamento.processar_vencedor(VENCEDOR, (ConexaoFalsa(), canal, 5))
+    assert canal.respostas == [('nack', 5, True)]
+    assert ms_pagamento.transacoes == {} and ms_pagamento.em_andamento == set()
@@ -0,0 +1,99 @@
+import collections
+import time
+
+import pika
+
+import broker_memoria
+import codec
+import runtime_amqp
+from lote_confirmacao import LoteConfirmacao
+from particionamento import (
+    particao_do_leilao, nome_particao, declarar_filas_particionadas, criar_callback_roteador
+)
+
+# Roteador de partições sobre o broker em memória: a mensagem só sai da fila
+# base no tx_commit que a publica na fila da partição.
+PARTICOES = 2
+LEILOES = [1, 2, 3, 4, 5, 6] * 2
+
+
+def preparar():
+    broker_memoria.resetar()
+    broker_memoria.instalar()
+    conexao = pika.BlockingConnection()
+    canal = conexao.channel()
+    runtime_amqp.declarar_exchanges(canal)
+    canal.queue_declare(queue='lance_realizado', durable=True)
+    canal.queue_bind(exchange='leilao', queue='lance_realizado', routing_key='lance_realizado')
+    declarar_filas_particionadas(canal, 'leilao', 'lance_realizado', PARTICOES)
+    for numero, leilao_id in enumerate(LEILOES):
+        body, properties = codec.codificar('lance_realizado', {
+            'id': f'lance-{numero}', 'leilao_id': leilao_id, 'user_id': 'u1',
+            'valor': numero + 1, 'timestamp': codec.agora()
+        })
+        canal.basic_publish(exchange='leilao', routing_key='lance_realizado', body=body, properties=properties)
+    return conexao
+
+
+def iniciar_roteador(janela=0.02):
+    conexao = pika.BlockingConnection()
+    canal = conexao.channel()
+    canal.basic_qos(prefetch_count=4)
+    lote = LoteConfirmacao(conexao, canal, 100, janela, nome='roteador')
+    canal.basic_consume(
+        queue='lance_realizado',
+        on_message_callback=criar_callback_roteador('leilao', 'lance_realizado', PARTICOES, 'leilao_id', lote)
+    )
+    return conexao, canal
+
+
+def profundidades():
+    return [broker_memoria.broker.profundidade(nome_particao('lance_realizado', numero)) for numero in range(PARTICOES)]
+
+
+def rotear_tudo(conexao):
+    limite = time.monotonic() + 5
+    while sum(profundidades()) < len(LEILOES) and time.monotonic() < limite:
+        conexao.process_data_events(time_limit=0.05)
+
+
+def test_encaminha_cada_lance_para_a_particao_do_leilao():
+    preparar()
+    conexao, canal = iniciar_roteador()
+    rotear_tudo(conexao)
+
+    esperado = collections.Counter(particao_do_leilao(leilao_id, PARTICOES) for leilao_id in LEILOES)
+    assert profundidades() == [esperado[numero] for numero in range(PARTICOES)]
+    assert broker_memoria.broker.profundidade('lance_realizado') == 0
+    assert not canal.nao_confirmadas
+
+
+def test_queda_antes_do_commit_devolve_os_lances_para_a_fila_base():
+    preparar()
+    conexao, canal = iniciar_roteador(janela=60)
+    conexao.process_data_events(time_limit=0.05)
+    assert len(canal.nao_confirmadas) == 4
+
+    conexao.close()
+    assert profundidades() == [0] * PARTICOES
+    assert broker_memoria.broker.profundidade('lance_realizado') == len(LEILOES)
+
+
+def test_publicacao_que_falha_volta_para_a_fila_base():
+    preparar()
+    conexao, canal = iniciar_roteador()
+    falhas = []
+    basic_publish = canal.basic_publish
+
+    def basic_publish_com_falha(**kwargs):
+        if not falhas:
+            falhas.append(kwargs['routing_key'])
+            raise pika.exceptions.AMQPConnectionError('falha simulada')
+        basic_publish(**kwargs)
+
+    canal.basic_publish = basic_publish_com_falha
+    rotear_tudo(conexao)
+
+    assert falhas
+    assert sum(profundidades()) == len(LEILOES)
+    assert broker_memoria.broker.profundidade('lance_realizado') == 0
@@ -0,0 +1,67 @@
+import math
+import time
+
+import pytest
+
+from precos_leiloes import PrecosLeiloes
+
+
+def ids(ranking):
+    return [leilao_id for leilao_id, _, _ in ranking]
+
+
+def test_preco_e_lider_seguem_o_maior_lance():
+    precos = PrecosLeiloes()
+    precos.registrar(1, 10, 'u1')
+    precos.registrar(1, 15, 'u2')
+    # Lance menor fora de ordem conta no total mas não troca o líder
+    precos.registrar(1, 12, 'u3')
+    assert precos.obter(1) == {'ultimoLance': 15, 'lider': 'u2', 'lances': 3}
+    assert precos.obter(2) is None
+
+
+def test_ranking_pela_atividade_com_decaimento():
+    precos = PrecosLeiloes(janela=10)
+    agora = time.time()
+    for _ in range(3):
+        precos.registrar(1, 10, 'u1', instante=agora)
+    for _ in range(2):
+        precos.registrar(2, 10, 'u1', instante=agora + 5)
+    precos.registrar(3, 10, 'u1', instante=agora + 5)
+
+    ranking = precos.quentes(3, agora=agora + 5)
+    assert ids(ranking) == [2, 1, 3]
+    atividades = [atividade for _, atividade, _ in ranking]
+    assert atividades == pytest.approx([2, 3 * math.exp(-0.5), 1])
+
+    # Mais tarde a ordem não muda sem lances novos; um lance recente passa à frente
+    assert ids(precos.quentes(3, agora=agora + 100)) == [2, 1, 3]
+    precos.registrar(3, 11, 'u2', instante=agora + 20)
+    assert ids(precos.quentes(2, agora=agora + 20)) == [3, 2]
+
+
+def test_quentes_nao_consome_o_heap_e_ignora_removidos():
+    precos = PrecosLeiloes()
+    agora = time.time()
+    for leilao_id in range(5):
+        for _ in range(leilao_id + 1):
+            precos.registrar(leilao_id, 10, 'u1', instante=agora)
+
+    assert ids(precos.quentes(2, agora=agora)) == [4, 3]
+    assert ids(precos.quentes(2, agora=agora)) == [4, 3]
+    precos.remover(4)
+    assert ids(precos.quentes(10, agora=agora)) == [3, 2, 1, 0]
+    assert len(precos) == 4 and precos.obter(4) is None
+
+
+def test_heap_e_compactado_com_muitos_lances():
+    precos = PrecosLeiloes()
+    agora = time.time()
+    for indice in range(1000):
+        precos.registrar(indice % 3, indice, 'u1', instante=agora)
+    assert len(precos._heap) <= 2 * 3 + 64 + 1
+    # 334 lances contra 333 dos outros dois
+    [(leilao_id, atividade, preco)] = precos.quentes(1, agora=agora)
+    assert (leilao_id, preco['lances'], preco['ultimoLance']) == (0, 334, 999)
+    assert atividade == pytest.approx(334)
+    assert precos.versao == 1000
@@ -0,0 +1,96 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pika
+import pika.exceptions
+
+import broker_memoria
+import runtime_amqp
+from runtime_amqp import Consumidor
+
+# Consumidor do runtime_amqp sobre o broker em memória: depois de uma queda
+# ele reconecta com backoff, chama configurar de novo e recebe outra vez o
+# que tinha ficado sem ack.
+
+
+def esperar(condicao, prazo=5):
+    limite = time.monotonic() + prazo
+    while time.monotonic() < limite:
+        if condicao():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_queda_reconecta_e_reentrega_o_que_ficou_sem_ack(monkeypatch):
+    broker_memoria.resetar()
+    broker_memoria.instalar()
+    monkeypatch.setattr(runtime_amqp, 'BACKOFF_INICIAL', 0.01)
+
+    conexao = pika.BlockingConnection()
+    canal = conexao.channel()
+    canal.queue_declare(queue='eventos', durable=True)
+    for numero in range(3):
+        canal.basic_publish(exchange='', routing_key='eventos', body=f'evento-{numero}')
+
+    recebidos = []
+    configuracoes = []
+
+    def configurar(conexao, canal):
+        configuracoes.append(conexao)
+        canal.queue_declare(queue='eventos', durable=True)
+        canal.basic_qos(prefetch_count=1)
+
+        def callback(ch, method, properties, body):
+            recebidos.append(body.decode())
+            if len(recebidos) == 2:
+                # A conexão cai antes do ack do segundo evento
+                conexao.close()
+                return
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+        canal.basic_consume(queue='eventos', on_message_callback=callback)
+
+    consumidor = Consumidor(configurar, nome='teste')
+    thread = threading.Thread(target=consumidor.executar, daemon=True)
+    thread.start()
+    try:
+        assert esperar(lambda: len(recebidos) == 4)
+        assert esperar(lambda: broker_memoria.broker.profundidade('eventos') == 0)
+    finally:
+        consumidor.parar()
+        thread.join(5)
+
+    assert recebidos == ['evento-0', 'evento-1', 'evento-1', 'evento-2']
+    assert len(configuracoes) == 2 and configuracoes[0] is not configuracoes[1]
+    assert consumidor.reconexoes == 1
+    assert not thread.is_alive() and not consumidor.estado()['conectado']
+
+
+def test_broker_fora_espera_com_backoff_exponencial_limitado(monkeypatch):
+    broker_memoria.resetar()
+    monkeypatch.setattr(runtime_amqp, 'BACKOFF_INICIAL', 0.5)
+    monkeypatch.setattr(runtime_amqp, 'BACKOFF_MAXIMO', 1.5)
+    esperas = []
+    monkeypatch.setattr(runtime_amqp, 'time', SimpleNamespace(sleep=esperas.append))
+
+    tentativas = []
+
+    def conexao_instavel(parametros=None):
+        tentativas.append(parametros)
+        if len(tentativas) <= 4:
+            raise pika.exceptions.AMQPConnectionError('broker fora')
+        return broker_memoria.ConexaoMemoria(parametros)
+
+    monkeypatch.setattr(pika, 'BlockingConnection', conexao_instavel)
+
+    parado = []
+    consumidor = Consumidor(lambda conexao, canal: consumidor.parar(), nome='teste', ao_parar=lambda: parado.append(True))
+    consumidor.executar()
+
+    assert esperas == [0.5, 1.0, 1.5, 1.5]
+    assert len(tentativas) == 5
+    assert consumidor.reconexoes == 1
+    assert consumidor.estado()['ultimo_erro'] == 'broker fora'
+    assert parado == [True]
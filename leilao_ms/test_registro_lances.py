@@ -0,0 +1,53 @@
+import json
+
+from registro_lances import RegistroLances, HistoricoEmDisco
+
+
+def test_guarda_so_o_melhor_lance_e_a_contagem():
+    registro = RegistroLances()
+    for numero, valor in enumerate((10, 12, 15)):
+        registro.registrar(f'u{numero}', valor, f't{numero}')
+
+    assert (registro.melhor_valor, registro.melhor_usuario, registro.melhor_timestamp) == (15, 'u2', 't2')
+    assert registro.quantidade == 3
+    assert registro.historico is None and registro.ultimos_lances() == []
+
+
+def test_historico_em_memoria_fica_limitado_aos_ultimos_lances():
+    registro = RegistroLances(historico_maximo=2)
+    for valor in (10, 12, 15):
+        registro.registrar('u1', valor, f't{valor}')
+
+    assert registro.quantidade == 3
+    assert [lance['valor'] for lance in registro.ultimos_lances()] == [12, 15]
+
+
+def test_copia_nao_acompanha_o_original():
+    registro = RegistroLances(historico_maximo=5)
+    registro.registrar('u1', 10, 't1')
+    copia = registro.copiar()
+    registro.registrar('u2', 20, 't2')
+
+    assert (copia.melhor_valor, copia.melhor_usuario, copia.quantidade) == (10, 'u1', 1)
+    assert [lance['valor'] for lance in copia.ultimos_lances()] == [10]
+    assert copia.historico.maxlen == 5
+
+
+def test_historico_em_disco_so_grava_o_que_foi_descarregado(tmp_path):
+    caminho = tmp_path / 'historico.ndjson'
+    historico = HistoricoEmDisco(str(caminho))
+
+    historico.gravar(1, 'u1', 10, 't1')
+    historico.descarregar()
+    historico.gravar(1, 'u2', 11, 't2')
+    historico.descartar()
+    historico.gravar(1, 'u3', 12, 't3')
+    historico.gravar_fechamento(1, 123.0, 'u3', 12)
+    historico.fechar()
+
+    linhas = [json.loads(linha) for linha in caminho.read_text(encoding='utf-8').splitlines()]
+    assert linhas == [
+        {'leilao_id': 1, 'user_id': 'u1', 'valor': 10, 'timestamp': 't1'},
+        {'leilao_id': 1, 'user_id': 'u3', 'valor': 12, 'timestamp': 't3'},
+        {'leilao_id': 1, 'fim': 123.0, 'vencedor_id': 'u3', 'valor_final': 12},
+    ]
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+import runtime_async
+from runtime_async import PublicadorAsync
+
+# PublicadorAsync com um canal falso: o que vem de threads fora do loop sai
+# em ordem e é repetido enquanto o broker estiver fora.
+
+
+class ExchangeFalsa:
+    def __init__(self, broker, nome):
+        self.broker = broker
+        self.nome = nome
+
+    async def publish(self, mensagem, routing_key):
+        if self.broker.fora:
+            self.broker.fora -= 1
+            raise ConnectionError('broker fora')
+        self.broker.publicadas.append((self.nome, routing_key, mensagem.body))
+
+
+class BrokerFalso:
+    def __init__(self, fora=0):
+        self.fora = fora
+        self.publicadas = []
+        self.is_closed = False
+
+    async def channel(self, publisher_confirms=False):
+        return self
+
+    async def declare_exchange(self, nome, tipo, durable=False):
+        return ExchangeFalsa(self, nome)
+
+
+async def publicar_de_outra_thread(publicador, *chamadas):
+    loop = asyncio.get_running_loop()
+    for kwargs in chamadas:
+        await loop.run_in_executor(None, lambda: publicador.publicar(**kwargs))
+
+
+async def aguardar_publicacoes(broker, quantidade):
+    for _ in range(200):
+        if len(broker.publicadas) >= quantidade:
+            return
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture(autouse=True)
+def backoff_curto(monkeypatch):
+    monkeypatch.setattr(runtime_async, 'BACKOFF_INICIAL', 0.01)
+
+
+def test_publicacao_que_falha_e_repetida_na_ordem():
+    async def cenario():
+        broker = BrokerFalso(fora=3)
+        publicador = PublicadorAsync(nome='teste')
+        await publicador.conectar(broker)
+        await publicar_de_outra_thread(
+            publicador,
+            dict(exchange='leilao_iniciado', routing_key='', body=b'iniciado'),
+            dict(exchange='leilao', routing_key='leilao_finalizado', body=b'finalizado')
+        )
+        await aguardar_publicacoes(broker, 2)
+        estado = publicador.estado()
+        publicador.parar()
+        return broker, estado
+
+    broker, estado = asyncio.run(cenario())
+    assert broker.publicadas == [
+        ('leilao_iniciado', '', b'iniciado'), ('leilao', 'leilao_finalizado', b'finalizado')
+    ]
+    assert estado['pendentes'] == 0 and estado['ultimo_erro'] == 'broker fora'
+
+
+def test_tempo_limite_estourado_retira_a_mensagem():
+    async def cenario():
+        broker = BrokerFalso(fora=10 ** 6)
+        publicador = PublicadorAsync(nome='teste')
+        await publicador.conectar(broker)
+        loop = asyncio.get_running_loop()
+        with pytest.raises(TimeoutError):
+            await loop.run_in_executor(None, lambda: publicador.publicar(
+                exchange='leilao', routing_key='leilao_finalizado', body=b'retirada',
+                aguardar=True, tempo_limite=0.05
+            ))
+        broker.fora = 0
+        await publicar_de_outra_thread(publicador, dict(exchange='leilao', routing_key='leilao_finalizado', body=b'nova'))
+        await aguardar_publicacoes(broker, 1)
+        await asyncio.sleep(0.05)
+        publicador.parar()
+        return broker
+
+    broker = asyncio.run(cenario())
+    assert broker.publicadas == [('leilao', 'leilao_finalizado', b'nova')]
@@ -5,36 +5,49 @@ import threading, time, random, requests, uuid
 app = Flask(__name__)
 CORS(app)
 
+# Idempotency-Key -> resposta já devolvida: repetir a chamada não cria outra transação
+transacoes_por_chave = {}
+lock_transacoes = threading.Lock()
+
 
 @app.route("/criar_transacao", methods=["POST"])
 def criar_transacao():
 
     dados = request.json or {}
-    transacao_id = str(uuid.uuid4())
+    chave = request.headers.get("Idempotency-Key")
+    with lock_transacoes:
+        if chave and chave in transacoes_por_chave:
+            return jsonify(transacoes_por_chave[chave]), 200
+
+        transacao_id = str(uuid.uuid4())
+        resposta = {
+            "transacao_id": transacao_id,
+            "link_pagamento": f"http://localhost:7000/pagar/{transacao_id}"
+        }
+        if chave:
+            transacoes_por_chave[chave] = resposta
+
     valor = dados.get("valor", 0)
     vencedor_id = dados.get("vencedor_id", "desconhecido")
     webhook_url = dados.get("webhook_url", "")
-
-    link_pagamento = f"http://localhost:7000/pagar/{transacao_id}"
+    leilao_id = dados.get("leilao_id")
 
     threading.Thread(
         target=simular_pagamento,
-        args=(transacao_id, valor, vencedor_id, webhook_url),
+        args=(transacao_id, leilao_id, valor, vencedor_id, webhook_url),
         daemon=True
     ).start()
 
-    return jsonify({
-        "transacao_id": transacao_id,
-        "link_pagamento": link_pagamento
-    }), 201
+    return jsonify(resposta), 201
 
 
-def simular_pagamento(transacao_id, valor, vencedor_id, webhook_url):
+def simular_pagamento(transacao_id, leilao_id, valor, vencedor_id, webhook_url):
 
     status = random.choice(["aprovado", "recusado"])
 
     payload = {
         "transacao_id": transacao_id,
+        "leilao_id": leilao_id,
         "status": status,
         "valor": valor,
         "comprador": {